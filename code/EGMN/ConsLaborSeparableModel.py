@@ -14,15 +14,17 @@ from HARK.ConsumptionSaving.ConsPortfolioModel import (
 from HARK.core import make_one_period_oo_solver
 from HARK.distribution import DiscreteDistribution, calc_expectation
 from HARK.interpolation import (
+    ConstantFunction,
+    IdentityFunction,
     LinearFast,
     LinearInterp,
-    LinearInterpOnInterp1D,
     MargValueFuncCRRA,
     ValueFuncCRRA,
 )
 from HARK.metric import MetricObject
 from HARK.rewards import UtilityFuncCRRA, UtilityFuncStoneGeary
 from HARK.utilities import NullFunc
+from interpolators import ClippedInterp, WarpedInterpOnInterp1D
 from utilities import interp_on_interp
 
 
@@ -118,8 +120,7 @@ class LaborSeparableConsumerType(LaborIntMargConsumerType):
 
         # consumption stage
 
-        def c_func_cs(m):
-            return m  # consume all cash in terminal period
+        c_func_cs = IdentityFunction()  # consume all cash in terminal period
 
         v_func_cs = ValueFuncCRRA(c_func_cs, self.CRRA)
         vp_func_cs = MargValueFuncCRRA(c_func_cs, self.CRRA)
@@ -191,10 +192,8 @@ class LaborSeparableConsumerType(LaborIntMargConsumerType):
 
         labor_func_unc = interp_on_interp(labor_mat, [bnrm_mat, tshk_mat])
 
-        self.leisure_func_terminal = lambda b, t: np.clip(
-            leisure_func_unc(b, t), 0.0, 1.0
-        )
-        self.labor_func_terminal = lambda b, t: np.clip(labor_func_unc(b, t), 0.0, 1.0)
+        self.leisure_func_terminal = ClippedInterp(leisure_func_unc, 0.0, 1.0)
+        self.labor_func_terminal = ClippedInterp(labor_func_unc, 0.0, 1.0)
 
         # now use same grid as mnrmat and tshkmat
         bnrm_mat = mnrm_mat
@@ -343,8 +342,8 @@ class LaborSeparableSolver:
 
         lsrFunc = interp_on_interp(lsrmat, [bnrmat, tshkmat])
         lbrFunc = interp_on_interp(lbrmat, [bnrmat, tshkmat])
-        leisure_func = lambda b, t: np.clip(lsrFunc(b, t), 0.0, 1.0)
-        labor_func = lambda b, t: np.clip(lbrFunc(b, t), 0.0, 1.0)
+        leisure_func = ClippedInterp(lsrFunc, 0.0, 1.0)
+        labor_func = ClippedInterp(lbrFunc, 0.0, 1.0)
 
         bmat = mnrmat
 
@@ -464,21 +463,21 @@ class LaborPortfolioConsumerType(PortfolioConsumerType, LaborIntMargConsumerType
     def update_solution_terminal(self):
         # in the terminal period the risky share is trivially 0 since there is
         # no continuation; agents consume all resources and save nothing
-        portfolio_stage = PortfolioStage(share_func=lambda a: a * 0.0)
+        portfolio_stage = PortfolioStage(share_func=ConstantFunction(0.0))
 
         # in terminal period agents consume everything
 
         util = UtilityFuncCRRA(self.CRRA)
         consumption_stage = ConsumptionSavingStage(
-            c_func=lambda m: m, v_func=util, vp_func=util.der
+            c_func=IdentityFunction(), v_func=util, vp_func=util.der
         )
 
         # in terminal period agents do not work, and so b = m
         # and marginal value is the same as in consumption stage
         labor_stage = LaborLeisureStage(
-            labor_func=lambda b, theta: b * 0.0,
-            v_func=lambda b, theta: util(b),
-            vp_func=lambda b, theta: util.der(b),
+            labor_func=ConstantFunction(0.0),
+            v_func=ValueFuncCRRA(IdentityFunction(n_dims=2), self.CRRA),
+            vp_func=MargValueFuncCRRA(IdentityFunction(n_dims=2), self.CRRA),
         )
 
         # create terminal solution object
@@ -715,14 +714,8 @@ class LaborPortfolioSolver(MetricObject):
             "leisure": leisureEndogMat,
         }
 
-        leisure_unconstrained_func_by_tShk = []
-        for i in range(self.TranShkGrid.size):
-            leisure_unconstrained_func_by_tShk.append(
-                LinearFast(leisureEndogMat[:, i], [bNrmEndogMat[:, i]])
-            )
-
-        leisure_unconstrained_func = LinearInterpOnInterp1D(
-            leisure_unconstrained_func_by_tShk, self.TranShkGrid
+        leisure_unconstrained_func = WarpedInterpOnInterp1D(
+            leisureEndogMat, bNrmEndogMat, self.TranShkGrid
         )
 
         # Now use exogenous self.bNrmMat and self.TranShkMat_b
@@ -1,6 +1,6 @@
 from collections import namedtuple
 from copy import deepcopy
-from dataclasses import dataclass
+from dataclasses import dataclass, field
 
 import estimagic as em
 import numpy as np
@@ -13,16 +13,43 @@ from HARK.ConsumptionSaving.ConsRiskyAssetModel import RiskyAssetConsumerType
 from HARK.core import make_one_period_oo_solver
 from HARK.distribution import DiscreteDistribution, DiscreteDistributionLabeled
 from HARK.interpolation import (
+    ConstantFunction,
+    IdentityFunction,
     LinearFast,
-    LinearInterpOnInterp1D,
     MargValueFuncCRRA,
     ValueFuncCRRA,
 )
-from HARK.interpolation._sklearn import GeneralizedRegressionUnstructuredInterp
 from HARK.metric import MetricObject
 from HARK.rewards import UtilityFuncCRRA, UtilityFunction
 from HARK.utilities import NullFunc, construct_assets_grid
-from scipy.optimize import Bounds, LinearConstraint, minimize
+from interpolators import (
+    ComposedSumInterp,
+    MultiFuncCRRA,
+    WarpedBilinearInterp,
+    WarpedInterpOnInterp1D,
+    bilinear_coords,
+    bilinear_eval,
+    bilinear_matrix,
+)
+from numba_backend import deposit_envelope
+from numba_backend import deposit_stage as deposit_stage_numba
+from numba_backend import post_decision as post_decision_numba
+from regression import (
+    GaussianProcessInterp,
+    KroneckerWarpedInterp,
+    make_unstructured_interp,
+)
+from scipy import sparse
+from simulation import (
+    draw_atoms,
+    mask_dead,
+    newborns,
+    panel_periods,
+    pension_transition,
+    period_solution,
+    simulate_panel,
+)
+from utilities import map_blocks, maximize_deposit, maximize_simplex, solve_foc
 
 
 @dataclass
@@ -38,6 +65,8 @@ class ConsumptionStage(MetricObject):
     v_func: ValueFuncCRRA = NullFunc()
     dvdl_func: MargValueFuncCRRA = NullFunc()
     dvdb_func: MargValueFuncCRRA = NullFunc()
+    # c, dvdl, dvdb and v from a single search of the shared knots
+    multi_func: MultiFuncCRRA = NullFunc()
 
 
 @dataclass
@@ -69,6 +98,26 @@ class PensionConsumerType(RiskyAssetConsumerType):
         "IncUnempRet",
         "TasteShkStd",
         "TaxDeduct",
+        "ExpChunkSize",
+        "Backend",
+        "VFIMode",
+        "VFIWorkers",
+        "VFIPool",
+        "VFIBlockSize",
+        "VFIGridCount",
+        "VFITol",
+        "VFIWarmStart",
+        "SolveMethod",
+        "DepositInterp",
+        "DepositInterpKwargs",
+        "GPKernelMode",
+        "DepositInversion",
+        "KroneckerKwargs",
+        "GPIncremental",
+        "AdaptiveTol",
+        "AdaptiveStride",
+        "AdaptiveBatch",
+        "AdaptiveMaxIter",
     ]
 
     def __init__(self, **kwds):
@@ -87,23 +136,17 @@ class PensionConsumerType(RiskyAssetConsumerType):
         self.update_grids()
         RiskyAssetConsumerType.update(self)
         self.update_distributions()
+        self.update_exp_matrices()
 
     def update_solution_terminal(self):
         # consume everything in terminal period
-        def c_func(mNrm, nNrm):
-            return mNrm + nNrm
+        c_func = ComposedSumInterp(IdentityFunction())
 
         # deposit nothing in terminal period
-        def d_func(mNrm, nNrm):
-            return 0.0
-
-        u = UtilityFuncCRRA(self.CRRA)
-
-        def v_func(mNrm, nNrm):
-            return u(c_func(mNrm, nNrm))
+        d_func = ConstantFunction(0.0)
 
-        def vp_func(mNrm, nNrm):
-            return u.der(c_func(mNrm, nNrm))
+        v_func = ValueFuncCRRA(c_func, self.CRRA)
+        vp_func = MargValueFuncCRRA(c_func, self.CRRA)
 
         consumption_stage = ConsumptionStage(
             c_func=c_func, v_func=v_func, dvdl_func=vp_func, dvdb_func=vp_func
@@ -112,6 +155,15 @@ class PensionConsumerType(RiskyAssetConsumerType):
         deposit_stage = DepositStage(
             d_func=d_func, v_func=v_func, dvdm_func=vp_func, dvdn_func=vp_func
         )
+        # consumption is linear in (m, n) so it is exact on the nodes
+        mGrid_temp = np.append(0.0, self.mGrid)
+        cMat_temp = mGrid_temp[:, None] + self.nGrid
+        deposit_stage.nodes = {
+            "grids": [mGrid_temp, self.nGrid],
+            "dvdm_nvrs": cMat_temp,
+            "dvdn_nvrs": cMat_temp,
+            "v_nvrs": cMat_temp,
+        }
 
         self.solution_terminal = PensionSolution(
             deposit_stage=deposit_stage,
@@ -182,6 +234,48 @@ class PensionConsumerType(RiskyAssetConsumerType):
 
         self.ShockDstn = ShockDstn
 
+    def update_exp_matrices(self):
+        # grids and shocks are time invariant within each distribution, so the
+        # next period (m, n) states of every (shock, a, b) point always land on
+        # the same cells of the common grid; precompute the sparse bilinear
+        # interpolation matrix once per distinct shock distribution
+        grids = [np.append(0.0, self.mGrid), self.nGrid]
+
+        ExpMatrix = []
+        for t, dstn in enumerate(self.ShockDstn):
+            for t_prev in range(t):
+                if np.array_equal(dstn.atoms, self.ShockDstn[t_prev].atoms):
+                    ExpMatrix.append(ExpMatrix[t_prev])
+                    break
+            else:
+                psi, theta, risky = np.atleast_2d(dstn.atoms)[..., None, None]
+                mNrm_next = self.aMat * self.Rfree / psi + theta
+                nNrm_next = self.bMat * risky / psi
+                ExpMatrix.append(bilinear_matrix(grids, mNrm_next, nNrm_next))
+
+        self.ExpMatrix = ExpMatrix
+        self.add_to_time_vary("ExpMatrix")
+
+    def initialize_panel(self, size, rng):
+        return newborns(self, size, rng, self.Rfree)
+
+    def panel_transition(self, t, state, rng):
+        # same deposit function g as the solver
+        return pension_transition(self, t, state, rng, (self.TaxDeduct, 1.0, 1.0))
+
+    def simulate_panel(self, agents=None, periods=None, seed=0, directory=None):
+        """
+        Simulate a panel of agents with the solved policies, see
+        `simulation.simulate_panel`. Defaults to AgentCount agents over the
+        agents' life, or T_sim periods if it is infinite.
+        """
+        agents = self.AgentCount if agents is None else agents
+        periods = panel_periods(self) if periods is None else periods
+
+        return simulate_panel(
+            self, agents, periods, self.PanelChunkSize, seed, directory
+        )
+
 
 @dataclass
 class PensionSolver(MetricObject):
@@ -207,9 +301,32 @@ class PensionSolver(MetricObject):
     blGrid: np.array
     lMat: np.ndarray
     blMat: np.array
+    ExpChunkSize: int = 2_000_000
+    ExpMatrix: sparse.csr_matrix = None
+    Backend: str = "hark"
+    VFIMode: str = "joint"
+    VFIWorkers: int = 6
+    VFIPool: str = "process"
+    VFIBlockSize: int = 500
+    VFIGridCount: int = 20
+    VFITol: float = 1e-8
+    VFIWarmStart: str = "none"
+    SolveMethod: str = "egm"
+    DepositInterp: str = "gaussian-process"
+    DepositInterpKwargs: dict = field(default_factory=dict)
+    GPKernelMode: str = "refit"
+    DepositInversion: str = "regression"
+    KroneckerKwargs: dict = field(default_factory=dict)
+    GPIncremental: bool = False
+    AdaptiveTol: float = 1e-3
+    AdaptiveStride: int = 4
+    AdaptiveBatch: int = 100
+    AdaptiveMaxIter: int = 10
 
     def __post_init__(self):
         self.def_utility_funcs()
+        self.gp_kernels = {}
+        self.adaptive_stats = None
 
     def def_utility_funcs(self):
         self.u = UtilityFuncCRRA(self.CRRA)
@@ -227,87 +344,136 @@ class PensionSolver(MetricObject):
             return self.TaxDeduct / x - 1
 
         self.g = UtilityFunction(g, gp, gp_inv)
+        # (factor, CRRA, shifter) of g as a Stone-Geary function
+        self.g_params = (self.TaxDeduct, 1.0, 1.0)
 
-    def solve_post_decision(self, deposit_stage_next):
+    def calc_end_of_prd_expectations(self, deposit_stage_next):
         """
-        Should use aMat and bMat.
+        Compute end of period value and marginal values in a single pass.
+
+        All shock atoms are evaluated at once as a broadcast batch of shape
+        (atoms, a, b), split into chunks of at most `ExpChunkSize` points to
+        keep memory bounded. If next period's deposit stage carries its nodal
+        values, the bracketing search on the (m, n) grid is done once and
+        shared by v, dvdm and dvdn; with a precomputed `ExpMatrix` the search
+        is skipped entirely and interpolation becomes a sparse mat-vec. With
+        the numba backend, the whole expectation runs as a compiled kernel.
 
         Parameters
         ----------
-        deposit_stage_next : _type_
-            _description_
+        deposit_stage_next : DepositStage
+            Next period's deposit stage solution.
 
         Returns
         -------
-        _type_
-            _description_
+        tuple of np.ndarray
+            End of period v, dvda and dvdb on the (aMat, bMat) grid.
         """
-        # unpack next period's solution
-        dvdm_func_next = deposit_stage_next.dvdm_func
-        dvdn_func_next = deposit_stage_next.dvdn_func
-        v_func_next = deposit_stage_next.v_func
-
-        def value_and_marginal_funcs(shock, aBal, bBal):
-            variables = {}
-
-            psi = shock["perm"]
-            mNrm_next = aBal * self.Rfree / psi + shock["tran"]
-            nNrm_next = bBal * shock["risky"] / psi
-
-            variables["dvda"] = (
-                self.DiscFac
-                * self.Rfree
-                * psi ** (-self.CRRA)
-                * dvdm_func_next(mNrm_next, nNrm_next)
+        psi, theta, risky = np.atleast_2d(self.ShockDstn.atoms)
+        prbs = self.ShockDstn.pmv
+
+        nodes = getattr(deposit_stage_next, "nodes", None)
+        if nodes is not None and self.Backend == "numba":
+            nodal_values = np.stack(
+                [nodes["v_nvrs"], nodes["dvdm_nvrs"], nodes["dvdn_nvrs"]], axis=0
             )
-            variables["dvdb"] = (
-                self.DiscFac
-                * psi ** (-self.CRRA)
-                * shock["risky"]
-                * dvdn_func_next(mNrm_next, nNrm_next)
+            return post_decision_numba(
+                self.aGrid,
+                self.bGrid,
+                psi,
+                theta,
+                risky,
+                prbs,
+                self.Rfree,
+                *nodes["grids"],
+                nodal_values,
+                self.CRRA,
+                self.DiscFac,
+            )
+
+        if nodes is not None:
+            nodal_values = np.stack(
+                [nodes["v_nvrs"], nodes["dvdm_nvrs"], nodes["dvdn_nvrs"]], axis=0
             )
-            variables["v"] = (
-                self.DiscFac
-                * psi ** (1 - self.CRRA)
-                * v_func_next(mNrm_next, nNrm_next)
+            use_matrix = (
+                self.ExpMatrix is not None
+                and self.ExpMatrix.shape[1] == nodal_values[0].size
             )
+            if use_matrix:
+                nodal_values = nodal_values.reshape(3, -1).T
+
+        v_end = np.zeros_like(self.aMat)
+        dvda_end = np.zeros_like(self.aMat)
+        dvdb_end = np.zeros_like(self.aMat)
+
+        chunk = max(1, self.ExpChunkSize // self.aMat.size)
+        for start in range(0, prbs.size, chunk):
+            idx = slice(start, start + chunk)
+            psi_c = psi[idx, None, None]
+            risky_c = risky[idx, None, None]
+            prbs_c = prbs[idx, None, None]
+
+            mNrm_next = self.aMat * self.Rfree / psi_c + theta[idx, None, None]
+            nNrm_next = self.bMat * risky_c / psi_c
+
+            if nodes is not None:
+                if use_matrix:
+                    rows = slice(
+                        start * self.aMat.size, (start + chunk) * self.aMat.size
+                    )
+                    interp = self.ExpMatrix[rows] @ nodal_values
+                    v_nvrs, dvdm_nvrs, dvdn_nvrs = interp.T.reshape(
+                        (3,) + mNrm_next.shape
+                    )
+                else:
+                    coords = bilinear_coords(nodes["grids"], mNrm_next, nNrm_next)
+                    v_nvrs, dvdm_nvrs, dvdn_nvrs = bilinear_eval(nodal_values, coords)
+                v_next = self.u(v_nvrs)
+                dvdm_next = self.u.der(dvdm_nvrs)
+                dvdn_next = self.u.der(dvdn_nvrs)
+            else:
+                v_next = deposit_stage_next.v_func(mNrm_next, nNrm_next)
+                dvdm_next = deposit_stage_next.dvdm_func(mNrm_next, nNrm_next)
+                dvdn_next = deposit_stage_next.dvdn_func(mNrm_next, nNrm_next)
 
-            return variables
+            psi_adj = prbs_c * psi_c ** (-self.CRRA)
+            v_end += np.sum(psi_adj * psi_c * v_next, axis=0)
+            dvda_end += np.sum(psi_adj * dvdm_next, axis=0)
+            dvdb_end += np.sum(psi_adj * risky_c * dvdn_next, axis=0)
 
-        # First calculate marginal value functions
+        v_end *= self.DiscFac
+        dvda_end *= self.DiscFac * self.Rfree
+        dvdb_end *= self.DiscFac
 
-        def dvda_func(shock, aBal, bBal):
-            psi = shock["perm"]
-            mNrm_next = aBal * self.Rfree / psi + shock["tran"]
-            nNrm_next = bBal * shock["risky"] / psi
-            return psi ** (-self.CRRA) * dvdm_func_next(mNrm_next, nNrm_next)
+        return v_end, dvda_end, dvdb_end
 
-        dvda_end_of_prd = (
-            self.DiscFac
-            * self.Rfree
-            * self.ShockDstn.expected(dvda_func, self.aMat, self.bMat)
-        )
+    def solve_post_decision(self, deposit_stage_next):
+        """
+        Should use aMat and bMat.
+
+        Parameters
+        ----------
+        deposit_stage_next : _type_
+            _description_
+
+        Returns
+        -------
+        _type_
+            _description_
+        """
+        (
+            v_end_of_prd,
+            dvda_end_of_prd,
+            dvdb_end_of_prd,
+        ) = self.calc_end_of_prd_expectations(deposit_stage_next)
 
+        # First calculate marginal value functions
         dvda_end_of_prd_nvrs = self.u.derinv(dvda_end_of_prd)
         dvda_end_of_prd_nvrs_func = LinearFast(
             dvda_end_of_prd_nvrs, [self.aGrid, self.bGrid]
         )
         dvda_end_of_prd_func = MargValueFuncCRRA(dvda_end_of_prd_nvrs_func, self.CRRA)
 
-        def dvdb_func(shock, aBal, bBal):
-            psi = shock["perm"]
-            mNrm_next = aBal * self.Rfree / psi + shock["tran"]
-            nNrm_next = bBal * shock["risky"] / psi
-            return (
-                psi ** (-self.CRRA)
-                * shock["risky"]
-                * dvdn_func_next(mNrm_next, nNrm_next)
-            )
-
-        dvdb_end_of_prd = self.DiscFac * self.ShockDstn.expected(
-            dvdb_func, self.aMat, self.bMat
-        )
-
         dvdb_end_of_prd_nvrs = self.u.derinv(dvdb_end_of_prd)
         dvdb_end_of_prd_nvrs_func = LinearFast(
             dvdb_end_of_prd_nvrs, [self.aGrid, self.bGrid]
@@ -316,16 +482,6 @@ class PensionSolver(MetricObject):
 
         # also calculate end of period value function
 
-        def v_func(shock, aBal, bBal):
-            psi = shock["perm"]
-            mNrm_next = aBal * self.Rfree / psi + shock["tran"]
-            nNrm_next = bBal * shock["risky"] / psi
-            return psi ** (1 - self.CRRA) * v_func_next(mNrm_next, nNrm_next)
-
-        v_end_of_prd = self.DiscFac * self.ShockDstn.expected(
-            v_func, self.aMat, self.bMat
-        )
-
         # value transformed through inverse utility
         v_end_of_prd_nvrs = self.u.inv(v_end_of_prd)
         v_end_of_prd_nvrs_func = LinearFast(v_end_of_prd_nvrs, [self.aGrid, self.bGrid])
@@ -367,62 +523,139 @@ class PensionSolver(MetricObject):
         lMat_temp = np.insert(lMat, 0, 0.0, axis=0)
         cMat_temp = np.insert(cMat, 0, 0.0, axis=0)
 
-        # bMat is a regular grid, lMat is not so we'll need to use LinearInterpOnInterp1D
-        c_innr_func_by_bBal = []
-        for bi in range(self.bGrid.size):
-            c_innr_func_by_bBal.append(LinearFast(cMat_temp[:, bi], [lMat_temp[:, bi]]))
-
-        c_innr_func = LinearInterpOnInterp1D(c_innr_func_by_bBal, self.bGrid)
-        dvdl_innr_func = MargValueFuncCRRA(c_innr_func, self.CRRA)
-
         # again, at l = 0, c = 0 and a = 0, so repeat dvdb[0]
-        # dvdb_end_of_prd_nvrs_temp = np.insert(dvdb_end_of_prd_nvrs, 0, 0.0, axis=0)
         dvdb_end_of_prd_nvrs_temp = np.insert(
             dvdb_end_of_prd_nvrs, 0, dvdb_end_of_prd_nvrs[0], axis=0
         )
 
-        dvdb_innr_nvrs_func_by_bBal = []
-        for bi in range(self.bGrid.size):
-            dvdb_innr_nvrs_func_by_bBal.append(
-                LinearFast(dvdb_end_of_prd_nvrs_temp[:, bi], [lMat_temp[:, bi]])
-            )
-
-        dvdb_innr_func = MargValueFuncCRRA(
-            LinearInterpOnInterp1D(dvdb_innr_nvrs_func_by_bBal, self.bGrid), self.CRRA
-        )
-
         # make value function
         v_innr = self.u(cMat) + v_end_of_prd
         v_innr_nvrs = self.u.inv(v_innr)
         v_now_nvrs_temp = np.insert(v_innr_nvrs, 0, 0.0, axis=0)
 
-        # bMat is regular grid so we can use LinearInterpOnInterp1D
-        v_innr_nvrs_func_by_bBal = []
-        for bi in range(self.bGrid.size):
-            v_innr_nvrs_func_by_bBal.append(
-                LinearFast(v_now_nvrs_temp[:, bi], [lMat_temp[:, bi]])
-            )
+        # bMat is a regular grid, lMat is not so we'll need to use
+        # WarpedInterpOnInterp1D; c, dvdb and v share their knots, so stack
+        # them and read each function off as a channel of the stack
+        innr_nvrs_interp = WarpedInterpOnInterp1D(
+            np.stack([cMat_temp, dvdb_end_of_prd_nvrs_temp, v_now_nvrs_temp]),
+            lMat_temp,
+            self.bGrid,
+        )
+        multi_innr_func = MultiFuncCRRA(
+            innr_nvrs_interp,
+            self.CRRA,
+            [(0, "level"), (0, "marg"), (1, "marg"), (2, "value")],
+        )
 
-        v_innr_nvrs_func = LinearInterpOnInterp1D(v_innr_nvrs_func_by_bBal, self.bGrid)
-        v_innr_func = ValueFuncCRRA(v_innr_nvrs_func, self.CRRA)
+        c_innr_func = innr_nvrs_interp.channel(0)
+        dvdl_innr_func = MargValueFuncCRRA(c_innr_func, self.CRRA)
+        dvdb_innr_func = MargValueFuncCRRA(innr_nvrs_interp.channel(1), self.CRRA)
+        v_innr_func = ValueFuncCRRA(innr_nvrs_interp.channel(2), self.CRRA)
 
         consumption_stage = ConsumptionStage(
             c_func=c_innr_func,
             v_func=v_innr_func,
             dvdl_func=dvdl_innr_func,
             dvdb_func=dvdb_innr_func,
+            multi_func=multi_innr_func,
         )
+        consumption_stage.nodes = {
+            "lMat": lMat_temp,
+            "bGrid": self.bGrid,
+            "c": cMat_temp,
+            "dvdb_nvrs": dvdb_end_of_prd_nvrs_temp,
+            "v_nvrs": v_now_nvrs_temp,
+        }
 
         return consumption_stage
 
+    def gp_kernels_next(self):
+        deposit_stage_next = getattr(
+            self.solution_next, "deposit_stage", self.solution_next
+        )
+
+        return getattr(deposit_stage_next, "gp_kernels", {})
+
+    def make_deposit_interp(self, values, grids, name):
+        # scattered-data interpolant of the endogenous (m, n) points
+        kwargs = dict(self.DepositInterpKwargs)
+
+        # surfaces change smoothly across periods, so next period's fitted
+        # kernel is a good guess for (or a fixed choice of) this period's
+        kernel_next = self.gp_kernels_next().get(name)
+        if kernel_next is not None and self.GPKernelMode != "refit":
+            kwargs["kernel"] = kernel_next
+            if self.GPKernelMode == "fixed":
+                kwargs["optimizer"] = None
+
+        interp = make_unstructured_interp(values, grids, self.DepositInterp, **kwargs)
+        self.gp_kernels[name] = getattr(interp, "kernel_", None)
+
+        return interp
+
+    def make_adaptive_deposit_interp(self, multi_func_next, dMat, mMat, nMat):
+        # fit d on a coarse subgrid of the egm points, then add egm points
+        # only where the predictive std on the common grid is above tolerance
+        def coarse(count):
+            # every AdaptiveStride-th index and the last one
+            return np.union1d(np.arange(0, count, self.AdaptiveStride), count - 1)
+
+        sub = np.ix_(coarse(dMat.shape[0]), coarse(dMat.shape[1]))
+        values = np.where(dMat[sub] > -1.0, dMat[sub], np.nan)
+        interp = self.make_deposit_interp(values, [mMat[sub], nMat[sub]], "dMat")
+        if not isinstance(interp, GaussianProcessInterp):
+            raise ValueError(
+                "Adaptive deposit sampling needs a predictive std, "
+                "use DepositInterp='gaussian-process'."
+            )
+
+        mGrid = self.mMat.ravel()
+        nGrid = self.nMat.ravel()
+        std = interp.std(mGrid, nGrid)
+        iterations = 0
+        while iterations < self.AdaptiveMaxIter and np.any(std > self.AdaptiveTol):
+            uncertain = np.flatnonzero(std > self.AdaptiveTol)
+            uncertain = uncertain[np.argsort(std[uncertain])[::-1]]
+            uncertain = uncertain[: self.AdaptiveBatch]
+
+            # exogenous points whose egm image should land on the uncertain
+            # points, given the current guess of d there
+            m_new = mGrid[uncertain]
+            n_new = nGrid[uncertain]
+            d_new = np.clip(interp(m_new, n_new), 0.0, m_new)
+            l_new = m_new - d_new
+            bl_new = n_new + d_new + self.g(d_new)
+
+            dvdl_next, dvdb_next = multi_func_next.marginals(l_new, bl_new)
+            d_new = self.g.inv(dvdl_next / dvdb_next - 1.0)
+
+            # update takes the targets in the layout the interpolant was
+            # created with, i.e. the coarse subgrid including dropped points
+            # on the first round and the kept points afterwards
+            interp = interp.update(
+                values,
+                np.where(d_new > -1.0, d_new, np.nan),
+                [l_new + d_new, bl_new - d_new - self.g(d_new)],
+            )
+            values = interp.values
+            std = interp.std(mGrid, nGrid)
+            iterations += 1
+
+        self.adaptive_stats = {
+            "points": interp.points.shape[0],
+            "iterations": iterations,
+            "max_std": np.max(std),
+        }
+
+        return interp
+
     def solve_deposit_decision(self, consumption_stage):
-        c_func_next = consumption_stage.c_func
-        v_func_next = consumption_stage.v_func
-        dvdl_func_next = consumption_stage.dvdl_func
-        dvdb_func_next = consumption_stage.dvdb_func
+        if self.Backend == "numba":
+            return self.solve_deposit_decision_numba(consumption_stage)
 
-        dvdl_next = dvdl_func_next(self.lMat, self.blMat)
-        dvdb_next = dvdb_func_next(self.lMat, self.blMat)
+        multi_func_next = consumption_stage.multi_func
+
+        dvdl_next, dvdb_next = multi_func_next.marginals(self.lMat, self.blMat)
 
         # endogenous grid method, again
         dMat = self.g.inv(dvdl_next / dvdb_next - 1.0)
@@ -438,52 +671,95 @@ class PensionSolver(MetricObject):
             "blMat": self.blMat,
         }
 
-        gaussian_interp_grid0 = GeneralizedRegressionUnstructuredInterp(
-            self.lMat,
-            [mMat, nMat],
-            model="gaussian-process",
-            std=True,
-            model_kwargs={"normalize_y": True},
-        )
+        if self.DepositInversion == "foc":
+            # no inversion at all, solve the foc on the common grid directly
+            dMat_foc, _ = self.solve_deposit_foc(multi_func_next)
+            gaussian_interp = LinearFast(dMat_foc, [self.mGrid, self.nGrid])
+        elif self.DepositInversion == "envelope":
+            # where the foc has several solutions the egm mesh folds over
+            # itself, so scan its simplices onto the common grid and keep the
+            # deposit with the highest value of choice at each point
+            dMat_env = deposit_envelope(
+                consumption_stage.nodes,
+                dMat,
+                mMat,
+                nMat,
+                self.mGrid,
+                self.nGrid,
+                self.CRRA,
+                self.g_params,
+            )
+            gaussian_interp = LinearFast(dMat_env, [self.mGrid, self.nGrid])
+        elif self.DepositInversion == "adaptive":
+            gaussian_interp = self.make_adaptive_deposit_interp(
+                multi_func_next, dMat, mMat, nMat
+            )
+        elif self.DepositInversion == "kronecker":
+            # m, n and d all live on the tensor (l, bl) grid, so smooth them
+            # with a kronecker structured gp and invert the smoothed mesh;
+            # nodes outside the domain of g are filled from their neighbors
+            # rather than smoothed as data
+            valid = dMat > -1.0
+            gaussian_interp = KroneckerWarpedInterp(
+                np.where(valid, dMat, np.nan),
+                [np.where(valid, mMat, np.nan), np.where(valid, nMat, np.nan)],
+                [self.lGrid, self.blGrid],
+                **self.KroneckerKwargs,
+            )
+        else:
+            # interpolate grids
+            if self.DepositInversion == "warped":
+                # (m, n) is a smooth warp of the regular (l, bl) grid, so locate
+                # the common grid in the warped mesh instead of regressing on it;
+                # points outside the mesh are nan and drop out below
+                warped_interp = WarpedBilinearInterp(
+                    np.stack([self.lMat, self.blMat]), [mMat, nMat]
+                )
+                lMat_temp, blMat_temp = warped_interp(self.mMat, self.nMat)
+                gaussian_interp_grids = None
+            else:
+                # l and bl are fitted on the same points, so fit them together
+                # and share one factorization of the kernel matrix
+                gaussian_interp_grids = self.make_deposit_interp(
+                    np.stack([self.lMat, self.blMat]), [mMat, nMat], "grids"
+                )
 
-        gaussian_interp_grid1 = GeneralizedRegressionUnstructuredInterp(
-            self.blMat,
-            [mMat, nMat],
-            model="gaussian-process",
-            std=True,
-            model_kwargs={"normalize_y": True},
-        )
+                lMat_temp, blMat_temp = gaussian_interp_grids(self.mMat, self.nMat)
+
+            # calculate derivatives
+            dvdl_next, dvdb_next = multi_func_next.marginals(lMat_temp, blMat_temp)
+
+            # endogenous grid method
+            dMat2 = self.g.inv(dvdl_next / dvdb_next - 1.0)
+            mMat2 = lMat_temp + dMat2
+            nMat2 = blMat_temp - dMat2 - self.g(dMat2)
+
+            if self.GPIncremental and isinstance(
+                gaussian_interp_grids, GaussianProcessInterp
+            ):
+                # the first pass sits on the points of the grids fit, so reuse its
+                # factorization: drop points outside the domain of g and append
+                # the second pass instead of refitting on the union. d inherits
+                # the kernel fitted to l and bl, so record it as the d kernel
+                # for GPKernelMode in the previous period
+                gaussian_interp = gaussian_interp_grids.update(
+                    np.where(dMat > -1.0, dMat, np.nan),
+                    np.where(dMat2 > -1.0, dMat2, np.nan),
+                    [mMat2, nMat2],
+                )
+                self.gp_kernels["dMat"] = gaussian_interp.kernel_
+            else:
+                # concatenate grids
+                dMat = np.concatenate((dMat.flatten(), dMat2.flatten()))
+                mMat = np.concatenate((mMat.flatten(), mMat2.flatten()))
+                nMat = np.concatenate((nMat.flatten(), nMat2.flatten()))
 
-        # interpolate grids
-        lMat_temp = gaussian_interp_grid0(self.mMat, self.nMat)
-        blMat_temp = gaussian_interp_grid1(self.mMat, self.nMat)
-
-        # calculate derivatives
-        dvdl_next = dvdl_func_next(lMat_temp, blMat_temp)
-        dvdb_next = dvdb_func_next(lMat_temp, blMat_temp)
-
-        # endogenous grid method
-        dMat2 = self.g.inv(dvdl_next / dvdb_next - 1.0)
-        mMat2 = lMat_temp + dMat2
-        nMat2 = blMat_temp - dMat2 - self.g(dMat2)
-
-        # concatenate grids
-        dMat = np.concatenate((dMat.flatten(), dMat2.flatten()))
-        mMat = np.concatenate((mMat.flatten(), mMat2.flatten()))
-        nMat = np.concatenate((nMat.flatten(), nMat2.flatten()))
-
-        cond = dMat > -1.0
-        dMat = dMat[cond]
-        nMat = nMat[cond]
-        mMat = mMat[cond]
-
-        gaussian_interp = GeneralizedRegressionUnstructuredInterp(
-            dMat,
-            [mMat, nMat],
-            model="gaussian-process",
-            std=True,
-            model_kwargs={"normalize_y": True},
-        )
+                cond = dMat > -1.0
+                dMat = dMat[cond]
+                nMat = nMat[cond]
+                mMat = mMat[cond]
+
+                gaussian_interp = self.make_deposit_interp(dMat, [mMat, nMat], "dMat")
 
         # evaluate d on common grid
         dMat = gaussian_interp(self.mMat, self.nMat)
@@ -491,8 +767,32 @@ class PensionSolver(MetricObject):
         lMat = self.mMat - dMat
         blMat = self.nMat + dMat + self.g(dMat)
 
-        # evaluate c on common grid
-        cMat = c_func_next(lMat, blMat)
+        # evaluate c, dvdn and v on common grid, without re-transforming
+        cMat, dvdn_outr_nvrs, v_outr_nvrs = multi_func_next.interp(lMat, blMat)
+
+        deposit_stage = self.make_deposit_stage(dMat, cMat, dvdn_outr_nvrs, v_outr_nvrs)
+        deposit_stage.gaussian_interp = gaussian_interp
+        deposit_stage.gp_kernels = self.gp_kernels
+        deposit_stage.adaptive_stats = self.adaptive_stats
+
+        return deposit_stage
+
+    def solve_deposit_decision_numba(self, consumption_stage):
+        # egm on the exogenous grid, then a simplex scan of the warped mesh
+        # onto the common grid; the foc is solved directly where it has holes
+        dMat, cMat, dvdn_outr_nvrs, v_outr_nvrs = deposit_stage_numba(
+            consumption_stage.nodes,
+            self.lMat,
+            self.blMat,
+            self.mGrid,
+            self.nGrid,
+            self.CRRA,
+            self.g_params,
+        )
+
+        return self.make_deposit_stage(dMat, cMat, dvdn_outr_nvrs, v_outr_nvrs)
+
+    def make_deposit_stage(self, dMat, cMat, dvdn_outr_nvrs, v_outr_nvrs):
         # there is no consumption or deposit when there is no cash on hand
         mGrid_temp = np.append(0.0, self.mGrid)
         dMat_temp = np.insert(dMat, 0, 0.0, axis=0)
@@ -502,19 +802,13 @@ class PensionSolver(MetricObject):
         c_outr_func = LinearFast(cMat_temp, [mGrid_temp, self.nGrid])
         dvdm_outr_func = MargValueFuncCRRA(c_outr_func, self.CRRA)
 
-        dvdb_next = dvdb_func_next(lMat, blMat)
-
-        dvdn_outr_nvrs = self.u.derinv(dvdb_next)
         dvdn_outr_nvrs_temp = np.insert(dvdn_outr_nvrs, 0, dvdn_outr_nvrs[0], axis=0)
         dvdn_outr_nvrs_func = LinearFast(dvdn_outr_nvrs_temp, [mGrid_temp, self.nGrid])
         dvdn_outr_func = MargValueFuncCRRA(dvdn_outr_nvrs_func, self.CRRA)
 
         # make value function
-        v_outr = v_func_next(lMat, blMat)
-        v_outr_nvrs = self.u.inv(v_outr)
         # insert value of 0 at m = 0
         v_outr_nvrs_temp = np.insert(v_outr_nvrs, 0, 0.0, axis=0)
-        # mMatand nMatare irregular grids so we need Curvilinear2DInterp
         v_now_nvrs_func = LinearFast(v_outr_nvrs_temp, [mGrid_temp, self.nGrid])
         v_outr_func = ValueFuncCRRA(v_now_nvrs_func, self.CRRA)
 
@@ -526,10 +820,56 @@ class PensionSolver(MetricObject):
         )
 
         deposit_stage.c_func = c_outr_func
-        deposit_stage.gaussian_interp = gaussian_interp
+        # nodal values let next period's post decision stage share one lookup
+        deposit_stage.nodes = {
+            "grids": [mGrid_temp, self.nGrid],
+            "dvdm_nvrs": cMat_temp,
+            "dvdn_nvrs": dvdn_outr_nvrs_temp,
+            "v_nvrs": v_outr_nvrs_temp,
+        }
 
         return deposit_stage
 
+    def warm_start_stage(self, consumption_stage):
+        # deposit stage whose policy starts the vfi and foc solvers
+        if self.VFIWarmStart == "egm":
+            return self.solve_deposit_decision(consumption_stage)
+        if self.VFIWarmStart == "previous":
+            return getattr(self.solution_next, "deposit_stage", self.solution_next)
+        return None
+
+    def deposit_guess(self, consumption_stage):
+        deposit_stage = self.warm_start_stage(consumption_stage)
+        if deposit_stage is None:
+            return None
+
+        d_guess = deposit_stage.d_func(self.mMat, self.nMat)
+        return np.clip(np.broadcast_to(d_guess, self.mMat.shape), 0.0, self.mMat)
+
+    def maximize_deposit_blocks(self, v_func_next, d_guess=None):
+        # every grid point is an independent bounded problem, so solve them
+        # in blocks spread over a pool of workers
+        m_nrm = self.mMat.ravel()
+        n_nrm = self.nMat.ravel()
+        d0 = None if d_guess is None else d_guess.ravel()
+        size = self.VFIBlockSize
+        blocks = [
+            (
+                v_func_next,
+                self.g_params,
+                m_nrm[i : i + size],
+                n_nrm[i : i + size],
+                None if d0 is None else d0[i : i + size],
+            )
+            for i in range(0, m_nrm.size, size)
+        ]
+        results = map_blocks(maximize_deposit, blocks, self.VFIWorkers, self.VFIPool)
+
+        d_nrm = np.concatenate([d for d, _ in results]).reshape(self.mMat.shape)
+        stats = {key: sum(st[key] for _, st in results) for key in results[0][1]}
+
+        return d_nrm, stats
+
     def solve_deposit_decision_vfi(self, consumption_stage):
         v_func_next = consumption_stage.v_func
 
@@ -546,33 +886,28 @@ class PensionSolver(MetricObject):
 
             return output
 
-        res = em.maximize(
-            objective,
-            params=self.mMat / 2,
-            criterion_kwargs={"m_nrm": self.mMat, "n_nrm": self.nMat},
-            algorithm="scipy_lbfgsb",
-            numdiff_options={"n_cores": 6},
-            multistart=True,
-            lower_bounds=np.zeros_like(self.mMat),
-            upper_bounds=self.mMat,
-        )
+        d_guess = self.deposit_guess(consumption_stage)
 
-        dMat = res.params
-
-        # for mi in range(self.mGrid.size):
-        #     for ni in range(self.nGrid.size):
-        #         m_nrm = self.mGrid[mi]
-        #         n_nrm = self.nGrid[ni]
-        #         res = minimize_scalar(
-        #             objective,
-        #             args=(
-        #                 m_nrm,
-        #                 n_nrm,
-        #             ),
-        #             bounds=(0, m_nrm),
-        #             method="bounded",
-        #         )
-        #         dMat[mi, ni] = res.x
+        if self.VFIMode == "blocks":
+            res = None
+            dMat, stats = self.maximize_deposit_blocks(v_func_next, d_guess)
+        else:
+            res = em.maximize(
+                objective,
+                params=self.mMat / 2 if d_guess is None else d_guess,
+                criterion_kwargs={"m_nrm": self.mMat, "n_nrm": self.nMat},
+                algorithm="scipy_lbfgsb",
+                numdiff_options={"n_cores": self.VFIWorkers},
+                multistart=True,
+                lower_bounds=np.zeros_like(self.mMat),
+                upper_bounds=self.mMat,
+            )
+            dMat = res.params
+            stats = {
+                "iterations": res.n_iterations,
+                "evaluations": res.n_criterion_evaluations,
+                "success": res.success,
+            }
 
         # add d = 0 when no liquid cash
         dMat_temp = np.insert(dMat, 0, 0.0, axis=0)
@@ -588,46 +923,25 @@ class PensionSolver(MetricObject):
             "n_nrm": self.nMat,
             "res": res,
         }
+        deposit_stage.solver_stats = stats
 
         return deposit_stage
 
-    def solve_deposit_decision_with_jac(self, consumption_stage):
-        dvdl_func_next = consumption_stage.dvdl_func
-        dvdb_func_next = consumption_stage.dvdb_func
-        v_func_next = consumption_stage.v_func
-
-        def objective(d_nrm, m_nrm, n_nrm):
+    def solve_deposit_foc(self, multi_func_next, d0=None):
+        # deposit foc on the whole common grid at once, with corners at 0 and m
+        def foc(d_nrm, m_nrm, n_nrm):
             l_nrm = m_nrm - d_nrm
             b_nrm = n_nrm + d_nrm + self.g(d_nrm)
-
-            return -v_func_next(l_nrm, b_nrm)
-
-        def jacobian(d_nrm, m_nrm, n_nrm):
-            l_nrm = m_nrm - d_nrm
-            b_nrm = n_nrm + d_nrm + self.g(d_nrm)
-
-            dvdl = dvdl_func_next(l_nrm, b_nrm)
-            dvdb = dvdb_func_next(l_nrm, b_nrm)
+            dvdl, dvdb = multi_func_next.marginals(l_nrm, b_nrm)
 
             return -dvdl + dvdb * (1 + self.g.der(d_nrm))
 
-        dMat = np.empty_like(self.mMat)
-
-        for mi in range(self.mGrid.size):
-            for ni in range(self.nGrid.size):
-                m_nrm = self.mGrid[mi]
-                n_nrm = self.nGrid[ni]
-                res = minimize(
-                    objective,
-                    jac=jacobian,
-                    x0=m_nrm / 2,
-                    args=(
-                        m_nrm,
-                        n_nrm,
-                    ),
-                    bounds=[(0, m_nrm)],
-                )
-                dMat[mi, ni] = res.x
+        return solve_foc(foc, 0.0, self.mMat, args=(self.mMat, self.nMat), x0=d0)
+
+    def solve_deposit_decision_with_jac(self, consumption_stage):
+        dMat, stats = self.solve_deposit_foc(
+            consumption_stage.multi_func, self.deposit_guess(consumption_stage)
+        )
 
         # add d = 0 when no liquid cash
         dMat_temp = np.insert(dMat, 0, 0.0, axis=0)
@@ -637,47 +951,64 @@ class PensionSolver(MetricObject):
         deposit_stage = DepositStage(
             d_func=d_func,
         )
+        deposit_stage.solver_stats = stats
 
         return deposit_stage
 
     def solve_vfi(self):
-        deposit_solution_next = self.solution_next.deposit_stage
-        post_decision_solution = self.solve_post_decision(deposit_solution_next)
+        # brute-force reference for the joint (c, d) choice: a grid search
+        # over the feasible simplex at every (m, n), polished all at once
+        deposit_stage_next = getattr(
+            self.solution_next, "deposit_stage", self.solution_next
+        )
+        post_decision_stage = self.solve_post_decision(deposit_stage_next)
+        v_end_of_prd_func = post_decision_stage.v_func
 
-        def objective(control, m_nrm, n_nrm):
-            c_nrm = control[0]
-            d_nrm = control[1]
+        def value(c_nrm, d_nrm, m_nrm, n_nrm):
             a_nrm = m_nrm - c_nrm - d_nrm
             b_nrm = n_nrm + d_nrm + self.g(d_nrm)
-            value = self.u(c_nrm) + post_decision_solution.v_func(a_nrm, b_nrm)
-            return -value
-
-        cMat = np.empty_like(self.mMat)
-        dMat = np.empty_like(self.mMat)
-        for mi in range(self.mGrid.size):
-            for ni in range(self.nGrid.size):
-                m_nrm = self.mGrid[mi]
-                n_nrm = self.nGrid[mi]
-
-                bounds = Bounds([0, m_nrm], [0, m_nrm])
-                linear_constraint = LinearConstraint([1, 1], [0], [m_nrm])
-
-                sol = minimize(
-                    objective,
-                    x0=np.array([m_nrm / 2, m_nrm / 2]),
-                    args=(
-                        m_nrm,
-                        n_nrm,
-                    ),
-                    method="trust-constr",
-                    constraints=[linear_constraint],
-                    bounds=bounds,
-                )
+            return self.u(c_nrm) + v_end_of_prd_func(a_nrm, b_nrm)
 
-                cMat[mi, ni] = sol.x[0]
-                dMat[mi, ni] = sol.x[1]
+        # start from the policies of the egm solution or of the next period
+        guess = None
+        if self.VFIWarmStart == "egm":
+            consumption_stage = self.solve_consumption_decision(post_decision_stage)
+            deposit_stage = self.solve_deposit_decision(consumption_stage)
+        else:
+            deposit_stage = self.warm_start_stage(None)
+        if hasattr(deposit_stage, "c_func"):
+            guess = (
+                deposit_stage.c_func(self.mMat, self.nMat),
+                deposit_stage.d_func(self.mMat, self.nMat),
+            )
+
+        cMat, dMat, vMat, stats = maximize_simplex(
+            value,
+            self.mMat,
+            args=(self.nMat,),
+            x0=guess,
+            count=self.VFIGridCount,
+            tol=self.VFITol,
+            chunk=self.ExpChunkSize,
+        )
+
+        # envelope conditions: dv/dm = u'(c) and dv/dn = dv/db after the choice
+        aMat = self.mMat - cMat - dMat
+        bMat = self.nMat + dMat + self.g(dMat)
+        dvdn_nvrs = self.u.derinv(post_decision_stage.dvdb_func(aMat, bMat))
+
+        deposit_stage = self.make_deposit_stage(dMat, cMat, dvdn_nvrs, self.u.inv(vMat))
+        deposit_stage.solver_stats = stats
+
+        return PensionSolution(
+            post_decision_stage=post_decision_stage,
+            deposit_stage=deposit_stage,
+        )
 
     def solve(self):
+        if self.SolveMethod == "vfi":
+            return self.solve_vfi()
+
         if hasattr(self.solution_next, "deposit_stage"):
             deposit_solution_next = self.solution_next.deposit_stage
         else:
@@ -719,6 +1050,59 @@ init_pension_contrib["IncUnemp"] = 0.0
 init_pension_contrib["UnempPrbRet"] = 0.0
 init_pension_contrib["IncUnempRet"] = 0.50
 init_pension_contrib["TasteShkStd"] = 0.10
+# max number of (shock, a, b) points evaluated at once in expectations
+init_pension_contrib["ExpChunkSize"] = 2_000_000
+# "hark" for HARK interpolants and regressions, "numba" for compiled kernels
+init_pension_contrib["Backend"] = "hark"
+# deposit vfi: "joint" maximizes all grid points as one problem with
+# estimagic, "blocks" solves each point on its own, in blocks of
+# VFIBlockSize points spread over VFIWorkers workers of a "process" or
+# "thread" VFIPool; VFIWorkers also sets estimagic's cores
+init_pension_contrib["VFIMode"] = "joint"
+init_pension_contrib["VFIWorkers"] = 6
+init_pension_contrib["VFIPool"] = "process"
+init_pension_contrib["VFIBlockSize"] = 500
+# "egm" solves each period with the endogenous grid methods, "vfi" with a
+# grid search over VFIGridCount x VFIGridCount (spent, deposited) shares of m
+# polished to VFITol, as a reference
+init_pension_contrib["SolveMethod"] = "egm"
+init_pension_contrib["VFIGridCount"] = 20
+init_pension_contrib["VFITol"] = 1e-8
+# initial guess of the vfi and foc solvers: "none" starts from m / 2 (or a
+# grid search), "egm" from this period's egm policy and "previous" from the
+# policy of the period solved before; solver_stats on the deposit stage
+# reports iterations and convergence
+init_pension_contrib["VFIWarmStart"] = "none"
+# scattered-data interpolant of the deposit stage, see regression.py;
+# "approximate-gp" fits in linear time, with its rank in DepositInterpKwargs,
+# and reports its error on held-out egm points in `holdout_error`; a
+# "max_memory" entry caps the bytes of each chunk of predictions
+init_pension_contrib["DepositInterp"] = "gaussian-process"
+init_pension_contrib["DepositInterpKwargs"] = {}
+# agents simulated at once by simulate_panel, which bounds its memory
+init_pension_contrib["PanelChunkSize"] = 100_000
+# "refit" fits each period's gaussian processes from scratch, "warm-start"
+# starts from next period's fitted kernels and "fixed" reuses them as is
+init_pension_contrib["GPKernelMode"] = "refit"
+# "regression" maps the common grid back to (l, bl) with the deposit
+# interpolant, "warped" inverts the egm mesh directly and "kronecker" inverts
+# it after smoothing with a gp on the (l, bl) grid (options in KroneckerKwargs);
+# "adaptive" fits d on every AdaptiveStride-th egm point and adds egm points
+# in batches where the gp std on the common grid exceeds AdaptiveTol;
+# "envelope" skips the regression and keeps the egm branch with the highest
+# value at each common grid point, solving the foc where the mesh has holes;
+# "foc" solves the foc on the whole common grid with safeguarded newton steps
+init_pension_contrib["DepositInversion"] = "regression"
+# options of KroneckerWarpedInterp, e.g. "refine" and "length_scale"
+init_pension_contrib["KroneckerKwargs"] = {}
+# update the factorization of the grids fit with the second egm pass instead
+# of refitting the deposit gaussian process on all points; d then uses the
+# kernel fitted to the grids
+init_pension_contrib["GPIncremental"] = False
+init_pension_contrib["AdaptiveTol"] = 1e-3
+init_pension_contrib["AdaptiveStride"] = 4
+init_pension_contrib["AdaptiveBatch"] = 100
+init_pension_contrib["AdaptiveMaxIter"] = 10
 
 init_pension_contrib["epsilon"] = 1e-6
 
@@ -775,6 +1159,29 @@ class RetirementConsumerType(PensionConsumerType):
     def update_solution_terminal(self):
         return IndShockConsumerType.update_solution_terminal(self)
 
+    def panel_transition(self, t, state, rng):
+        if t < self.T_retire:
+            return PensionConsumerType.panel_transition(self, t, state, rng)
+
+        # retirees cash out the pension account and solve a consumption
+        # saving problem in cash on hand alone
+        solution = period_solution(self, t)
+        t_cycle = t % self.T_cycle
+        m = state["m"] + state["n"]
+
+        c = np.clip(solution.cFunc(m), 0.0, m)
+        a = m - c
+        outputs = {"m": m, "n": np.zeros_like(m), "c": c, "a": a, "p": state["p"]}
+        outputs = mask_dead(outputs, state["alive"])
+
+        psi, theta, _ = draw_atoms(self.ShockDstn[t_cycle], m.size, rng)
+        state["m"] = a * self.Rfree / (self.PermGroFac[t_cycle] * psi) + theta
+        state["n"] = np.zeros_like(m)
+        state["p"] = state["p"] * self.PermGroFac[t_cycle] * psi
+        state["alive"] &= rng.random(m.size) < self.LivPrb[t_cycle]
+
+        return outputs
+
 
 init_pension_retirement = init_pension_contrib.copy()
 T_cycle = 15
@@ -1,7 +1,7 @@
 # this code is outdated
 
 from copy import deepcopy
-from dataclasses import dataclass
+from dataclasses import dataclass, field
 
 import estimagic as em
 import numpy as np
@@ -18,15 +18,19 @@ from HARK.interpolation import (
     ConstantFunction,
     Curvilinear2DInterp,
     LinearInterp,
-    LinearInterpOnInterp1D,
     MargValueFuncCRRA,
     ValueFuncCRRA,
 )
 from HARK.metric import MetricObject
 from HARK.rewards import UtilityFuncCRRA, UtilityFuncStoneGeary
 from HARK.utilities import NullFunc, make_grid_exp_mult
+from interpolators import MultiFuncCRRA, WarpedInterpOnInterp1D
+from numba_backend import deposit_stage as deposit_stage_numba
+from numba_backend import post_decision as post_decision_numba
+from regression import make_unstructured_interp
 from scipy.interpolate import CloughTocher2DInterpolator
-from scipy.optimize import Bounds, LinearConstraint, minimize
+from simulation import newborns, panel_periods, pension_transition, simulate_panel
+from utilities import map_blocks, maximize_deposit, maximize_simplex, solve_foc
 
 
 @dataclass
@@ -42,6 +46,8 @@ class ConsumptionStage(MetricObject):
     v_func: ValueFuncCRRA = NullFunc()
     dvdl_func: MargValueFuncCRRA = NullFunc()
     dvdb_func: MargValueFuncCRRA = NullFunc()
+    # c, dvdl, dvdb and v from a single search of the shared knots
+    multi_func: MultiFuncCRRA = NullFunc()
 
 
 @dataclass
@@ -73,6 +79,17 @@ class PensionConsumerType(RiskyAssetConsumerType):
         "IncUnempRet",
         "TasteShkStd",
         "TaxDeduct",
+        "Backend",
+        "VFIMode",
+        "VFIWorkers",
+        "VFIPool",
+        "VFIBlockSize",
+        "VFIGridCount",
+        "VFITol",
+        "VFIWarmStart",
+        "SolveMethod",
+        "DepositInterp",
+        "DepositInterpKwargs",
     ]
 
     def __init__(self, **kwds):
@@ -118,6 +135,12 @@ class PensionConsumerType(RiskyAssetConsumerType):
             dvdm_func=vp_func_terminal,
             dvdn_func=vp_func_terminal,
         )
+        deposit_stage.nodes = {
+            "grids": [np.append(0.0, self.mGrid), self.nGrid],
+            "dvdm_nvrs": cmat_temp,
+            "dvdn_nvrs": cmat_temp,
+            "v_nvrs": cmat_temp,
+        }
 
         self.solution_terminal = WorkingSolution(
             deposit_stage=deposit_stage,
@@ -182,6 +205,26 @@ class PensionConsumerType(RiskyAssetConsumerType):
 
             self.ShockDstn[i] = labeled_dstn
 
+    def initialize_panel(self, size, rng):
+        return newborns(self, size, rng, self.Rfree)
+
+    def panel_transition(self, t, state, rng):
+        # same deposit function g as the solver
+        return pension_transition(self, t, state, rng, (1.0, self.DisutilLabor, 0.0))
+
+    def simulate_panel(self, agents=None, periods=None, seed=0, directory=None):
+        """
+        Simulate a panel of agents with the solved policies, see
+        `simulation.simulate_panel`. Defaults to AgentCount agents over the
+        agents' life, or T_sim periods if it is infinite.
+        """
+        agents = self.AgentCount if agents is None else agents
+        periods = panel_periods(self) if periods is None else periods
+
+        return simulate_panel(
+            self, agents, periods, self.PanelChunkSize, seed, directory
+        )
+
 
 @dataclass
 class PensionSolver(MetricObject):
@@ -209,6 +252,17 @@ class PensionSolver(MetricObject):
     b2Grid: np.array
     lMat: np.ndarray
     b2Mat: np.array
+    Backend: str = "hark"
+    VFIMode: str = "joint"
+    VFIWorkers: int = 6
+    VFIPool: str = "process"
+    VFIBlockSize: int = 500
+    VFIGridCount: int = 20
+    VFITol: float = 1e-8
+    VFIWarmStart: str = "none"
+    SolveMethod: str = "egm"
+    DepositInterp: str = "clough-tocher"
+    DepositInterpKwargs: dict = field(default_factory=dict)
 
     def __post_init__(self):
         self.def_utility_funcs()
@@ -220,6 +274,7 @@ class PensionSolver(MetricObject):
         # which is gradually decreasing in the level of deposits
 
         self.g = UtilityFuncStoneGeary(self.DisutilLabor)
+        self.g_params = (1.0, self.DisutilLabor, 0.0)
 
     def solve_retired_problem(self, retired_solution_next):
         vp_func_next = retired_solution_next.vp_func
@@ -306,7 +361,57 @@ class PensionSolver(MetricObject):
 
         return worker_retiring_solution
 
+    def solve_post_decision_numba(self, nodes):
+        psi, theta, risky = np.atleast_2d(self.ShockDstn.atoms)
+        nodal_values = np.stack(
+            [nodes["v_nvrs"], nodes["dvdm_nvrs"], nodes["dvdn_nvrs"]]
+        )
+
+        v_end_of_prd, dvda_end_of_prd, dvdb_end_of_prd = post_decision_numba(
+            self.aGrid,
+            self.bGrid,
+            psi,
+            theta,
+            risky,
+            self.ShockDstn.pmv,
+            self.Rfree,
+            *nodes["grids"],
+            nodal_values,
+            self.CRRA,
+            self.DiscFac,
+        )
+
+        dvda_end_of_prd_nvrs = self.u.derinv(dvda_end_of_prd)
+        dvda_end_of_prd_func = MargValueFuncCRRA(
+            BilinearInterp(dvda_end_of_prd_nvrs, self.aGrid, self.bGrid), self.CRRA
+        )
+
+        dvdb_end_of_prd_nvrs = self.u.derinv(dvdb_end_of_prd)
+        dvdb_end_of_prd_func = MargValueFuncCRRA(
+            BilinearInterp(dvdb_end_of_prd_nvrs, self.aGrid, self.bGrid), self.CRRA
+        )
+
+        v_end_of_prd_nvrs = self.u.inv(v_end_of_prd)
+        v_end_of_prd_func = ValueFuncCRRA(
+            BilinearInterp(v_end_of_prd_nvrs, self.aGrid, self.bGrid), self.CRRA
+        )
+
+        post_decision_stage = PostDecisionStage(
+            v_func=v_end_of_prd_func,
+            dvda_func=dvda_end_of_prd_func,
+            dvdb_func=dvdb_end_of_prd_func,
+        )
+        post_decision_stage.dvda_nvrs = dvda_end_of_prd_nvrs
+        post_decision_stage.dvdb_nvrs = dvdb_end_of_prd_nvrs
+        post_decision_stage.vals = v_end_of_prd
+
+        return post_decision_stage
+
     def solve_post_decision(self, deposit_stage_next):
+        nodes = getattr(deposit_stage_next, "nodes", None)
+        if nodes is not None and self.Backend == "numba":
+            return self.solve_post_decision_numba(nodes)
+
         dvdm_func_next = deposit_stage_next.dvdm_func
         dvdn_func_next = deposit_stage_next.dvdn_func
         v_func_next = deposit_stage_next.v_func
@@ -403,70 +508,59 @@ class PensionSolver(MetricObject):
         lmat_temp = np.insert(lmat, 0, 0.0, axis=0)
         cmat_temp = np.insert(cmat, 0, 0.0, axis=0)
 
-        # bmat is a regular grid, lmat is not so we'll need to use LinearInterpOnInterp1D
-        c_innr_func_by_bbal = []
-        for bi in range(self.bGrid.size):
-            c_innr_func_by_bbal.append(
-                LinearInterp(
-                    lmat_temp[:, bi],
-                    cmat_temp[:, bi],
-                )
-            )
-
-        c_innr_func = LinearInterpOnInterp1D(c_innr_func_by_bbal, self.bGrid)
-        dvdl_innr_func = MargValueFuncCRRA(c_innr_func, self.CRRA)
-
         # again, at l = 0, c = 0 and a = 0, so repeat dvdb[0]
-        # dvdb_end_of_prd_nvrs_temp = np.insert(dvdb_end_of_prd_nvrs, 0, 0.0, axis=0)
         dvdb_end_of_prd_nvrs_temp = np.insert(
             dvdb_end_of_prd_nvrs, 0, dvdb_end_of_prd_nvrs[0], axis=0
         )
 
-        dvdb_innr_nvrs_func_by_bbal = []
-        for bi in range(self.bGrid.size):
-            dvdb_innr_nvrs_func_by_bbal.append(
-                LinearInterp(
-                    lmat_temp[:, bi],
-                    dvdb_end_of_prd_nvrs_temp[:, bi],
-                )
-            )
-
-        dvdb_innr_func = MargValueFuncCRRA(
-            LinearInterpOnInterp1D(dvdb_innr_nvrs_func_by_bbal, self.bGrid), self.CRRA
-        )
-
         # make value function
         v_innr = self.u(cmat) - self.DisutilLabor + v_end_of_prd
         v_innr_nvrs = self.u.inv(v_innr)
         v_now_nvrs_temp = np.insert(v_innr_nvrs, 0, 0.0, axis=0)
 
-        # bmat is regular grid so we can use LinearInterpOnInterp1D
-        v_innr_nvrs_func_by_bbal = []
-        for bi in range(self.bGrid.size):
-            v_innr_nvrs_func_by_bbal.append(
-                LinearInterp(lmat_temp[:, bi], v_now_nvrs_temp[:, bi])
-            )
+        # bmat is a regular grid, lmat is not so we'll need to use
+        # WarpedInterpOnInterp1D; c, dvdb and v share their knots, so stack
+        # them and read each function off as a channel of the stack
+        innr_nvrs_interp = WarpedInterpOnInterp1D(
+            np.stack([cmat_temp, dvdb_end_of_prd_nvrs_temp, v_now_nvrs_temp]),
+            lmat_temp,
+            self.bGrid,
+        )
+        multi_innr_func = MultiFuncCRRA(
+            innr_nvrs_interp,
+            self.CRRA,
+            [(0, "level"), (0, "marg"), (1, "marg"), (2, "value")],
+        )
 
-        v_innr_nvrs_func = LinearInterpOnInterp1D(v_innr_nvrs_func_by_bbal, self.bGrid)
-        v_innr_func = ValueFuncCRRA(v_innr_nvrs_func, self.CRRA)
+        c_innr_func = innr_nvrs_interp.channel(0)
+        dvdl_innr_func = MargValueFuncCRRA(c_innr_func, self.CRRA)
+        dvdb_innr_func = MargValueFuncCRRA(innr_nvrs_interp.channel(1), self.CRRA)
+        v_innr_func = ValueFuncCRRA(innr_nvrs_interp.channel(2), self.CRRA)
 
         consumption_stage = ConsumptionStage(
             c_func=c_innr_func,
             v_func=v_innr_func,
             dvdl_func=dvdl_innr_func,
             dvdb_func=dvdb_innr_func,
+            multi_func=multi_innr_func,
         )
+        consumption_stage.nodes = {
+            "lMat": lmat_temp,
+            "bGrid": self.bGrid,
+            "c": cmat_temp,
+            "dvdb_nvrs": dvdb_end_of_prd_nvrs_temp,
+            "v_nvrs": v_now_nvrs_temp,
+        }
 
         return consumption_stage
 
     def solve_deposit_decision(self, consumption_stage):
-        dvdl_func_next = consumption_stage.dvdl_func
-        dvdb_func_next = consumption_stage.dvdb_func
-        c_func_next = consumption_stage.c_func
-        v_func_next = consumption_stage.v_func
+        if self.Backend == "numba":
+            return self.solve_deposit_decision_numba(consumption_stage)
+
+        multi_func_next = consumption_stage.multi_func
 
-        dvdl_innr = dvdl_func_next(self.lMat, self.b2Mat)
-        dvdb_innr = dvdb_func_next(self.lMat, self.b2Mat)
+        dvdl_innr, dvdb_innr = multi_func_next.marginals(self.lMat, self.b2Mat)
 
         # endogenous grid method, again
         dmat = self.g.derinv(dvdl_innr / dvdb_innr - 1.0)
@@ -498,7 +592,12 @@ class PensionSolver(MetricObject):
         n = n[~idx]
 
         # create interpolator
-        linear_interp = CloughTocher2DInterpolator(list(zip(m, n)), d)
+        if self.DepositInterp == "clough-tocher":
+            linear_interp = CloughTocher2DInterpolator(list(zip(m, n)), d)
+        else:
+            linear_interp = make_unstructured_interp(
+                d, [m, n], self.DepositInterp, **self.DepositInterpKwargs
+            )
 
         # evaluate d on common grid
         dmat = np.nan_to_num(linear_interp(self.mMat, self.nMat))
@@ -506,8 +605,31 @@ class PensionSolver(MetricObject):
         lmat = self.mMat - dmat
         b2mat = self.nMat + dmat + self.g(dmat)
 
-        # evaluate c on common grid
-        cmat = c_func_next(lmat, b2mat)
+        # evaluate c, dvdn and v on common grid, without re-transforming
+        cmat, dvdn_outr_nvrs, v_outr_nvrs = multi_func_next.interp(lmat, b2mat)
+
+        deposit_stage = self.make_deposit_stage(dmat, cmat, dvdn_outr_nvrs, v_outr_nvrs)
+        deposit_stage.linear_interp = linear_interp
+        deposit_stage.curvilinear_interp = curvilinear_interp
+
+        return deposit_stage
+
+    def solve_deposit_decision_numba(self, consumption_stage):
+        # egm on the exogenous grid, then a simplex scan of the warped mesh
+        # onto the common grid; the foc is solved directly where it has holes
+        dmat, cmat, dvdn_outr_nvrs, v_outr_nvrs = deposit_stage_numba(
+            consumption_stage.nodes,
+            self.lMat,
+            self.b2Mat,
+            self.mGrid,
+            self.nGrid,
+            self.CRRA,
+            self.g_params,
+        )
+
+        return self.make_deposit_stage(dmat, cmat, dvdn_outr_nvrs, v_outr_nvrs)
+
+    def make_deposit_stage(self, dmat, cmat, dvdn_outr_nvrs, v_outr_nvrs):
         # there is no consumption or deposit when there is no cash on hand
         mGrid_temp = np.append(0.0, self.mGrid)
         dmat_temp = np.insert(dmat, 0, 0.0, axis=0)
@@ -517,9 +639,6 @@ class PensionSolver(MetricObject):
         c_outr_func = BilinearInterp(cmat_temp, mGrid_temp, self.nGrid)
         dvdm_outr_func = MargValueFuncCRRA(c_outr_func, self.CRRA)
 
-        dvdb_innr = dvdb_func_next(lmat, b2mat)
-
-        dvdn_outr_nvrs = self.u.derinv(dvdb_innr)
         dvdn_outr_nvrs_temp = np.insert(dvdn_outr_nvrs, 0, dvdn_outr_nvrs[0], axis=0)
         dvdn_outr_nvrs_func = BilinearInterp(
             dvdn_outr_nvrs_temp, mGrid_temp, self.nGrid
@@ -527,11 +646,8 @@ class PensionSolver(MetricObject):
         dvdn_outr_func = MargValueFuncCRRA(dvdn_outr_nvrs_func, self.CRRA)
 
         # make value function
-        v_outr = v_func_next(lmat, b2mat)
-        v_outr_nvrs = self.u.inv(v_outr)
         # insert value of 0 at m = 0
         v_outr_nvrs_temp = np.insert(v_outr_nvrs, 0, 0.0, axis=0)
-        # mmat and nmat are irregular grids so we need Curvilinear2DInterp
         v_now_nvrs_func = BilinearInterp(v_outr_nvrs_temp, mGrid_temp, self.nGrid)
         v_outr_func = ValueFuncCRRA(v_now_nvrs_func, self.CRRA)
 
@@ -543,11 +659,55 @@ class PensionSolver(MetricObject):
         )
 
         deposit_stage.c_func = c_outr_func
-        deposit_stage.linear_interp = linear_interp
-        deposit_stage.curvilinear_interp = curvilinear_interp
+        deposit_stage.nodes = {
+            "grids": [mGrid_temp, self.nGrid],
+            "dvdm_nvrs": cmat_temp,
+            "dvdn_nvrs": dvdn_outr_nvrs_temp,
+            "v_nvrs": v_outr_nvrs_temp,
+        }
 
         return deposit_stage
 
+    def warm_start_stage(self, consumption_stage):
+        # deposit stage whose policy starts the vfi and foc solvers
+        if self.VFIWarmStart == "egm":
+            return self.solve_deposit_decision(consumption_stage)
+        if self.VFIWarmStart == "previous":
+            return self.solution_next.deposit_stage
+        return None
+
+    def deposit_guess(self, consumption_stage):
+        deposit_stage = self.warm_start_stage(consumption_stage)
+        if deposit_stage is None:
+            return None
+
+        d_guess = deposit_stage.d_func(self.mMat, self.nMat)
+        return np.clip(np.broadcast_to(d_guess, self.mMat.shape), 0.0, self.mMat)
+
+    def maximize_deposit_blocks(self, v_func_next, d_guess=None):
+        # every grid point is an independent bounded problem, so solve them
+        # in blocks spread over a pool of workers
+        m_nrm = self.mMat.ravel()
+        n_nrm = self.nMat.ravel()
+        d0 = None if d_guess is None else d_guess.ravel()
+        size = self.VFIBlockSize
+        blocks = [
+            (
+                v_func_next,
+                self.g_params,
+                m_nrm[i : i + size],
+                n_nrm[i : i + size],
+                None if d0 is None else d0[i : i + size],
+            )
+            for i in range(0, m_nrm.size, size)
+        ]
+        results = map_blocks(maximize_deposit, blocks, self.VFIWorkers, self.VFIPool)
+
+        d_nrm = np.concatenate([d for d, _ in results]).reshape(self.mMat.shape)
+        stats = {key: sum(st[key] for _, st in results) for key in results[0][1]}
+
+        return d_nrm, stats
+
     def solve_deposit_decision_vfi(self, consumption_stage):
         v_func_next = consumption_stage.v_func
 
@@ -564,33 +724,28 @@ class PensionSolver(MetricObject):
 
             return output
 
-        res = em.maximize(
-            objective,
-            params=self.mMat / 2,
-            criterion_kwargs={"m_nrm": self.mMat, "n_nrm": self.nMat},
-            algorithm="scipy_lbfgsb",
-            numdiff_options={"n_cores": 6},
-            multistart=True,
-            lower_bounds=np.zeros_like(self.mMat),
-            upper_bounds=self.mMat,
-        )
-
-        dmat = res.params
-
-        # for mi in range(self.mGrid.size):
-        #     for ni in range(self.nGrid.size):
-        #         m_nrm = self.mGrid[mi]
-        #         n_nrm = self.nGrid[ni]
-        #         res = minimize_scalar(
-        #             objective,
-        #             args=(
-        #                 m_nrm,
-        #                 n_nrm,
-        #             ),
-        #             bounds=(0, m_nrm),
-        #             method="bounded",
-        #         )
-        #         dmat[mi, ni] = res.x
+        d_guess = self.deposit_guess(consumption_stage)
+
+        if self.VFIMode == "blocks":
+            res = None
+            dmat, stats = self.maximize_deposit_blocks(v_func_next, d_guess)
+        else:
+            res = em.maximize(
+                objective,
+                params=self.mMat / 2 if d_guess is None else d_guess,
+                criterion_kwargs={"m_nrm": self.mMat, "n_nrm": self.nMat},
+                algorithm="scipy_lbfgsb",
+                numdiff_options={"n_cores": self.VFIWorkers},
+                multistart=True,
+                lower_bounds=np.zeros_like(self.mMat),
+                upper_bounds=self.mMat,
+            )
+            dmat = res.params
+            stats = {
+                "iterations": res.n_iterations,
+                "evaluations": res.n_criterion_evaluations,
+                "success": res.success,
+            }
 
         # add d = 0 when no liquid cash
         dmat_temp = np.insert(dmat, 0, 0.0, axis=0)
@@ -606,46 +761,25 @@ class PensionSolver(MetricObject):
             "n_nrm": self.nMat,
             "res": res,
         }
+        deposit_stage.solver_stats = stats
 
         return deposit_stage
 
-    def solve_deposit_decision_with_jac(self, consumption_stage):
-        dvdl_func_next = consumption_stage.dvdl_func
-        dvdb_func_next = consumption_stage.dvdb_func
-        v_func_next = consumption_stage.v_func
-
-        def objective(d_nrm, m_nrm, n_nrm):
+    def solve_deposit_foc(self, multi_func_next, d0=None):
+        # deposit foc on the whole common grid at once, with corners at 0 and m
+        def foc(d_nrm, m_nrm, n_nrm):
             l_nrm = m_nrm - d_nrm
             b_nrm = n_nrm + d_nrm + self.g(d_nrm)
-
-            return -v_func_next(l_nrm, b_nrm)
-
-        def jacobian(d_nrm, m_nrm, n_nrm):
-            l_nrm = m_nrm - d_nrm
-            b_nrm = n_nrm + d_nrm + self.g(d_nrm)
-
-            dvdl = dvdl_func_next(l_nrm, b_nrm)
-            dvdb = dvdb_func_next(l_nrm, b_nrm)
+            dvdl, dvdb = multi_func_next.marginals(l_nrm, b_nrm)
 
             return -dvdl + dvdb * (1 + self.g.der(d_nrm))
 
-        dmat = np.empty_like(self.mMat)
-
-        for mi in range(self.mGrid.size):
-            for ni in range(self.nGrid.size):
-                m_nrm = self.mGrid[mi]
-                n_nrm = self.nGrid[ni]
-                res = minimize(
-                    objective,
-                    jac=jacobian,
-                    x0=m_nrm / 2,
-                    args=(
-                        m_nrm,
-                        n_nrm,
-                    ),
-                    bounds=[(0, m_nrm)],
-                )
-                dmat[mi, ni] = res.x
+        return solve_foc(foc, 0.0, self.mMat, args=(self.mMat, self.nMat), x0=d0)
+
+    def solve_deposit_decision_with_jac(self, consumption_stage):
+        dmat, stats = self.solve_deposit_foc(
+            consumption_stage.multi_func, self.deposit_guess(consumption_stage)
+        )
 
         # add d = 0 when no liquid cash
         dmat_temp = np.insert(dmat, 0, 0.0, axis=0)
@@ -655,47 +789,61 @@ class PensionSolver(MetricObject):
         deposit_stage = DepositStage(
             d_func=d_func,
         )
+        deposit_stage.solver_stats = stats
 
         return deposit_stage
 
     def solve_vfi(self):
-        deposit_solution_next = self.solution_next.deposit_stage
-        post_decision_solution = self.solve_post_decision(deposit_solution_next)
+        # brute-force reference for the joint (c, d) choice: a grid search
+        # over the feasible simplex at every (m, n), polished all at once
+        deposit_stage_next = self.solution_next.deposit_stage
+        post_decision_stage = self.solve_post_decision(deposit_stage_next)
+        v_end_of_prd_func = post_decision_stage.v_func
 
-        def objective(control, m_nrm, n_nrm):
-            c_nrm = control[0]
-            d_nrm = control[1]
+        def value(c_nrm, d_nrm, m_nrm, n_nrm):
             a_nrm = m_nrm - c_nrm - d_nrm
             b_nrm = n_nrm + d_nrm + self.g(d_nrm)
-            value = self.u(c_nrm) + post_decision_solution.v_func(a_nrm, b_nrm)
-            return -value
-
-        cMat = np.empty_like(self.mMat)
-        dMat = np.empty_like(self.mMat)
-        for mi in range(self.mGrid.size):
-            for ni in range(self.nGrid.size):
-                m_nrm = self.mGrid[mi]
-                n_nrm = self.nGrid[mi]
-
-                bounds = Bounds([0, m_nrm], [0, m_nrm])
-                linear_constraint = LinearConstraint([1, 1], [0], [m_nrm])
-
-                sol = minimize(
-                    objective,
-                    x0=np.array([m_nrm / 2, m_nrm / 2]),
-                    args=(
-                        m_nrm,
-                        n_nrm,
-                    ),
-                    method="trust-constr",
-                    constraints=[linear_constraint],
-                    bounds=bounds,
-                )
-
-                cMat[mi, ni] = sol.x[0]
-                dMat[mi, ni] = sol.x[1]
+            return self.u(c_nrm) + v_end_of_prd_func(a_nrm, b_nrm)
+
+        # start from the policies of the egm solution or of the next period
+        guess = None
+        if self.VFIWarmStart == "egm":
+            consumption_stage = self.solve_consumption_decision(post_decision_stage)
+            deposit_stage = self.solve_deposit_decision(consumption_stage)
+        else:
+            deposit_stage = self.warm_start_stage(None)
+        if hasattr(deposit_stage, "c_func"):
+            guess = (
+                deposit_stage.c_func(self.mMat, self.nMat),
+                deposit_stage.d_func(self.mMat, self.nMat),
+            )
+
+        cMat, dMat, vMat, stats = maximize_simplex(
+            value,
+            self.mMat,
+            args=(self.nMat,),
+            x0=guess,
+            count=self.VFIGridCount,
+            tol=self.VFITol,
+        )
+
+        # envelope conditions: dv/dm = u'(c) and dv/dn = dv/db after the choice
+        aMat = self.mMat - cMat - dMat
+        bMat = self.nMat + dMat + self.g(dMat)
+        dvdn_nvrs = self.u.derinv(post_decision_stage.dvdb_func(aMat, bMat))
+
+        deposit_stage = self.make_deposit_stage(dMat, cMat, dvdn_nvrs, self.u.inv(vMat))
+        deposit_stage.solver_stats = stats
+
+        return WorkingSolution(
+            post_decision_stage=post_decision_stage,
+            deposit_stage=deposit_stage,
+        )
 
     def solve(self):
+        if self.SolveMethod == "vfi":
+            return self.solve_vfi()
+
         deposit_solution_next = self.solution_next.deposit_stage
 
         post_decision_solution = self.solve_post_decision(deposit_solution_next)
@@ -737,6 +885,33 @@ init_retirement_pension["IncUnemp"] = 0.0
 init_retirement_pension["UnempPrbRet"] = 0.0
 init_retirement_pension["IncUnempRet"] = 0.50
 init_retirement_pension["TasteShkStd"] = 0.10
+# "hark" for HARK interpolants and regressions, "numba" for compiled kernels
+init_retirement_pension["Backend"] = "hark"
+# deposit vfi: "joint" maximizes all grid points as one problem with
+# estimagic, "blocks" solves each point on its own, in blocks of
+# VFIBlockSize points spread over VFIWorkers workers of a "process" or
+# "thread" VFIPool; VFIWorkers also sets estimagic's cores
+init_retirement_pension["VFIMode"] = "joint"
+init_retirement_pension["VFIWorkers"] = 6
+init_retirement_pension["VFIPool"] = "process"
+init_retirement_pension["VFIBlockSize"] = 500
+# "egm" solves each period with the endogenous grid methods, "vfi" with a
+# grid search over VFIGridCount x VFIGridCount (spent, deposited) shares of m
+# polished to VFITol, as a reference
+init_retirement_pension["SolveMethod"] = "egm"
+init_retirement_pension["VFIGridCount"] = 20
+init_retirement_pension["VFITol"] = 1e-8
+# initial guess of the vfi and foc solvers: "none" starts from m / 2 (or a
+# grid search), "egm" from this period's egm policy and "previous" from the
+# policy of the period solved before; solver_stats on the deposit stage
+# reports iterations and convergence
+init_retirement_pension["VFIWarmStart"] = "none"
+# "clough-tocher" or a scattered-data interpolant of regression.py, e.g.
+# "approximate-gp" with {"rank": 500} for a linear-time gaussian process
+init_retirement_pension["DepositInterp"] = "clough-tocher"
+init_retirement_pension["DepositInterpKwargs"] = {}
+# agents simulated at once by simulate_panel, which bounds its memory
+init_retirement_pension["PanelChunkSize"] = 100_000
 
 init_retirement_pension["epsilon"] = 1e-6
 
@@ -1,5 +1,5 @@
 from copy import deepcopy
-from dataclasses import dataclass
+from dataclasses import dataclass, field
 
 import numpy as np
 from HARK.ConsumptionSaving.ConsPortfolioModel import init_portfolio
@@ -8,16 +8,42 @@ from HARK.core import make_one_period_oo_solver
 from HARK.distribution import DiscreteDistribution, calc_expectation
 from HARK.interpolation import (
     BilinearInterp,
-    GeneralizedRegressionUnstructuredInterp,
+    ConstantFunction,
+    IdentityFunction,
     LinearInterp,
-    LinearInterpOnInterp1D,
     MargValueFuncCRRA,
     ValueFuncCRRA,
-    calc_log_sum_choice_probs,
 )
 from HARK.metric import MetricObject
 from HARK.rewards import UtilityFuncCRRA, UtilityFuncStoneGeary
 from HARK.utilities import NullFunc, make_grid_exp_mult
+from interpolators import (
+    ComposedSumInterp,
+    MultiFuncCRRA,
+    StackedBilinearInterp,
+    WarpedBilinearInterp,
+    WarpedInterpOnInterp1D,
+    bilinear_matrix,
+)
+from numba_backend import deposit_envelope
+from numba_backend import deposit_stage as deposit_stage_numba
+from numba_backend import post_decision as post_decision_numba
+from regression import (
+    GaussianProcessInterp,
+    KroneckerWarpedInterp,
+    make_unstructured_interp,
+)
+from scipy import sparse
+from simulation import (
+    draw_atoms,
+    mask_dead,
+    newborns,
+    panel_periods,
+    pension_period,
+    period_solution,
+    simulate_panel,
+)
+from utilities import log_sum_choice, retired_cache, solve_foc
 
 
 @dataclass
@@ -33,6 +59,8 @@ class ConsumptionStage(MetricObject):
     v_func: ValueFuncCRRA = NullFunc()
     dvdl_func: MargValueFuncCRRA = NullFunc()
     dvdb_func: MargValueFuncCRRA = NullFunc()
+    # c, dvdl, dvdb and v from a single search of the shared knots
+    multi_func: MultiFuncCRRA = NullFunc()
 
 
 @dataclass
@@ -97,6 +125,19 @@ class RetirementConsumerType(RiskyAssetConsumerType):
         "RfreeA",
         "RfreeB",
         "TaxDeduct",
+        "Backend",
+        "DepositInterp",
+        "DepositInterpKwargs",
+        "GPKernelMode",
+        "DepositInversion",
+        "KroneckerKwargs",
+        "GPIncremental",
+        "AdaptiveTol",
+        "AdaptiveStride",
+        "AdaptiveBatch",
+        "AdaptiveMaxIter",
+        "RetiredCache",
+        "RetiredCacheDir",
     ]
 
     def __init__(self, **kwds):
@@ -112,12 +153,12 @@ class RetirementConsumerType(RiskyAssetConsumerType):
     def update(self):
         self.update_grids()
         super().update()
+        self.update_exp_matrices()
 
         # self.update_solution_terminal()
 
     def update_solution_terminal(self):
-        def c_func_retired(m):
-            return m
+        c_func_retired = IdentityFunction()
 
         # retired problem
         self.retired_solution = RetiredSolution(
@@ -126,8 +167,7 @@ class RetirementConsumerType(RiskyAssetConsumerType):
             v_func=ValueFuncCRRA(c_func_retired, self.CRRA),
         )
 
-        def c_func(m, n):
-            return m + n
+        c_func = ComposedSumInterp(IdentityFunction())
 
         vp_func = MargValueFuncCRRA(c_func, self.CRRA)
         v_func = ValueFuncCRRA(c_func, self.CRRA)
@@ -136,8 +176,7 @@ class RetirementConsumerType(RiskyAssetConsumerType):
             c_func=c_func, vp_func=vp_func, v_func=v_func
         )
 
-        def d_func(m, n):
-            return m * 0.0
+        d_func = ConstantFunction(0.0)
 
         deposit_stage = DepositStage(
             c_func=c_func,
@@ -146,6 +185,15 @@ class RetirementConsumerType(RiskyAssetConsumerType):
             dvdn_func=vp_func,
             v_func=v_func,
         )
+        # consumption is linear in (m, n) so it is exact on the nodes
+        mGrid_temp = np.append(0.0, self.mGrid)
+        cMat_temp = mGrid_temp[:, None] + self.nGrid
+        deposit_stage.nodes = {
+            "grids": [mGrid_temp, self.nGrid],
+            "dvdm_nvrs": cMat_temp,
+            "dvdn_nvrs": cMat_temp,
+            "v_nvrs": cMat_temp,
+        }
 
         self.working_solution = WorkingSolution(deposit_stage=deposit_stage)
 
@@ -203,6 +251,94 @@ class RetirementConsumerType(RiskyAssetConsumerType):
             "blMat",
         )
 
+    def update_exp_matrices(self):
+        # next period (m, n) states of every (shock, a, b) point land on the
+        # same cells of the common worker grid every period, so precompute the
+        # sparse bilinear interpolation matrix once per distinct distribution
+        grids = [np.append(0.0, self.mGrid), self.nGrid]
+        nNrm_next = self.RfreeB * self.bMat
+
+        ExpMatrix = []
+        for t, dstn in enumerate(self.TranShkDstn):
+            for t_prev in range(t):
+                if np.array_equal(dstn.atoms, self.TranShkDstn[t_prev].atoms):
+                    ExpMatrix.append(ExpMatrix[t_prev])
+                    break
+            else:
+                shocks = np.atleast_2d(dstn.atoms)[0, :, None, None]
+                mNrm_next = self.RfreeA * self.aMat + shocks
+                ExpMatrix.append(bilinear_matrix(grids, mNrm_next, nNrm_next))
+
+        self.ExpMatrix = ExpMatrix
+        self.add_to_time_vary("ExpMatrix")
+
+    def initialize_panel(self, size, rng):
+        state = newborns(self, size, rng, self.RfreeA)
+        state["retired"] = np.zeros(size, dtype=bool)
+
+        return state
+
+    def panel_transition(self, t, state, rng):
+        solution = period_solution(self, t)
+        t_cycle = t % self.T_cycle
+        m, n, retired = state["m"], state["n"], state["retired"]
+
+        # workers retire on their taste shocks, everyone does in the last period
+        prob_retiring = solution.worker_solution.probabilities.prob_retiring
+        if isinstance(prob_retiring, NullFunc):
+            retiring = ~retired
+        else:
+            retiring = ~retired & (rng.random(m.size) < prob_retiring(m, n))
+        working = ~retired & ~retiring
+
+        # retiring agents cash out the pension account and consume as retirees
+        d, c, a, b = (np.full(m.size, np.nan) for _ in range(4))
+        wealth = m[~working] + n[~working]
+        c[~working] = np.clip(solution.retired_solution.c_func(wealth), 0.0, wealth)
+        a[~working] = wealth - c[~working]
+
+        stages = solution.working_solution
+        d[working], c[working], a[working], b[working] = pension_period(
+            stages.deposit_stage,
+            stages.consumption_stage,
+            m[working],
+            n[working],
+            (self.TaxDeduct, 1.0, 1.0),
+        )
+
+        outputs = {
+            "m": m,
+            "n": n,
+            "d": d,
+            "c": c,
+            "a": a,
+            "b": b,
+            "retired": retired,
+            "retiring": retiring,
+        }
+        outputs = mask_dead(outputs, state["alive"])
+
+        theta = draw_atoms(self.TranShkDstn[t_cycle], m.size, rng)[0]
+        state["m"] = self.RfreeA * a + np.where(working, theta, self.IncUnempRet)
+        state["n"] = np.where(working, self.RfreeB * b, 0.0)
+        state["retired"] = ~working
+        state["alive"] &= rng.random(m.size) < self.LivPrb[t_cycle]
+
+        return outputs
+
+    def simulate_panel(self, agents=None, periods=None, seed=0, directory=None):
+        """
+        Simulate a panel of agents with the solved policies, see
+        `simulation.simulate_panel`. Defaults to AgentCount agents over the
+        agents' life, or T_sim periods if it is infinite.
+        """
+        agents = self.AgentCount if agents is None else agents
+        periods = panel_periods(self) if periods is None else periods
+
+        return simulate_panel(
+            self, agents, periods, self.PanelChunkSize, seed, directory
+        )
+
 
 @dataclass
 class RetirementSolver:
@@ -229,9 +365,25 @@ class RetirementSolver:
     blGrid: np.array
     lMat: np.ndarray
     blMat: np.array
+    ExpMatrix: sparse.csr_matrix = None
+    Backend: str = "hark"
+    DepositInterp: str = "gaussian-process"
+    DepositInterpKwargs: dict = field(default_factory=dict)
+    GPKernelMode: str = "refit"
+    DepositInversion: str = "regression"
+    KroneckerKwargs: dict = field(default_factory=dict)
+    GPIncremental: bool = False
+    AdaptiveTol: float = 1e-3
+    AdaptiveStride: int = 4
+    AdaptiveBatch: int = 100
+    AdaptiveMaxIter: int = 10
+    RetiredCache: bool = True
+    RetiredCacheDir: str = None
 
     def __post_init__(self):
         self.def_utility_funcs()
+        self.gp_kernels = {}
+        self.adaptive_stats = None
 
     def def_utility_funcs(self):
         self.u = UtilityFuncCRRA(self.CRRA)
@@ -240,6 +392,7 @@ class RetirementSolver:
         # which is gradually decreasing in the level of deposits
         # CRRA = 1 makes it log function
         self.g = UtilityFuncStoneGeary(CRRA=1.0, factor=self.TaxDeduct, shifter=1.0)
+        self.g_params = (self.TaxDeduct, 1.0, 1.0)
 
     def solve_retired_problem(self, solution_next):
         vp_func_next = solution_next.vp_func
@@ -287,13 +440,39 @@ class RetirementSolver:
 
         return retired_solution
 
+    def solve_retired_cached(self, retired_solution_next):
+        # the retired problem depends on a handful of parameters and on the
+        # retired solution it starts from, whose key in turn encodes the
+        # periods back to the terminal one, so keys chain period by period;
+        # the cache is shared across models, so the key names the class of
+        # the solution it stores
+        if not self.RetiredCache:
+            return self.solve_retired_problem(retired_solution_next)
+
+        key = retired_cache.make_key(
+            f"{RetiredSolution.__module__}.{RetiredSolution.__qualname__}",
+            getattr(retired_solution_next, "cache_key", "terminal"),
+            self.CRRA,
+            self.DiscFac,
+            self.RfreeA,
+            self.IncUnempRet,
+            self.aRetGrid,
+        )
+        retired_solution = retired_cache.get(key, self.RetiredCacheDir)
+        if retired_solution is None:
+            retired_solution = self.solve_retired_problem(retired_solution_next)
+            retired_solution.cache_key = key
+            retired_cache.put(key, retired_solution, self.RetiredCacheDir)
+
+        return retired_solution
+
     def solve_retiring_problem(self, retired_solution):
-        # this is kind of pointless
+        # a retiring agent cashes out the pension account
         retiring_solution = RetiringSolution(
-            c_func=lambda m, n: retired_solution.c_func(m + n),
-            d_func=lambda m, n: m * 0.0,
-            vp_func=lambda m, n: retired_solution.vp_func(m + n),
-            v_func=lambda m, n: retired_solution.v_func(m + n),
+            c_func=ComposedSumInterp(retired_solution.c_func),
+            d_func=ConstantFunction(0.0),
+            vp_func=ComposedSumInterp(retired_solution.vp_func),
+            v_func=ComposedSumInterp(retired_solution.v_func),
         )
 
         return retiring_solution
@@ -313,10 +492,52 @@ class RetirementSolver:
             v_end = v_func_next(mnrm_next, nnrm_next)
             return dvda, dvdb, v_end
 
-        conditional_values = self.DiscFac * calc_expectation(
-            self.TranShkDstn, conditional_funcs, self.aMat, self.bMat
+        nodes = getattr(deposit_stage_next, "nodes", None)
+        use_matrix = (
+            nodes is not None
+            and self.ExpMatrix is not None
+            and self.ExpMatrix.shape[1] == nodes["v_nvrs"].size
         )
 
+        if nodes is not None and self.Backend == "numba":
+            shocks = np.atleast_2d(self.TranShkDstn.atoms)[0]
+            nodal_values = np.stack(
+                [nodes["v_nvrs"], nodes["dvdm_nvrs"], nodes["dvdn_nvrs"]]
+            )
+            v_end, dvda, dvdb = post_decision_numba(
+                self.aGrid,
+                self.bGrid,
+                np.ones_like(shocks),
+                shocks,
+                np.full_like(shocks, self.RfreeB),
+                self.TranShkDstn.pmv,
+                self.RfreeA,
+                *nodes["grids"],
+                nodal_values,
+                self.CRRA,
+                self.DiscFac,
+            )
+            # returns are applied below
+            conditional_values = (dvda / self.RfreeA, dvdb / self.RfreeB, v_end)
+        elif use_matrix:
+            # interpolation is a single sparse mat-vec on next period's nodes
+            nodal_values = np.stack(
+                [nodes["dvdm_nvrs"], nodes["dvdn_nvrs"], nodes["v_nvrs"]], axis=-1
+            ).reshape(-1, 3)
+            interp = self.ExpMatrix @ nodal_values
+            shape = (3, self.TranShkDstn.pmv.size) + self.aMat.shape
+            dvdm_nvrs, dvdn_nvrs, v_nvrs = interp.T.reshape(shape)
+            conditional_values = np.stack(
+                [self.u.der(dvdm_nvrs), self.u.der(dvdn_nvrs), self.u(v_nvrs)]
+            )
+            conditional_values = self.DiscFac * np.tensordot(
+                conditional_values, self.TranShkDstn.pmv, axes=([1], [0])
+            )
+        else:
+            conditional_values = self.DiscFac * calc_expectation(
+                self.TranShkDstn, conditional_funcs, self.aMat, self.bMat
+            )
+
         # TODO: what happens at a, b = 0.0?
         # probably nothing at a = 0 as long as min(shock) > 0
         dvda, dvdb, v_end = conditional_values
@@ -348,13 +569,9 @@ class RetirementSolver:
         return post_decision_stage
 
     def interp_on_interp(self, values, grids):
-        temp = []
         x, y = grids
-        grid = y[0]
-        for i in range(grid.size):
-            temp.append(LinearInterp(x[:, i], values[:, i]))
 
-        return LinearInterpOnInterp1D(temp, grid)
+        return WarpedInterpOnInterp1D(values, x, y[0])
 
     def solve_consumption_stage(self, post_decision_stage):
         dvda_nvrs_next = post_decision_stage.dvda_nvrs
@@ -369,42 +586,144 @@ class RetirementSolver:
         cMat_temp = np.insert(cMat, 0, 0.0, axis=0)
         np.insert(self.bMat, 0, 0.0, axis=0)
 
-        # bMat is a regular grid, lMat is not so we'll need to use Warped
-
-        c_func = self.interp_on_interp(cMat_temp, [lMat_temp, self.bMat])
-        dvdl_func = MargValueFuncCRRA(c_func, self.CRRA)
-
         # again, at l = 0, c = 0 and a = 0, so repeat dvdb[0]
         dvdb_nvrs_temp = np.insert(dvdb_nvrs_next, 0, dvdb_nvrs_next[0], axis=0)
-        dvdb_nvrs_func = self.interp_on_interp(dvdb_nvrs_temp, [lMat_temp, self.bMat])
-        dvdb_func = MargValueFuncCRRA(dvdb_nvrs_func, self.CRRA)
 
         # make value function
         value = self.u(cMat) - self.DisutilLabor + value_next
         v_nvrs = self.u.inv(value)
         v_nvrs_temp = np.insert(v_nvrs, 0, 0.0, axis=0)
 
-        # bMat is regular grid so we can use WarpedInterpOnInterp2D
-        v_nvrs_func = self.interp_on_interp(v_nvrs_temp, [lMat_temp, self.bMat])
-        v_func = ValueFuncCRRA(v_nvrs_func, self.CRRA)
+        # bMat is a regular grid, lMat is not so we'll need to use Warped;
+        # c, dvdb and v share their knots, so stack them and read each
+        # function off as a channel of the stack
+        nvrs_interp = self.interp_on_interp(
+            np.stack([cMat_temp, dvdb_nvrs_temp, v_nvrs_temp]), [lMat_temp, self.bMat]
+        )
+        multi_func = MultiFuncCRRA(
+            nvrs_interp,
+            self.CRRA,
+            [(0, "level"), (0, "marg"), (1, "marg"), (2, "value")],
+        )
+
+        c_func = nvrs_interp.channel(0)
+        dvdl_func = MargValueFuncCRRA(c_func, self.CRRA)
+        dvdb_func = MargValueFuncCRRA(nvrs_interp.channel(1), self.CRRA)
+        v_func = ValueFuncCRRA(nvrs_interp.channel(2), self.CRRA)
 
         consumption_stage = ConsumptionStage(
             c_func=c_func,
             v_func=v_func,
             dvdl_func=dvdl_func,
             dvdb_func=dvdb_func,
+            multi_func=multi_func,
         )
+        consumption_stage.nodes = {
+            "lMat": lMat_temp,
+            "bGrid": self.bGrid,
+            "c": cMat_temp,
+            "dvdb_nvrs": dvdb_nvrs_temp,
+            "v_nvrs": v_nvrs_temp,
+        }
 
         return consumption_stage
 
+    def gp_kernels_next(self):
+        deposit_stage_next = self.solution_next.working_solution.deposit_stage
+
+        return getattr(deposit_stage_next, "gp_kernels", {})
+
+    def make_deposit_interp(self, values, grids, name):
+        # scattered-data interpolant of the endogenous (m, n) points
+        kwargs = dict(self.DepositInterpKwargs)
+
+        # surfaces change smoothly across periods, so next period's fitted
+        # kernel is a good guess for (or a fixed choice of) this period's
+        kernel_next = self.gp_kernels_next().get(name)
+        if kernel_next is not None and self.GPKernelMode != "refit":
+            kwargs["kernel"] = kernel_next
+            if self.GPKernelMode == "fixed":
+                kwargs["optimizer"] = None
+
+        interp = make_unstructured_interp(values, grids, self.DepositInterp, **kwargs)
+        self.gp_kernels[name] = getattr(interp, "kernel_", None)
+
+        return interp
+
+    def make_adaptive_deposit_interp(self, multi_func_next, dMat, mMat, nMat):
+        # fit d on a coarse subgrid of the egm points, then add egm points
+        # only where the predictive std on the common grid is above tolerance
+        def coarse(count):
+            # every AdaptiveStride-th index and the last one
+            return np.union1d(np.arange(0, count, self.AdaptiveStride), count - 1)
+
+        sub = np.ix_(coarse(dMat.shape[0]), coarse(dMat.shape[1]))
+        values = np.where(dMat[sub] > -1.0, dMat[sub], np.nan)
+        interp = self.make_deposit_interp(values, [mMat[sub], nMat[sub]], "dMat")
+        if not isinstance(interp, GaussianProcessInterp):
+            raise ValueError(
+                "Adaptive deposit sampling needs a predictive std, "
+                "use DepositInterp='gaussian-process'."
+            )
+
+        mGrid = self.mMat.ravel()
+        nGrid = self.nMat.ravel()
+        std = interp.std(mGrid, nGrid)
+        iterations = 0
+        while iterations < self.AdaptiveMaxIter and np.any(std > self.AdaptiveTol):
+            uncertain = np.flatnonzero(std > self.AdaptiveTol)
+            uncertain = uncertain[np.argsort(std[uncertain])[::-1]]
+            uncertain = uncertain[: self.AdaptiveBatch]
+
+            # exogenous points whose egm image should land on the uncertain
+            # points, given the current guess of d there
+            m_new = mGrid[uncertain]
+            n_new = nGrid[uncertain]
+            d_new = np.clip(interp(m_new, n_new), 0.0, m_new)
+            l_new = m_new - d_new
+            bl_new = n_new + d_new + self.g(d_new)
+
+            dvdl_next, dvdb_next = multi_func_next.marginals(l_new, bl_new)
+            d_new = self.g.derinv(dvdl_next / dvdb_next - 1.0)
+
+            # update takes the targets in the layout the interpolant was
+            # created with, i.e. the coarse subgrid including dropped points
+            # on the first round and the kept points afterwards
+            interp = interp.update(
+                values,
+                np.where(d_new > -1.0, d_new, np.nan),
+                [l_new + d_new, bl_new - d_new - self.g(d_new)],
+            )
+            values = interp.values
+            std = interp.std(mGrid, nGrid)
+            iterations += 1
+
+        self.adaptive_stats = {
+            "points": interp.points.shape[0],
+            "iterations": iterations,
+            "max_std": np.max(std),
+        }
+
+        return interp
+
+    def solve_deposit_foc(self, multi_func_next, d0=None):
+        # deposit foc on the whole common grid at once, with corners at 0 and m
+        def foc(d_nrm, m_nrm, n_nrm):
+            l_nrm = m_nrm - d_nrm
+            b_nrm = n_nrm + d_nrm + self.g(d_nrm)
+            dvdl, dvdb = multi_func_next.marginals(l_nrm, b_nrm)
+
+            return -dvdl + dvdb * (1 + self.g.der(d_nrm))
+
+        return solve_foc(foc, 0.0, self.mMat, args=(self.mMat, self.nMat), x0=d0)
+
     def solve_deposit_stage(self, consumption_stage):
-        c_func_next = consumption_stage.c_func
-        v_func_next = consumption_stage.v_func
-        dvdl_func_next = consumption_stage.dvdl_func
-        dvdb_func_next = consumption_stage.dvdb_func
+        if self.Backend == "numba":
+            return self.solve_deposit_stage_numba(consumption_stage)
+
+        multi_func_next = consumption_stage.multi_func
 
-        dvdl_next = dvdl_func_next(self.lMat, self.blMat)
-        dvdb_next = dvdb_func_next(self.lMat, self.blMat)
+        dvdl_next, dvdb_next = multi_func_next.marginals(self.lMat, self.blMat)
 
         # endogenous grid method
         dMat = self.g.derinv(dvdl_next / dvdb_next - 1.0)
@@ -412,52 +731,95 @@ class RetirementSolver:
         mMat = self.lMat + dMat
         nMat = self.blMat - dMat - self.g(dMat)
 
-        gaussian_interp_grid0 = GeneralizedRegressionUnstructuredInterp(
-            self.lMat,
-            [mMat, nMat],
-            model="gaussian-process",
-            std=True,
-            model_kwargs={"normalize_y": True},
-        )
-
-        gaussian_interp_grid1 = GeneralizedRegressionUnstructuredInterp(
-            self.blMat,
-            [mMat, nMat],
-            model="gaussian-process",
-            std=True,
-            model_kwargs={"normalize_y": True},
-        )
-
-        # interpolate grids
-        lMat_temp = gaussian_interp_grid0(self.mMat, self.nMat)
-        blMat_temp = gaussian_interp_grid1(self.mMat, self.nMat)
-
-        # calculate derivatives
-        dvdl_next = dvdl_func_next(lMat_temp, blMat_temp)
-        dvdb_next = dvdb_func_next(lMat_temp, blMat_temp)
-
-        # endogenous grid method
-        dMat2 = self.g.derinv(dvdl_next / dvdb_next - 1.0)
-        mMat2 = lMat_temp + dMat2
-        nMat2 = blMat_temp - dMat2 - self.g(dMat2)
-
-        # concatenate grids
-        dMat = np.concatenate((dMat.flatten(), dMat2.flatten()))
-        mMat = np.concatenate((mMat.flatten(), mMat2.flatten()))
-        nMat = np.concatenate((nMat.flatten(), nMat2.flatten()))
-
-        cond = dMat > -1.0
-        dMat = dMat[cond]
-        nMat = nMat[cond]
-        mMat = mMat[cond]
-
-        gaussian_interp = GeneralizedRegressionUnstructuredInterp(
-            dMat,
-            [mMat, nMat],
-            model="gaussian-process",
-            std=True,
-            model_kwargs={"normalize_y": True},
-        )
+        if self.DepositInversion == "foc":
+            # no inversion at all, solve the foc on the common grid directly
+            dMat_foc, _ = self.solve_deposit_foc(multi_func_next)
+            gaussian_interp = BilinearInterp(dMat_foc, self.mGrid, self.nGrid)
+        elif self.DepositInversion == "envelope":
+            # where the foc has several solutions the egm mesh folds over
+            # itself, so scan its simplices onto the common grid and keep the
+            # deposit with the highest value of choice at each point
+            dMat_env = deposit_envelope(
+                consumption_stage.nodes,
+                dMat,
+                mMat,
+                nMat,
+                self.mGrid,
+                self.nGrid,
+                self.CRRA,
+                self.g_params,
+            )
+            gaussian_interp = BilinearInterp(dMat_env, self.mGrid, self.nGrid)
+        elif self.DepositInversion == "adaptive":
+            gaussian_interp = self.make_adaptive_deposit_interp(
+                multi_func_next, dMat, mMat, nMat
+            )
+        elif self.DepositInversion == "kronecker":
+            # m, n and d all live on the tensor (l, bl) grid, so smooth them
+            # with a kronecker structured gp and invert the smoothed mesh;
+            # nodes outside the domain of g are filled from their neighbors
+            # rather than smoothed as data
+            valid = dMat > -1.0
+            gaussian_interp = KroneckerWarpedInterp(
+                np.where(valid, dMat, np.nan),
+                [np.where(valid, mMat, np.nan), np.where(valid, nMat, np.nan)],
+                [self.lGrid, self.blGrid],
+                **self.KroneckerKwargs,
+            )
+        else:
+            # interpolate grids
+            if self.DepositInversion == "warped":
+                # (m, n) is a smooth warp of the regular (l, bl) grid, so locate
+                # the common grid in the warped mesh instead of regressing on it;
+                # points outside the mesh are nan and drop out below
+                warped_interp = WarpedBilinearInterp(
+                    np.stack([self.lMat, self.blMat]), [mMat, nMat]
+                )
+                lMat_temp, blMat_temp = warped_interp(self.mMat, self.nMat)
+                gaussian_interp_grids = None
+            else:
+                # l and bl are fitted on the same points, so fit them together
+                # and share one factorization of the kernel matrix
+                gaussian_interp_grids = self.make_deposit_interp(
+                    np.stack([self.lMat, self.blMat]), [mMat, nMat], "grids"
+                )
+
+                lMat_temp, blMat_temp = gaussian_interp_grids(self.mMat, self.nMat)
+
+            # calculate derivatives
+            dvdl_next, dvdb_next = multi_func_next.marginals(lMat_temp, blMat_temp)
+
+            # endogenous grid method
+            dMat2 = self.g.derinv(dvdl_next / dvdb_next - 1.0)
+            mMat2 = lMat_temp + dMat2
+            nMat2 = blMat_temp - dMat2 - self.g(dMat2)
+
+            if self.GPIncremental and isinstance(
+                gaussian_interp_grids, GaussianProcessInterp
+            ):
+                # the first pass sits on the points of the grids fit, so reuse its
+                # factorization: drop points outside the domain of g and append
+                # the second pass instead of refitting on the union. d inherits
+                # the kernel fitted to l and bl, so record it as the d kernel
+                # for GPKernelMode in the previous period
+                gaussian_interp = gaussian_interp_grids.update(
+                    np.where(dMat > -1.0, dMat, np.nan),
+                    np.where(dMat2 > -1.0, dMat2, np.nan),
+                    [mMat2, nMat2],
+                )
+                self.gp_kernels["dMat"] = gaussian_interp.kernel_
+            else:
+                # concatenate grids
+                dMat = np.concatenate((dMat.flatten(), dMat2.flatten()))
+                mMat = np.concatenate((mMat.flatten(), mMat2.flatten()))
+                nMat = np.concatenate((nMat.flatten(), nMat2.flatten()))
+
+                cond = dMat > -1.0
+                dMat = dMat[cond]
+                nMat = nMat[cond]
+                mMat = mMat[cond]
+
+                gaussian_interp = self.make_deposit_interp(dMat, [mMat, nMat], "dMat")
 
         # evaluate d on common grid
         dMat = gaussian_interp(self.mMat, self.nMat)
@@ -465,8 +827,32 @@ class RetirementSolver:
         lMat = self.mMat - dMat
         blMat = self.nMat + dMat + self.g(dMat)
 
-        # evaluate c on common grid
-        cMat = c_func_next(lMat, blMat)
+        # evaluate c, dvdn and v on common grid, without re-transforming
+        cMat, dvdn_nvrs, v_nvrs = multi_func_next.interp(lMat, blMat)
+
+        deposit_stage = self.make_deposit_stage(dMat, cMat, dvdn_nvrs, v_nvrs)
+        deposit_stage.interp = gaussian_interp
+        deposit_stage.gp_kernels = self.gp_kernels
+        deposit_stage.adaptive_stats = self.adaptive_stats
+
+        return deposit_stage
+
+    def solve_deposit_stage_numba(self, consumption_stage):
+        # egm on the exogenous grid, then a simplex scan of the warped mesh
+        # onto the common grid; the foc is solved directly where it has holes
+        dMat, cMat, dvdn_nvrs, v_nvrs = deposit_stage_numba(
+            consumption_stage.nodes,
+            self.lMat,
+            self.blMat,
+            self.mGrid,
+            self.nGrid,
+            self.CRRA,
+            self.g_params,
+        )
+
+        return self.make_deposit_stage(dMat, cMat, dvdn_nvrs, v_nvrs)
+
+    def make_deposit_stage(self, dMat, cMat, dvdn_nvrs, v_nvrs):
         # there is no consumption or deposit when there is no cash on hand
         mGrid_temp = np.append(0.0, self.mGrid)
         dMat_temp = np.insert(dMat, 0, 0.0, axis=0)
@@ -476,19 +862,13 @@ class RetirementSolver:
         c_func = BilinearInterp(cMat_temp, mGrid_temp, self.nGrid)
         dvdm_func = MargValueFuncCRRA(c_func, self.CRRA)
 
-        dvdb_next = dvdb_func_next(lMat, blMat)
-
-        dvdn_nvrs = self.u.derinv(dvdb_next)
         dvdn_nvrs_temp = np.insert(dvdn_nvrs, 0, dvdn_nvrs[0], axis=0)
         dvdn_nvrs_func = BilinearInterp(dvdn_nvrs_temp, mGrid_temp, self.nGrid)
         dvdn_func = MargValueFuncCRRA(dvdn_nvrs_func, self.CRRA)
 
         # make value function
-        value = v_func_next(lMat, blMat)
-        v_nvrs = self.u.inv(value)
         # insert value of 0 at m = 0
         v_nvrs_temp = np.insert(v_nvrs, 0, 0.0, axis=0)
-        # mMat and nMat are irregular grids so we need Curvilinear2DInterp
         v_nvrs_func = BilinearInterp(v_nvrs_temp, mGrid_temp, self.nGrid)
         v_func = ValueFuncCRRA(v_nvrs_func, self.CRRA)
 
@@ -499,8 +879,14 @@ class RetirementSolver:
             dvdm_func=dvdm_func,
             dvdn_func=dvdn_func,
         )
-
-        deposit_stage.interp = gaussian_interp
+        # nodal values on the grid of the worker's discrete choice
+        deposit_stage.nodes = {
+            "grids": [mGrid_temp, self.nGrid],
+            "c": cMat_temp,
+            "d": dMat_temp,
+            "dvdn_nvrs": dvdn_nvrs_temp,
+            "v_nvrs": v_nvrs_temp,
+        }
 
         return deposit_stage
 
@@ -519,78 +905,89 @@ class RetirementSolver:
 
         return working_solution
 
-    def solve_worker_problem(self, working_solution, retiring_solution):
-        vWorking_func = working_solution.deposit_stage.v_func
-        cWorking_func = working_solution.deposit_stage.c_func
-        dWorking_func = working_solution.deposit_stage.d_func
-        dvdmWorking_func = working_solution.deposit_stage.dvdm_func
-        dvdnWorking_func = working_solution.deposit_stage.dvdn_func
+    def working_channels(self, deposit_stage, mMat_temp, nMat_temp):
+        # c, d, dvdn and v of working on the worker's grid, read off the
+        # nodes when the working stage was built on that same grid
+        nodes = getattr(deposit_stage, "nodes", None)
+        if nodes is not None and "c" in nodes and nodes["c"].shape == mMat_temp.shape:
+            return (
+                nodes["c"],
+                nodes["d"],
+                self.u.der(nodes["dvdn_nvrs"]),
+                self.u(nodes["v_nvrs"]),
+            )
+
+        return (
+            deposit_stage.c_func(mMat_temp, nMat_temp),
+            deposit_stage.d_func(mMat_temp, nMat_temp),
+            deposit_stage.dvdn_func(mMat_temp, nMat_temp),
+            deposit_stage.v_func(mMat_temp, nMat_temp),
+        )
 
+    def solve_worker_problem(self, working_solution, retiring_solution):
+        mGrid_temp = np.append(0.0, self.mGrid)
         mMat_temp = np.insert(self.mMat, 0, 0.0, axis=0)
         nMat_temp = np.insert(self.nMat, 0, self.nGrid, axis=0)
 
-        vRetiring = retiring_solution.v_func(mMat_temp, nMat_temp)
-        cRetiring = retiring_solution.c_func(mMat_temp, nMat_temp)
-        vPRetiring = retiring_solution.vp_func(mMat_temp, nMat_temp)
-
-        vWorking = vWorking_func(mMat_temp, nMat_temp)
-        cWorking = cWorking_func(mMat_temp, nMat_temp)
-        dWorking = dWorking_func(mMat_temp, nMat_temp)
-        dvdmWorking = dvdmWorking_func(mMat_temp, nMat_temp)
-        dvdnWorking = dvdnWorking_func(mMat_temp, nMat_temp)
-
-        vWorker, prbs = calc_log_sum_choice_probs(
-            [vWorking, vRetiring], self.TasteShkStd
+        cWorking, dWorking, dvdnWorking, vWorking = self.working_channels(
+            working_solution.deposit_stage, mMat_temp, nMat_temp
         )
 
-        vWorkerNvrs = self.u.inv(vWorker)
-        vWorkerNvrs[0, 0] = 0.0
-
-        prbWorking, prbRetiring = prbs
-        prbWorking[0, 0] = 0.0
-        prbRetiring[0, 0] = 1.0
-
-        mGrid_temp = np.append(0.0, self.mGrid)
+        # retiring consumes everything, so its marginal value is u'(c)
+        cRetiring = retiring_solution.c_func(mMat_temp, nMat_temp)
+        vRetiring = retiring_solution.v_func(mMat_temp, nMat_temp)
 
-        vWorkerNvrsFunc = BilinearInterp(vWorkerNvrs, mGrid_temp, self.nGrid)
-        vWorkerFunc = ValueFuncCRRA(vWorkerNvrsFunc, self.CRRA)
+        # one stack for every channel of the worker, filled in place
+        names = ("c", "d", "dvdm_nvrs", "dvdn_nvrs", "v_nvrs", "working", "retiring")
+        stack = np.empty((len(names),) + mMat_temp.shape)
+        prbs = stack[5:]
+        prbs[0] = vWorking
+        prbs[1] = vRetiring
 
-        # if m = 0, work for sure is the limit
-        prbRetiring = prbs[0]
-        prbWorking = prbs[1]
+        vWorker, prbs = log_sum_choice(prbs, self.TasteShkStd)
 
-        prbWorkingFunc = BilinearInterp(prbWorking, mGrid_temp, self.nGrid)
-        prbRetiringFunc = BilinearInterp(prbRetiring, mGrid_temp, self.nGrid)
+        # with no cash at all the agent retires for sure
+        prbs[:, 0, 0] = [0.0, 1.0]
+        prbWorking, prbRetiring = prbs
 
-        # agent who is working and has no cash consumes 0
-        cWorker = prbWorking * cWorking + prbWorking * cRetiring
-        dWorker = prbWorking * dWorking
+        def expect(working, retiring):
+            # a choice made with probability 0 adds nothing, even if its
+            # marginal value is infinite
+            with np.errstate(invalid="ignore"):
+                working = np.where(prbWorking > 0.0, prbWorking * working, 0.0)
+                retiring = np.where(prbRetiring > 0.0, prbRetiring * retiring, 0.0)
 
-        cWorkerFunc = BilinearInterp(cWorker, mGrid_temp, self.nGrid)
-        dWorkerFunc = BilinearInterp(dWorker, mGrid_temp, self.nGrid)
+            return working + retiring
 
-        # need to add an empty axis, value doesn't Matter because at m=0
-        # agent retires with probability 1.0
-        dvdmWorker = prbWorking * dvdmWorking + prbRetiring * vPRetiring
-        dvdmWorkerNvrs = self.u.derinv(dvdmWorker)
-        dvdmWorkerNvrsFunc = BilinearInterp(dvdmWorkerNvrs, mGrid_temp, self.nGrid)
-        dvdmWorkerFunc = MargValueFuncCRRA(dvdmWorkerNvrsFunc, self.CRRA)
+        vPRetiring = self.u.der(cRetiring)
+        stack[0] = expect(cWorking, cRetiring)
+        stack[1] = expect(dWorking, 0.0)
+        stack[2] = self.u.derinv(expect(self.u.der(cWorking), vPRetiring))
+        stack[3] = self.u.derinv(expect(dvdnWorking, vPRetiring))
+        stack[4] = self.u.inv(vWorker)
+        stack[4, 0, 0] = 0.0
 
-        dvdnWorker = prbWorking * dvdnWorking + prbRetiring * vPRetiring
-        dvdnWorkerNvrs = self.u.derinv(dvdnWorker)
-        dvdnWorkerNvrsFunc = BilinearInterp(dvdnWorkerNvrs, mGrid_temp, self.nGrid)
-        dvdnWorkerFunc = MargValueFuncCRRA(dvdnWorkerNvrsFunc, self.CRRA)
+        worker_interp = StackedBilinearInterp(stack, [mGrid_temp, self.nGrid], names)
 
         deposit_solution = DepositStage(
-            c_func=cWorkerFunc,
-            d_func=dWorkerFunc,
-            dvdm_func=dvdmWorkerFunc,
-            dvdn_func=dvdnWorkerFunc,
-            v_func=vWorkerFunc,
+            c_func=worker_interp.channel("c"),
+            d_func=worker_interp.channel("d"),
+            dvdm_func=MargValueFuncCRRA(worker_interp.channel("dvdm_nvrs"), self.CRRA),
+            dvdn_func=MargValueFuncCRRA(worker_interp.channel("dvdn_nvrs"), self.CRRA),
+            v_func=ValueFuncCRRA(worker_interp.channel("v_nvrs"), self.CRRA),
         )
+        deposit_solution.interp = worker_interp
+        # nodal values let next period's post decision stage skip interpolation
+        deposit_solution.nodes = {
+            "grids": [mGrid_temp, self.nGrid],
+            "dvdm_nvrs": stack[2],
+            "dvdn_nvrs": stack[3],
+            "v_nvrs": stack[4],
+        }
 
         probabilities = DiscreteChoiceProbabilities(
-            prob_working=prbWorkingFunc, prob_retiring=prbRetiringFunc
+            prob_working=worker_interp.channel("working"),
+            prob_retiring=worker_interp.channel("retiring"),
         )
 
         worker_solution = WorkerSolution(
@@ -603,7 +1000,7 @@ class RetirementSolver:
         retired_solution_next = self.solution_next.retired_solution
         worker_solution_next = self.solution_next.worker_solution
 
-        self.retired_solution = self.solve_retired_problem(retired_solution_next)
+        self.retired_solution = self.solve_retired_cached(retired_solution_next)
         self.retiring_solution = self.solve_retiring_problem(self.retired_solution)
         self.working_solution = self.solve_working_problem(worker_solution_next)
         self.worker_solution = self.solve_worker_problem(
@@ -639,6 +1036,43 @@ init_retirement_pension["IncUnemp"] = 0.0
 init_retirement_pension["UnempPrbRet"] = 0.0
 init_retirement_pension["IncUnempRet"] = 0.50
 init_retirement_pension["TasteShkStd"] = 0.1
+# "hark" for HARK interpolants and regressions, "numba" for compiled kernels
+init_retirement_pension["Backend"] = "hark"
+# scattered-data interpolant of the deposit stage, see regression.py;
+# "approximate-gp" fits in linear time, with its rank in DepositInterpKwargs,
+# and reports its error on held-out egm points in `holdout_error`; a
+# "max_memory" entry caps the bytes of each chunk of predictions
+init_retirement_pension["DepositInterp"] = "gaussian-process"
+init_retirement_pension["DepositInterpKwargs"] = {}
+# "refit" fits each period's gaussian processes from scratch, "warm-start"
+# starts from next period's fitted kernels and "fixed" reuses them as is
+init_retirement_pension["GPKernelMode"] = "refit"
+# "regression" maps the common grid back to (l, bl) with the deposit
+# interpolant, "warped" inverts the egm mesh directly and "kronecker" inverts
+# it after smoothing with a gp on the (l, bl) grid (options in KroneckerKwargs);
+# "adaptive" fits d on every AdaptiveStride-th egm point and adds egm points
+# in batches where the gp std on the common grid exceeds AdaptiveTol;
+# "envelope" skips the regression and keeps the egm branch with the highest
+# value at each common grid point, solving the foc where the mesh has holes;
+# "foc" solves the foc on the whole common grid with safeguarded newton steps
+init_retirement_pension["DepositInversion"] = "regression"
+# options of KroneckerWarpedInterp, e.g. "refine" and "length_scale"
+init_retirement_pension["KroneckerKwargs"] = {}
+# update the factorization of the grids fit with the second egm pass instead
+# of refitting the deposit gaussian process on all points; d then uses the
+# kernel fitted to the grids
+init_retirement_pension["GPIncremental"] = False
+init_retirement_pension["AdaptiveTol"] = 1e-3
+init_retirement_pension["AdaptiveStride"] = 4
+init_retirement_pension["AdaptiveBatch"] = 100
+init_retirement_pension["AdaptiveMaxIter"] = 10
+# reuse retired-phase solutions of agents with the same CRRA, DiscFac,
+# RfreeA, IncUnempRet and aRetGrid; RetiredCacheDir also pickles them there
+# so that later runs can load them, utilities.retired_cache sets the size
+init_retirement_pension["RetiredCache"] = True
+init_retirement_pension["RetiredCacheDir"] = None
+# agents simulated at once by simulate_panel, which bounds its memory
+init_retirement_pension["PanelChunkSize"] = 100_000
 
 init_retirement_pension["epsilon"] = 1e-8
 
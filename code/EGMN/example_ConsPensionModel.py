@@ -216,19 +216,17 @@ fig.savefig(figures_path + "ExogenousGrid.svg")
 grids = agent.solution[T].consumption_stage.grids_before_cleanup
 
 # %%
-from HARK.interpolation._sklearn import GeneralizedRegressionUnstructuredInterp
+from regression import GaussianProcessInterp
 
 # %%
-gauss_interp = GeneralizedRegressionUnstructuredInterp(
-    grids["dMat"],
-    [grids["mMat"], grids["nMat"]],
-    model="gaussian-process",
-    std=True,
-    model_kwargs={"normalize_y": True},
-)
+gauss_interp = GaussianProcessInterp(grids["dMat"], [grids["mMat"], grids["nMat"]])
 
 # %%
 get_ipython().run_line_magic("matplotlib", "widget")
 plot_3d_func(gauss_interp, 0, 5)
 
 # %%
+# the predictive std is only computed on request
+plot_3d_func(gauss_interp.std, 0, 5)
+
+# %%
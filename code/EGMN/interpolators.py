@@ -0,0 +1,475 @@
+from copy import copy
+
+import numpy as np
+from HARK.metric import MetricObject
+from HARK.rewards import CRRAutility, CRRAutilityP
+from numba_backend import interp_on_interp
+from scipy import sparse
+from scipy.spatial import cKDTree
+
+
+def bilinear_coords(grids, x, y):
+    """
+    Find bracketing indices and weights of query points on a rectilinear grid.
+
+    Points outside the grid are extrapolated linearly from the edge cells, which
+    matches the default behavior of `LinearFast` and `BilinearInterp`.
+
+    Parameters
+    ----------
+    grids : list of np.array
+        The two 1-D grids spanning the rectilinear grid.
+    x, y : np.ndarray
+        Query points, broadcastable to a common shape.
+
+    Returns
+    -------
+    tuple
+        Lower indices (ix, iy) and weights (wx, wy) of the upper neighbors.
+    """
+    xgrid, ygrid = grids
+    x, y = np.broadcast_arrays(x, y)
+
+    ix = np.clip(np.searchsorted(xgrid, x) - 1, 0, xgrid.size - 2)
+    iy = np.clip(np.searchsorted(ygrid, y) - 1, 0, ygrid.size - 2)
+
+    wx = (x - xgrid[ix]) / (xgrid[ix + 1] - xgrid[ix])
+    wy = (y - ygrid[iy]) / (ygrid[iy + 1] - ygrid[iy])
+
+    return ix, iy, wx, wy
+
+
+def bilinear_eval(values, coords):
+    """
+    Evaluate one or several stacked bilinear interpolants at precomputed coords.
+
+    Parameters
+    ----------
+    values : np.ndarray
+        Function values on the grid with shape (nx, ny), or a stack of
+        several functions on the same grid with shape (k, nx, ny).
+    coords : tuple
+        Output of `bilinear_coords`.
+
+    Returns
+    -------
+    np.ndarray
+        Interpolated values with shape of the query points, prefixed by k
+        if several functions were stacked.
+    """
+    ix, iy, wx, wy = coords
+
+    return (
+        values[..., ix, iy] * (1 - wx) * (1 - wy)
+        + values[..., ix + 1, iy] * wx * (1 - wy)
+        + values[..., ix, iy + 1] * (1 - wx) * wy
+        + values[..., ix + 1, iy + 1] * wx * wy
+    )
+
+
+def bilinear_matrix(grids, x, y):
+    """
+    Build the sparse matrix that maps nodal values on a rectilinear grid to
+    bilinear interpolated values at fixed query points.
+
+    Parameters
+    ----------
+    grids : list of np.array
+        The two 1-D grids spanning the rectilinear grid.
+    x, y : np.ndarray
+        Query points, broadcastable to a common shape.
+
+    Returns
+    -------
+    scipy.sparse.csr_matrix
+        Matrix of shape (number of query points, nx * ny) with four nonzero
+        weights per row, such that `matrix @ values.ravel()` interpolates.
+    """
+    ix, iy, wx, wy = (arr.ravel() for arr in bilinear_coords(grids, x, y))
+    ny = grids[1].size
+
+    rows = np.repeat(np.arange(ix.size), 4)
+    cols = np.stack(
+        [ix * ny + iy, (ix + 1) * ny + iy, ix * ny + iy + 1, (ix + 1) * ny + iy + 1],
+        axis=1,
+    ).ravel()
+    data = np.stack(
+        [(1 - wx) * (1 - wy), wx * (1 - wy), (1 - wx) * wy, wx * wy], axis=1
+    ).ravel()
+
+    shape = (ix.size, grids[0].size * ny)
+
+    return sparse.csr_matrix((data, (rows, cols)), shape=shape)
+
+
+def warped_coords(grids, x, y, tree=None, max_walk=None, newton_iter=8, tol=1e-10):
+    """
+    Locate query points in a warped quadrilateral mesh.
+
+    The mesh is the image of a regular grid under a smooth map, given by the
+    coordinates (xMat, yMat) of its nodes. Each query starts in a cell next
+    to its nearest node, solves for its local coordinates in that cell by
+    Newton's method on the bilinear map, and walks to the neighboring cell
+    in the direction of any local coordinate outside [0, 1] until it lands
+    in a cell that contains it.
+
+    Parameters
+    ----------
+    grids : list of np.ndarray
+        Node coordinates (xMat, yMat), each of shape (nx, ny).
+    x, y : np.ndarray
+        Query points, broadcastable to a common shape.
+    tree : scipy.spatial.cKDTree, optional
+        KD-tree of the finite nodes, built if not given.
+    max_walk : int, optional
+        Maximum number of cell steps, nx + ny by default.
+    newton_iter : int
+        Newton iterations per visited cell.
+    tol : float
+        Tolerance on the local coordinates for a cell to contain a point.
+
+    Returns
+    -------
+    tuple
+        Lower cell indices (ix, iy), local coordinates (wx, wy) in [0, 1] and
+        a mask of the points found inside the mesh, in the format of
+        `bilinear_coords`.
+    """
+    xMat, yMat = grids
+    nx, ny = xMat.shape
+    x, y = np.broadcast_arrays(x, y)
+    shape = x.shape
+    x = x.ravel()
+    y = y.ravel()
+
+    finite = np.flatnonzero(finite_nodes(grids))
+    if tree is None:
+        tree = cKDTree(np.column_stack([xMat.ravel()[finite], yMat.ravel()[finite]]))
+    if max_walk is None:
+        max_walk = nx + ny
+
+    # start from the cell whose lower corner is the nearest node
+    node = finite[tree.query(np.column_stack([x, y]))[1]]
+    ix = np.minimum(node // ny, nx - 2)
+    iy = np.minimum(node % ny, ny - 2)
+    wx = np.full(x.size, 0.5)
+    wy = np.full(x.size, 0.5)
+    inside = np.zeros(x.size, dtype=bool)
+
+    active = np.arange(x.size)
+    for _ in range(max_walk):
+        i, j = ix[active], iy[active]
+        corners_x = (xMat[i, j], xMat[i + 1, j], xMat[i, j + 1], xMat[i + 1, j + 1])
+        corners_y = (yMat[i, j], yMat[i + 1, j], yMat[i, j + 1], yMat[i + 1, j + 1])
+
+        s, t = invert_bilinear(corners_x, corners_y, x[active], y[active], newton_iter)
+
+        found = (s > -tol) & (s < 1 + tol) & (t > -tol) & (t < 1 + tol)
+        wx[active] = s
+        wy[active] = t
+        inside[active] = found
+
+        # step towards the point, stopping at the edge of the mesh
+        step_x = (s > 1 + tol).astype(int) - (s < -tol).astype(int)
+        step_y = (t > 1 + tol).astype(int) - (t < -tol).astype(int)
+        new_i = np.clip(i + step_x, 0, nx - 2)
+        new_j = np.clip(j + step_y, 0, ny - 2)
+        moved = (new_i != i) | (new_j != j)
+
+        ix[active] = new_i
+        iy[active] = new_j
+        active = active[~found & moved]
+
+        if active.size == 0:
+            break
+
+    wx = np.clip(np.nan_to_num(wx), 0.0, 1.0)
+    wy = np.clip(np.nan_to_num(wy), 0.0, 1.0)
+
+    return (
+        ix.reshape(shape),
+        iy.reshape(shape),
+        wx.reshape(shape),
+        wy.reshape(shape),
+        inside.reshape(shape),
+    )
+
+
+def finite_nodes(grids):
+    return np.logical_and.reduce([np.isfinite(grid) for grid in grids]).ravel()
+
+
+def invert_bilinear(corners_x, corners_y, x, y, newton_iter):
+    """
+    Local coordinates (s, t) of points (x, y) under the bilinear map of the
+    cells with the given corners, ordered (00, 10, 01, 11).
+    """
+    x00, x10, x01, x11 = corners_x
+    y00, y10, y01, y11 = corners_y
+
+    s = np.full(x.shape, 0.5)
+    t = np.full(x.shape, 0.5)
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        for _ in range(newton_iter):
+            rx = x00 * (1 - s) * (1 - t) + x10 * s * (1 - t)
+            rx += x01 * (1 - s) * t + x11 * s * t - x
+            ry = y00 * (1 - s) * (1 - t) + y10 * s * (1 - t)
+            ry += y01 * (1 - s) * t + y11 * s * t - y
+
+            dxds = (x10 - x00) * (1 - t) + (x11 - x01) * t
+            dxdt = (x01 - x00) * (1 - s) + (x11 - x10) * s
+            dyds = (y10 - y00) * (1 - t) + (y11 - y01) * t
+            dydt = (y01 - y00) * (1 - s) + (y11 - y10) * s
+
+            det = dxds * dydt - dxdt * dyds
+            s = s - (dydt * rx - dxdt * ry) / det
+            t = t - (dxds * ry - dyds * rx) / det
+
+            # points far outside the cell only need the direction to walk
+            s = np.clip(s, -1.0, 2.0)
+            t = np.clip(t, -1.0, 2.0)
+
+    return s, t
+
+
+class WarpedBilinearInterp(MetricObject):
+    """
+    Bilinear interpolant on a warped quadrilateral mesh, i.e. the image of a
+    regular grid under a smooth monotone map such as the endogenous grid
+    method. Queries are located with `warped_coords` and values outside the
+    mesh are NaN.
+
+    Parameters
+    ----------
+    values : np.ndarray
+        Function values at the nodes, shape (nx, ny), or (k, nx, ny) for k
+        stacked functions.
+    grids : list of np.ndarray
+        Node coordinates (xMat, yMat), each of shape (nx, ny).
+    """
+
+    distance_criteria = ["values", "grids"]
+
+    def __init__(self, values, grids):
+        self.values = np.asarray(values, dtype=float)
+        self.grids = [np.asarray(grid, dtype=float) for grid in grids]
+
+        points = np.column_stack([grid.ravel() for grid in self.grids])
+        self.tree = cKDTree(points[finite_nodes(self.grids)])
+
+    def __call__(self, x, y):
+        ix, iy, wx, wy, inside = warped_coords(self.grids, x, y, tree=self.tree)
+
+        out = bilinear_eval(self.values, (ix, iy, wx, wy))
+
+        return np.where(inside, out, np.nan)
+
+
+class WarpedInterpOnInterp1D(MetricObject):
+    """
+    Linear interpolant on a grid that is curvilinear along its first axis and
+    regular along its second, i.e. each column j of the knot matrix holds the
+    (sorted) x-knots of a 1-D linear interpolant at y = grid[j].
+
+    This is the array-backed equivalent of a list of `LinearInterp` objects
+    wrapped in `LinearInterpOnInterp1D`, evaluated for all query points in a
+    single jitted pass instead of looping over columns in Python. Queries
+    outside the knots are extrapolated linearly in both directions.
+
+    Several functions sharing the same knots can be stacked along a leading
+    axis of `values`; the bracketing search then runs once for all of them.
+
+    Parameters
+    ----------
+    values : np.ndarray
+        Function values at the knots, shape (nx, ny), or (k, nx, ny) for k
+        stacked functions.
+    knots : np.ndarray
+        Curvilinear x-knots, shape (nx, ny), sorted along the first axis.
+    grid : np.array
+        Regular y-grid of size ny.
+    """
+
+    distance_criteria = ["values", "knots", "grid"]
+
+    def __init__(self, values, knots, grid):
+        self.values = np.asarray(values, dtype=float)
+        self.knots = np.asarray(knots, dtype=float)
+        self.grid = np.asarray(grid, dtype=float)
+
+        # the kernel walks one column at a time, so store columns contiguously
+        stacked = self.values if self.values.ndim == 3 else self.values[None]
+        self._knots = np.ascontiguousarray(self.knots.T)
+        self._values = np.ascontiguousarray(np.swapaxes(stacked, 1, 2))
+
+    def __call__(self, x, y):
+        x, y = np.broadcast_arrays(
+            np.asarray(x, dtype=float), np.asarray(y, dtype=float)
+        )
+
+        out = interp_on_interp(
+            self._knots,
+            self.grid,
+            self._values,
+            np.ascontiguousarray(x).ravel(),
+            np.ascontiguousarray(y).ravel(),
+        )
+
+        if self.values.ndim == 3:
+            return out.reshape((-1,) + x.shape)
+
+        return out[0].reshape(x.shape)
+
+    def channel(self, k):
+        """
+        Interpolant of the k-th stacked function, or of a stack of several
+        if k is a slice, sharing the knots and values of this one.
+        """
+        new = copy(self)
+        new.values = self.values[k]
+        new._values = self._values[k]
+        if new._values.ndim == 2:
+            new._values = new._values[None]
+
+        return new
+
+
+class ComposedSumInterp(MetricObject):
+    """
+    Function of the sum of its arguments, f(x + y + ...), e.g. the
+    retired consumption function evaluated at total wealth m + n.
+
+    Parameters
+    ----------
+    func : callable
+        Function of a single argument.
+    """
+
+    distance_criteria = ["func"]
+
+    def __init__(self, func):
+        self.func = func
+
+    def __call__(self, *args):
+        total = args[0]
+        for arg in args[1:]:
+            total = total + arg
+
+        return self.func(total)
+
+
+class ClippedInterp(MetricObject):
+    """
+    Function with its output clipped to [lower, upper], e.g. a share of
+    time that must lie in [0, 1].
+
+    Parameters
+    ----------
+    func : callable
+        Function to clip.
+    lower, upper : float
+        Bounds of the output.
+    """
+
+    distance_criteria = ["func"]
+
+    def __init__(self, func, lower, upper):
+        self.func = func
+        self.lower = lower
+        self.upper = upper
+
+    def __call__(self, *args):
+        # out of place, func may return its input, e.g. IdentityFunction
+        return np.clip(self.func(*args), self.lower, self.upper)
+
+
+class StackedBilinearInterp(MetricObject):
+    """
+    Bilinear interpolant of several functions on one rectilinear grid. Each
+    query is located once for all of them, and `channel` returns the
+    interpolant of a single function as a view of the stacked values.
+
+    Parameters
+    ----------
+    values : np.ndarray
+        Function values with shape (k, nx, ny), or (nx, ny) for a single
+        function.
+    grids : list of np.array
+        The two 1-D grids spanning the rectilinear grid.
+    names : sequence of str, optional
+        Name of each of the k functions, so that channels can be selected
+        by name.
+    """
+
+    distance_criteria = ["values", "grids"]
+
+    def __init__(self, values, grids, names=None):
+        self.values = np.asarray(values, dtype=float)
+        self.grids = [np.asarray(grid, dtype=float) for grid in grids]
+        self.names = None if names is None else tuple(names)
+
+    def __call__(self, x, y):
+        x = np.asarray(x, dtype=float)
+        y = np.asarray(y, dtype=float)
+
+        return bilinear_eval(self.values, bilinear_coords(self.grids, x, y))
+
+    def channel(self, k):
+        if isinstance(k, str):
+            k = self.names.index(k)
+
+        return StackedBilinearInterp(self.values[k], self.grids)
+
+
+class MultiFuncCRRA(MetricObject):
+    """
+    Several CRRA-transformed functions read off one stacked interpolant.
+
+    Each output is a channel of the stacked interpolant, returned as is
+    ("level"), as marginal utility of it ("marg", as in `MargValueFuncCRRA`)
+    or as utility of it ("value", as in `ValueFuncCRRA`). A channel can feed
+    more than one output, e.g. consumption and the marginal value of
+    liquid wealth.
+
+    Parameters
+    ----------
+    interp : callable
+        Stacked interpolant returning an array of shape (k,) + query shape.
+    CRRA : float
+        Coefficient of relative risk aversion.
+    outputs : sequence of (int, str)
+        Channel index and transformation of each output.
+    """
+
+    distance_criteria = ["interp"]
+
+    def __init__(self, interp, CRRA, outputs):
+        self.interp = interp
+        self.CRRA = CRRA
+        self.outputs = tuple(outputs)
+
+    def transform(self, x, kind):
+        if kind == "marg":
+            return CRRAutilityP(x, self.CRRA)
+        if kind == "value":
+            return CRRAutility(x, self.CRRA)
+
+        return x
+
+    def __call__(self, *args):
+        nvrs = self.interp(*args)
+
+        return tuple(self.transform(nvrs[k], kind) for k, kind in self.outputs)
+
+    def marginals(self, *args):
+        """
+        Only the "marg" outputs, interpolating only the channels that feed
+        them, e.g. dvdl and dvdb without c and v for the deposit stage.
+        """
+        outputs = [(k, kind) for k, kind in self.outputs if kind == "marg"]
+        lower = min(k for k, _ in outputs)
+        upper = max(k for k, _ in outputs) + 1
+        nvrs = self.interp.channel(slice(lower, upper))(*args)
+
+        return tuple(self.transform(nvrs[k - lower], kind) for k, kind in outputs)
@@ -0,0 +1,455 @@
+"""
+Compiled kernels for the EGMN pension solvers.
+
+The functions in this module work on flat arrays only. Solvers call them with
+the nodal values attached to each stage (`stage.nodes`) and wrap the results
+in HARK interpolants at the end, so the hot loops never touch Python objects.
+"""
+
+import numpy as np
+from numba import njit, prange
+
+###########
+# utility #
+###########
+
+
+@njit(fastmath=True)
+def crra_func(c, rho):
+    if rho == 1.0:
+        return np.log(c)
+    return c ** (1.0 - rho) / (1.0 - rho)
+
+
+@njit(fastmath=True)
+def crra_marg_func(c, rho):
+    return c ** (-rho)
+
+
+@njit(fastmath=True)
+def pens_func(d, factor, rho, shifter):
+    # Stone-Geary tax deduction on pension deposits
+    if rho == 1.0:
+        return factor * np.log(d + shifter)
+    return factor * (d + shifter) ** (1.0 - rho) / (1.0 - rho)
+
+
+@njit(fastmath=True)
+def pens_marg_func(d, factor, rho, shifter):
+    return factor * (d + shifter) ** (-rho)
+
+
+@njit(fastmath=True)
+def pens_inv_marg_func(x, factor, rho, shifter):
+    return (x / factor) ** (-1.0 / rho) - shifter
+
+
+#################
+# interpolation #
+#################
+
+
+@njit
+def bracket(grid, x):
+    """lower index of the grid cell containing (or nearest to) x"""
+    i = np.searchsorted(grid, x) - 1
+    return min(max(i, 0), grid.size - 2)
+
+
+@njit
+def bilinear_point(xgrid, ygrid, values, x, y, out):
+    """evaluate all stacked channels of values (k, nx, ny) at one point"""
+    i = bracket(xgrid, x)
+    j = bracket(ygrid, y)
+    wx = (x - xgrid[i]) / (xgrid[i + 1] - xgrid[i])
+    wy = (y - ygrid[j]) / (ygrid[j + 1] - ygrid[j])
+
+    for k in range(values.shape[0]):
+        out[k] = (
+            values[k, i, j] * (1 - wx) * (1 - wy)
+            + values[k, i + 1, j] * wx * (1 - wy)
+            + values[k, i, j + 1] * (1 - wx) * wy
+            + values[k, i + 1, j + 1] * wx * wy
+        )
+
+
+@njit
+def interp_on_interp_point(x_knots, ygrid, values, x, y, out):
+    """
+    evaluate all stacked channels of an interpolant that is linear on
+    column-specific knots x_knots (ny, nx) and linear across the regular ygrid
+    """
+    j = bracket(ygrid, y)
+    wy = (y - ygrid[j]) / (ygrid[j + 1] - ygrid[j])
+
+    for k in range(values.shape[0]):
+        out[k] = 0.0
+
+    for jj in range(2):
+        col = j + jj
+        w_col = wy if jj == 1 else 1 - wy
+        knots = x_knots[col]
+        i = bracket(knots, x)
+        wx = (x - knots[i]) / (knots[i + 1] - knots[i])
+        for k in range(values.shape[0]):
+            out[k] += w_col * (
+                values[k, col, i] * (1 - wx) + values[k, col, i + 1] * wx
+            )
+
+
+@njit(parallel=True)
+def interp_on_interp(x_knots, ygrid, values, x, y):
+    """
+    evaluate stacked interp-on-interp channels at flat query arrays x and y
+
+    x_knots has shape (ny, nx) and values has shape (k, ny, nx)
+    """
+    out = np.empty((values.shape[0], x.size))
+    for p in prange(x.size):
+        temp = np.empty(values.shape[0])
+        interp_on_interp_point(x_knots, ygrid, values, x[p], y[p], temp)
+        out[:, p] = temp
+
+    return out
+
+
+#################
+# post decision #
+#################
+
+
+@njit(parallel=True)
+def post_decision(
+    aGrid, bGrid, psi, theta, Rb, prbs, Ra, mGrid, nGrid, nodes, rho, beta
+):
+    """
+    end of period v, dvda and dvdb on the (aGrid, bGrid) tensor grid
+
+    next period states are m = Ra * a / psi + theta and n = Rb * b / psi for
+    each shock atom; nodes stacks next period's inverted v, dvdm and dvdn on
+    the (mGrid, nGrid) tensor grid
+    """
+    Na = aGrid.size
+    Nb = bGrid.size
+
+    v_end = np.zeros((Na, Nb))
+    dvda_end = np.zeros((Na, Nb))
+    dvdb_end = np.zeros((Na, Nb))
+
+    for i_a in prange(Na):
+        temp = np.empty(3)
+        for i_b in range(Nb):
+            for i_s in range(prbs.size):
+                m_plus = Ra * aGrid[i_a] / psi[i_s] + theta[i_s]
+                n_plus = Rb[i_s] * bGrid[i_b] / psi[i_s]
+
+                bilinear_point(mGrid, nGrid, nodes, m_plus, n_plus, temp)
+
+                weight = prbs[i_s] * psi[i_s] ** (-rho)
+                v_end[i_a, i_b] += weight * psi[i_s] * crra_func(temp[0], rho)
+                dvda_end[i_a, i_b] += weight * Ra * crra_marg_func(temp[1], rho)
+                dvdb_end[i_a, i_b] += weight * Rb[i_s] * crra_marg_func(temp[2], rho)
+
+            v_end[i_a, i_b] *= beta
+            dvda_end[i_a, i_b] *= beta
+            dvdb_end[i_a, i_b] *= beta
+
+    return v_end, dvda_end, dvdb_end
+
+
+#################
+# deposit stage #
+#################
+
+
+@njit
+def deposit_foc(d, m, n, x_knots, ygrid, values, rho, g_pars, temp):
+    """derivative of the value of depositing d out of m given n"""
+    factor, g_rho, shifter = g_pars
+    l = m - d
+    b = n + d + pens_func(d, factor, g_rho, shifter)
+    interp_on_interp_point(x_knots, ygrid, values, l, b, temp)
+    dvdl = crra_marg_func(temp[0], rho)
+    dvdb = crra_marg_func(temp[1], rho)
+
+    return -dvdl + dvdb * (1 + pens_marg_func(d, factor, g_rho, shifter))
+
+
+@njit
+def deposit_bisect(m, n, x_knots, ygrid, values, rho, g_pars, tol, max_iter):
+    """solve the deposit foc on [0, m], allowing for corner solutions"""
+    temp = np.empty(values.shape[0])
+
+    foc_lo = deposit_foc(0.0, m, n, x_knots, ygrid, values, rho, g_pars, temp)
+    if foc_lo <= 0.0:
+        return 0.0
+    foc_hi = deposit_foc(m, m, n, x_knots, ygrid, values, rho, g_pars, temp)
+    if foc_hi >= 0.0:
+        return m
+
+    lo = 0.0
+    hi = m
+    for _ in range(max_iter):
+        mid = 0.5 * (lo + hi)
+        if hi - lo < tol:
+            break
+        if deposit_foc(mid, m, n, x_knots, ygrid, values, rho, g_pars, temp) > 0:
+            lo = mid
+        else:
+            hi = mid
+
+    return 0.5 * (lo + hi)
+
+
+@njit
+def scan_triangle(
+    out_d, out_v, mGrid, nGrid, m, n, d, idx, x_knots, ygrid, values, g_pars, temp
+):
+    """
+    barycentric interpolation of d onto common grid points in a triangle,
+    keeping it where its value of choice beats that of other triangles
+    """
+    factor, g_rho, shifter = g_pars
+    m1, m2, m3 = m[idx[0]], m[idx[1]], m[idx[2]]
+    n1, n2, n3 = n[idx[0]], n[idx[1]], n[idx[2]]
+
+    denom = (n2 - n3) * (m1 - m3) + (m3 - m2) * (n1 - n3)
+    if denom == 0.0:
+        return
+
+    # bounding box in common grid
+    i_m_lo = np.searchsorted(mGrid, min(m1, m2, m3))
+    i_m_hi = np.searchsorted(mGrid, max(m1, m2, m3), side="right")
+    i_n_lo = np.searchsorted(nGrid, min(n1, n2, n3))
+    i_n_hi = np.searchsorted(nGrid, max(n1, n2, n3), side="right")
+
+    for i_m in range(i_m_lo, i_m_hi):
+        for i_n in range(i_n_lo, i_n_hi):
+            m_now = mGrid[i_m]
+            n_now = nGrid[i_n]
+
+            w1 = ((n2 - n3) * (m_now - m3) + (m3 - m2) * (n_now - n3)) / denom
+            w2 = ((n3 - n1) * (m_now - m3) + (m1 - m3) * (n_now - n3)) / denom
+            w3 = 1 - w1 - w2
+
+            if w1 < -1e-12 or w2 < -1e-12 or w3 < -1e-12:
+                continue
+
+            d_now = w1 * d[idx[0]] + w2 * d[idx[1]] + w3 * d[idx[2]]
+            d_now = min(max(d_now, 0.0), m_now)
+
+            # value of choice, compared in inverted units since the
+            # inverse utility is increasing
+            l_now = m_now - d_now
+            b_now = n_now + d_now + pens_func(d_now, factor, g_rho, shifter)
+            interp_on_interp_point(x_knots, ygrid, values, l_now, b_now, temp)
+
+            if temp[0] > out_v[i_m, i_n]:
+                out_v[i_m, i_n] = temp[0]
+                out_d[i_m, i_n] = d_now
+
+
+@njit
+def upper_envelope(mGrid, nGrid, m, n, d, valid, x_knots, ygrid, values, g_pars):
+    """
+    interpolate d from the warped (m, n) mesh of the exogenous (l, bl) grid
+    onto the common (mGrid, nGrid) grid, splitting each cell into two simplices;
+    where the mesh folds over itself (several egm branches), each common grid
+    point keeps the d with the highest value, given by the single channel of
+    values (inverted v on the consumption stage knots)
+    """
+    Nl, Nbl = m.shape
+    out_d = np.full((mGrid.size, nGrid.size), np.nan)
+    out_v = np.full((mGrid.size, nGrid.size), -np.inf)
+
+    m_flat = m.ravel()
+    n_flat = n.ravel()
+    d_flat = d.ravel()
+    idx = np.empty(3, dtype=np.int64)
+    temp = np.empty(1)
+
+    for i_l in range(Nl - 1):
+        for i_bl in range(Nbl - 1):
+            for tri in range(2):
+                if tri == 0:
+                    corners = ((i_l, i_bl), (i_l + 1, i_bl), (i_l, i_bl + 1))
+                else:
+                    corners = ((i_l + 1, i_bl + 1), (i_l, i_bl + 1), (i_l + 1, i_bl))
+
+                ok = True
+                for c in range(3):
+                    ok = ok and valid[corners[c][0], corners[c][1]]
+                    idx[c] = corners[c][0] * Nbl + corners[c][1]
+                if not ok:
+                    continue
+
+                scan_triangle(
+                    out_d,
+                    out_v,
+                    mGrid,
+                    nGrid,
+                    m_flat,
+                    n_flat,
+                    d_flat,
+                    idx,
+                    x_knots,
+                    ygrid,
+                    values,
+                    g_pars,
+                    temp,
+                )
+
+    return out_d, out_v > -np.inf
+
+
+@njit(parallel=True)
+def fill_holes(out_d, filled, mGrid, nGrid, x_knots, ygrid, values, rho, g_pars):
+    """solve the deposit foc directly where the egm mesh does not reach"""
+    for i_m in prange(mGrid.size):
+        for i_n in range(nGrid.size):
+            if not filled[i_m, i_n]:
+                out_d[i_m, i_n] = deposit_bisect(
+                    mGrid[i_m],
+                    nGrid[i_n],
+                    x_knots,
+                    ygrid,
+                    values,
+                    rho,
+                    g_pars,
+                    1e-10,
+                    100,
+                )
+
+
+def consumption_nodes(nodes):
+    """column knots, regular grid and stacked c, dvdb_nvrs, v_nvrs channels"""
+    x_knots = np.ascontiguousarray(nodes["lMat"].T)
+    values = np.ascontiguousarray(
+        np.stack([nodes["c"], nodes["dvdb_nvrs"], nodes["v_nvrs"]]).transpose(0, 2, 1)
+    )
+
+    return x_knots, nodes["bGrid"], values
+
+
+def deposit_envelope(nodes, dMat, mMat, nMat, mGrid, nGrid, rho, g_pars):
+    """
+    Deposit policy on the common (mGrid, nGrid) grid from the egm points.
+
+    The simplices of the (m, n) mesh are scanned onto the common grid and,
+    where several of them cover a grid point because the foc has several
+    solutions, the deposit with the highest value of choice is kept. Grid
+    points the mesh does not reach solve the foc directly.
+
+    Parameters
+    ----------
+    nodes : dict
+        Consumption stage nodal values, see `deposit_stage`.
+    dMat, mMat, nMat : np.ndarray
+        Deposits and endogenous (m, n) points on the exogenous (l, bl) grid.
+    mGrid, nGrid : np.array
+        Common grid.
+    rho : float
+        Coefficient of relative risk aversion.
+    g_pars : tuple
+        (factor, CRRA, shifter) of the Stone-Geary tax deduction function.
+
+    Returns
+    -------
+    np.ndarray
+        d on the common grid, between 0 and m.
+    """
+    x_knots, ygrid, values = consumption_nodes(nodes)
+
+    valid = np.isfinite(dMat) & np.isfinite(mMat) & np.isfinite(nMat)
+    out_d, filled = upper_envelope(
+        mGrid,
+        nGrid,
+        mMat,
+        nMat,
+        dMat,
+        valid,
+        x_knots,
+        ygrid,
+        np.ascontiguousarray(values[2:]),
+        g_pars,
+    )
+    fill_holes(out_d, filled, mGrid, nGrid, x_knots, ygrid, values, rho, g_pars)
+
+    return np.clip(out_d, 0.0, mGrid[:, None])
+
+
+def deposit_stage(nodes, lMat, blMat, mGrid, nGrid, rho, g_pars):
+    """
+    Solve the deposit stage on the common (mGrid, nGrid) grid.
+
+    Parameters
+    ----------
+    nodes : dict
+        Consumption stage nodal values: column knots "lMat" (nl, nb) along the
+        regular "bGrid", and "c", "dvdb_nvrs" and "v_nvrs" on those knots.
+    lMat, blMat : np.ndarray
+        Exogenous post-deposit grid used for the endogenous grid step.
+    mGrid, nGrid : np.array
+        Common grid on which the deposit policy is computed.
+    rho : float
+        Coefficient of relative risk aversion.
+    g_pars : tuple
+        (factor, CRRA, shifter) of the Stone-Geary tax deduction function.
+
+    Returns
+    -------
+    tuple of np.ndarray
+        d, c, inverted dvdn and inverted v on the common grid.
+    """
+    x_knots, ygrid, values = consumption_nodes(nodes)
+    factor, g_rho, shifter = g_pars
+
+    # a. endogenous grid method on the exogenous (l, bl) grid
+    egm = interp_on_interp(x_knots, ygrid, values[:2], lMat.ravel(), blMat.ravel())
+    dvdl = crra_marg_func(egm[0], rho).reshape(lMat.shape)
+    dvdb = crra_marg_func(egm[1], rho).reshape(lMat.shape)
+
+    with np.errstate(all="ignore"):
+        dMat = pens_inv_marg_func(dvdl / dvdb - 1.0, factor, g_rho, shifter)
+        mMat = lMat + dMat
+        nMat = blMat - dMat - pens_func(dMat, factor, g_rho, shifter)
+
+    # b. upper envelope of the egm mesh on the common grid
+    dMat = deposit_envelope(nodes, dMat, mMat, nMat, mGrid, nGrid, rho, g_pars)
+    mMat, nMat = np.meshgrid(mGrid, nGrid, indexing="ij")
+
+    # c. evaluate consumption stage at optimal deposits
+    lMat = mMat - dMat
+    blMat = nMat + dMat + pens_func(dMat, factor, g_rho, shifter)
+    c, dvdb_nvrs, v_nvrs = interp_on_interp(
+        x_knots, ygrid, values, lMat.ravel(), blMat.ravel()
+    )
+
+    shape = mMat.shape
+    return dMat, c.reshape(shape), dvdb_nvrs.reshape(shape), v_nvrs.reshape(shape)
+
+
+##################
+# linear algebra #
+##################
+
+
+@njit
+def cholesky_update(L, X):
+    """
+    lower cholesky factor of L @ L.T + X @ X.T, computed in place with one
+    rank-1 update per column of X at O(n^2) each
+    """
+    n = L.shape[0]
+    for k in range(X.shape[1]):
+        x = X[:, k].copy()
+        for i in range(n):
+            r = np.sqrt(L[i, i] ** 2 + x[i] ** 2)
+            c = r / L[i, i]
+            s = x[i] / L[i, i]
+            L[i, i] = r
+            for j in range(i + 1, n):
+                L[j, i] = (L[j, i] + s * x[j]) / c
+                x[j] = c * x[j] - s * L[j, i]
+
+    return L
@@ -0,0 +1,775 @@
+"""
+Scattered-data interpolants for the deposit stage of the EGMN solvers.
+
+The second endogenous grid method step produces (m, n) points that do not lie
+on a grid, so the deposit policy has to be recovered from scattered data. A
+Gaussian process does this well but fitting it is cubic in the number of
+points. A low-rank approximation of it fits in linear time, and the other
+interpolants here trade some smoothness for near-linear scaling. All of them
+share the interface of `GeneralizedRegressionUnstructuredInterp` (callable on
+arrays, with `values` and `grids` attributes) so that solvers can switch
+between them per agent.
+"""
+
+from abc import ABC, abstractmethod
+from copy import copy
+
+import numpy as np
+from HARK.metric import MetricObject
+from interpolators import WarpedBilinearInterp
+from numba_backend import cholesky_update
+from scipy.interpolate import LinearNDInterpolator, RBFInterpolator
+from scipy.linalg import cho_solve, solve_triangular
+from scipy.optimize import minimize
+from scipy.spatial import cKDTree
+from sklearn.gaussian_process import GaussianProcessRegressor
+from sklearn.gaussian_process.kernels import RBF
+from sklearn.kernel_approximation import Nystroem, RBFSampler
+
+
+class UnstructuredInterp(MetricObject, ABC):
+    """
+    Base class for interpolants on scattered points in two or more dimensions.
+
+    Parameters
+    ----------
+    values : np.ndarray
+        Function values at the scattered points, with the shape of each grid,
+        or several functions stacked along a leading axis. Stacked functions
+        are fitted together and returned stacked.
+    grids : list of np.ndarray
+        Coordinates of the scattered points, one array per dimension, each
+        with the same shape. Points with non-finite coordinates or values are
+        dropped.
+
+    Queries are evaluated in chunks so that the temporaries of a prediction
+    take at most `max_memory` bytes, whatever the number of queries.
+    """
+
+    distance_criteria = ["values", "grids"]
+    max_memory = 2**28
+
+    def __init__(self, values, grids):
+        grids = [np.asarray(grid, dtype=float) for grid in grids]
+        values = np.asarray(values, dtype=float)
+        self.stacked = values.ndim > grids[0].ndim
+
+        values = values.reshape((-1, grids[0].size) if self.stacked else -1)
+        points = np.column_stack([grid.ravel() for grid in grids])
+
+        # egm can produce non-finite points where the foc has no solution
+        finite = np.isfinite(values).reshape(-1, points.shape[0]).all(axis=0)
+        finite &= np.all(np.isfinite(points), axis=1)
+
+        self.shape = grids[0].shape
+        self.finite = finite
+        self.values = values[..., finite]
+        self.points = points[finite]
+        self.grids = list(self.points.T)
+        # targets are (points,) or (points, functions) as scipy and sklearn expect
+        self.targets = self.values.T
+
+    def __call__(self, *args):
+        return self.evaluate(self._predict, args)
+
+    @property
+    def query_bytes(self):
+        # memory per query, one row of a cross-covariance with the points
+        return 8 * self.points.shape[0]
+
+    def evaluate(self, predict, args):
+        args = np.broadcast_arrays(*args)
+        points = np.column_stack([arg.ravel() for arg in args])
+
+        size = max(1, int(self.max_memory // self.query_bytes))
+        if points.shape[0] <= size:
+            out = predict(points)
+        else:
+            out = np.concatenate(
+                [
+                    predict(points[start : start + size])
+                    for start in range(0, points.shape[0], size)
+                ]
+            )
+
+        if self.stacked:
+            return out.T.reshape((-1,) + args[0].shape)
+
+        return out.reshape(args[0].shape)
+
+    @abstractmethod
+    def _predict(self, points):
+        """
+        Values of the interpolant at an (n, d) array of query points.
+        """
+
+
+class DelaunayInterp(UnstructuredInterp):
+    """
+    Piecewise linear (barycentric) interpolation on the Delaunay triangulation
+    of the points. Queries outside the convex hull take the value of the
+    nearest point.
+    """
+
+    def __init__(self, values, grids):
+        super().__init__(values, grids)
+        self.interp = LinearNDInterpolator(self.points, self.targets)
+        self.tree = cKDTree(self.points)
+
+    def _predict(self, points):
+        out = self.interp(points)
+
+        outside = np.isnan(out.reshape(points.shape[0], -1)).any(axis=1)
+        if np.any(outside):
+            _, idx = self.tree.query(points[outside])
+            out[outside] = self.targets[idx]
+
+        return out
+
+
+class InverseDistanceInterp(UnstructuredInterp):
+    """
+    Inverse-distance weighting over the k nearest neighbors of each query,
+    found with a KD-tree.
+
+    Parameters
+    ----------
+    neighbors : int
+        Number of nearest points used for each query.
+    power : float
+        Exponent of the inverse distance weights.
+    """
+
+    def __init__(self, values, grids, neighbors=8, power=2.0):
+        super().__init__(values, grids)
+        self.neighbors = min(neighbors, self.points.shape[0])
+        self.power = power
+        self.tree = cKDTree(self.points)
+
+    def _predict(self, points):
+        dist, idx = self.tree.query(points, k=self.neighbors)
+        dist = dist.reshape(points.shape[0], -1)
+        idx = idx.reshape(points.shape[0], -1)
+
+        with np.errstate(divide="ignore"):
+            weights = dist ** (-self.power)
+
+        # queries that coincide with a point take its value exactly
+        exact = dist[:, 0] == 0.0
+        weights[exact] = 0.0
+        weights[exact, 0] = 1.0
+
+        weights /= np.sum(weights, axis=1, keepdims=True)
+
+        return np.einsum("pk,pk...->p...", weights, self.targets[idx])
+
+
+class LocalRBFInterp(UnstructuredInterp):
+    """
+    Radial basis function interpolation with local support: each query is
+    fitted on its k nearest points only, so the cost grows linearly in the
+    number of queries instead of cubically in the number of points.
+
+    Parameters
+    ----------
+    neighbors : int
+        Number of nearest points used for each query.
+    kernel : str
+        Radial basis function, see `scipy.interpolate.RBFInterpolator`.
+    smoothing : float
+        Smoothing parameter, 0 for exact interpolation.
+    """
+
+    def __init__(
+        self, values, grids, neighbors=30, kernel="thin_plate_spline", smoothing=0.0
+    ):
+        super().__init__(values, grids)
+        self.interp = RBFInterpolator(
+            self.points,
+            self.targets,
+            neighbors=min(neighbors, self.points.shape[0]),
+            kernel=kernel,
+            smoothing=smoothing,
+        )
+
+    def _predict(self, points):
+        return self.interp(points)
+
+
+class GaussianProcessInterp(UnstructuredInterp):
+    """
+    Gaussian process regression on standardized coordinates.
+
+    The fitted kernel is kept in `kernel_` so that it can seed the fit of a
+    similar surface, e.g. the same function one period earlier: passing it
+    as `kernel` starts the marginal likelihood optimization from its
+    hyperparameters, and passing `optimizer=None` as well keeps them fixed
+    so that the fit only refactorizes the kernel matrix.
+
+    Parameters
+    ----------
+    kernel : sklearn.gaussian_process.kernels.Kernel, optional
+        Kernel or initial guess of its hyperparameters, sklearn's default
+        if None.
+    optimizer : str or callable or None
+        Optimizer of the marginal likelihood, None to keep the kernel fixed.
+    **model_kwargs
+        Other options of `sklearn.gaussian_process.GaussianProcessRegressor`.
+    """
+
+    def __init__(
+        self, values, grids, kernel=None, optimizer="fmin_l_bfgs_b", **model_kwargs
+    ):
+        super().__init__(values, grids)
+
+        self.loc = self.points.mean(axis=0)
+        self.scale = self.points.std(axis=0)
+        self.scale[self.scale == 0.0] = 1.0
+
+        options = {"normalize_y": True}
+        options.update(model_kwargs)
+
+        self.model = GaussianProcessRegressor(
+            kernel=kernel, optimizer=optimizer, **options
+        )
+        # stacked functions share the kernel, so the kernel matrix is built
+        # and factorized once and solved for all of them
+        self.model.fit(self.standardize(self.points), self.targets)
+        self.kernel_ = self.model.kernel_
+        self.noise = self.model.alpha
+        self.normalize_y = self.model.normalize_y
+        self.solve(self.model.L_)
+
+    def standardize(self, points):
+        return (points - self.loc) / self.scale
+
+    def solve(self, L):
+        """
+        Weights of the training targets given the lower Cholesky factor L of
+        the kernel matrix of the training points.
+        """
+        self.L = L
+
+        self.y_mean = 0.0
+        self.y_std = 1.0
+        if self.normalize_y:
+            self.y_mean = self.targets.mean(axis=0)
+            self.y_std = self.targets.std(axis=0)
+            self.y_std = np.where(self.y_std == 0.0, 1.0, self.y_std)
+
+        self.weights = cho_solve((L, True), (self.targets - self.y_mean) / self.y_std)
+
+    def update(self, values, new_values=None, new_grids=None, max_downdate=0.125):
+        """
+        Gaussian process with the same kernel on new targets, reusing the
+        Cholesky factor of this one.
+
+        Training points whose new value is non-finite are removed with a
+        rank-k update of the factor, and new points are appended with a
+        block update, so the cost is O(n^2 k) instead of a full refit.
+
+        Parameters
+        ----------
+        values : np.ndarray
+            New targets at the training points, in the layout of the values
+            this interpolant was created with; non-finite entries drop the
+            point.
+        new_values : np.ndarray, optional
+            Targets at additional points.
+        new_grids : list of np.ndarray, optional
+            Coordinates of the additional points.
+        max_downdate : float
+            Above this share of removed points, the kernel matrix of the
+            remaining points is factorized from scratch instead.
+
+        Returns
+        -------
+        GaussianProcessInterp
+        """
+        values = np.asarray(values, dtype=float)
+        stacked = values.ndim > len(self.shape)
+        values = values.reshape((-1, self.finite.size) if stacked else -1)
+        values = values[..., self.finite]
+
+        # a. remove training points without a finite target
+        keep = np.isfinite(values).reshape(-1, values.shape[-1]).all(axis=0)
+        points = self.points[keep]
+        L = self.L[keep]
+
+        if np.all(keep):
+            L = L.copy()
+        elif np.mean(~keep) <= max_downdate:
+            L = cholesky_update(np.ascontiguousarray(L[:, keep]), L[:, ~keep])
+        else:
+            K = self.kernel_(self.standardize(points))
+            L = np.linalg.cholesky(K + self.noise * np.eye(points.shape[0]))
+
+        values = values[..., keep]
+
+        # b. append new points
+        if new_values is not None:
+            new_values = np.asarray(new_values, dtype=float)
+            new_values = new_values.reshape(values.shape[:-1] + (-1,))
+            new_points = np.column_stack([np.ravel(grid) for grid in new_grids])
+
+            finite = np.isfinite(new_values).reshape(-1, new_points.shape[0])
+            finite = finite.all(axis=0) & np.all(np.isfinite(new_points), axis=1)
+            new_values = new_values[..., finite]
+            new_points = new_points[finite]
+
+            X1 = self.standardize(points)
+            X2 = self.standardize(new_points)
+            L21 = solve_triangular(L, self.kernel_(X1, X2), lower=True).T
+            S = self.kernel_(X2) + self.noise * np.eye(X2.shape[0]) - L21 @ L21.T
+
+            L = np.block(
+                [
+                    [L, np.zeros((L.shape[0], X2.shape[0]))],
+                    [L21, np.linalg.cholesky(S)],
+                ]
+            )
+            points = np.concatenate((points, new_points))
+            values = np.concatenate((values, new_values), axis=-1)
+
+        new = copy(self)
+        new.model = None  # fitted on the old targets
+        new.stacked = stacked
+        new.shape = (points.shape[0],)
+        new.finite = np.ones(points.shape[0], dtype=bool)
+        new.values = values
+        new.points = points
+        new.grids = list(points.T)
+        new.targets = values.T
+        new.solve(L)
+
+        return new
+
+    def _predict(self, points):
+        K_trans = self.kernel_(self.standardize(points), self.standardize(self.points))
+
+        return K_trans @ self.weights * self.y_std + self.y_mean
+
+    @property
+    def query_bytes(self):
+        # the cross-covariance, the distances it is computed from and the
+        # triangular solve for the std
+        return 40 * self.points.shape[0]
+
+    def std(self, *args):
+        """
+        Predictive standard deviation at the query points, in the shape of
+        the interpolated values. It is only computed when asked for, since
+        it costs a triangular solve per chunk of queries. Stacked functions
+        share the kernel, so they differ only by their scale.
+        """
+        return self.evaluate(self._std, args)
+
+    def _std(self, points):
+        X = self.standardize(points)
+        K_trans = self.kernel_(self.standardize(self.points), X)
+        V = solve_triangular(self.L, K_trans, lower=True)
+        var = np.maximum(self.kernel_.diag(X) - np.sum(V**2, axis=0), 0.0)
+
+        return np.sqrt(var)[:, None] * self.y_std
+
+
+class ApproximateGaussianProcessInterp(UnstructuredInterp):
+    """
+    Gaussian process regression with a low-rank approximation of a squared
+    exponential kernel, either Nyström features on `rank` inducing points or
+    `rank` random Fourier features. Fitting is a ridge regression on the
+    features and costs O(n rank^2) instead of O(n^3).
+
+    A share `holdout` of the points is left out of a first fit to measure
+    the approximation error, which is kept in `holdout_error`, and the
+    weights are then refitted on all points.
+
+    Parameters
+    ----------
+    kernel : sklearn.gaussian_process.kernels.Kernel, optional
+        Kernel with a `length_scale` (in standardized units), or initial
+        guess of it. If None, the length scale is fitted by an exact
+        Gaussian process on `rank` random points.
+    optimizer : str or callable or None
+        Optimizer of the marginal likelihood on those points, None to keep
+        the length scale of `kernel` fixed.
+    rank : int
+        Number of inducing points or random features.
+    features : str
+        "nystroem" or "fourier".
+    noise : float
+        Noise variance relative to the normalized values.
+    holdout : float
+        Share of points held out to measure the fit error, 0 to skip.
+    seed : int
+        Seed of the holdout split, the inducing points and the features.
+    """
+
+    def __init__(
+        self,
+        values,
+        grids,
+        kernel=None,
+        optimizer="fmin_l_bfgs_b",
+        rank=500,
+        features="nystroem",
+        noise=1e-6,
+        holdout=0.1,
+        seed=0,
+    ):
+        super().__init__(values, grids)
+
+        if features not in ("nystroem", "fourier"):
+            raise ValueError(
+                f"Unknown features {features!r}, expected 'nystroem' or 'fourier'."
+            )
+
+        rng = np.random.default_rng(seed)
+        n_points = self.points.shape[0]
+        self.rank = min(rank, n_points) if features == "nystroem" else rank
+        self.noise = noise
+
+        self.loc = self.points.mean(axis=0)
+        self.scale = self.points.std(axis=0)
+        self.scale[self.scale == 0.0] = 1.0
+
+        self.y_mean = self.targets.mean(axis=0)
+        self.y_std = self.targets.std(axis=0)
+        self.y_std = np.where(self.y_std == 0.0, 1.0, self.y_std)
+        targets = (self.targets - self.y_mean) / self.y_std
+
+        order = rng.permutation(n_points)
+        n_holdout = int(holdout * n_points)
+        test, train = order[:n_holdout], order[n_holdout:]
+
+        if kernel is None or optimizer is not None:
+            # the length scale is a global property of the surface, so a
+            # subset of the points is enough to fit it
+            subset = train[: self.rank]
+            model = GaussianProcessRegressor(
+                kernel=kernel if kernel is not None else RBF(),
+                optimizer=optimizer,
+                alpha=noise,
+                normalize_y=True,
+            )
+            model.fit(self.standardize(self.points[subset]), self.targets[subset])
+            kernel = model.kernel_
+
+        self.kernel_ = kernel
+        self.length_scale = self.get_length_scale(kernel)
+
+        X = self.standardize(self.points) / self.length_scale
+        if features == "nystroem":
+            self.feature_map = Nystroem(
+                gamma=0.5, n_components=self.rank, random_state=seed
+            )
+            self.feature_map.fit(X[train])
+        else:
+            self.feature_map = RBFSampler(
+                gamma=0.5, n_components=self.rank, random_state=seed
+            )
+            self.feature_map.fit(X)
+        Phi = self.feature_map.transform(X)
+
+        self.holdout_error = None
+        if n_holdout > 0:
+            weights = self.solve(Phi[train], targets[train])
+            error = (Phi[test] @ weights - targets[test]) * self.y_std
+            self.holdout_error = {
+                "rmse": np.sqrt(np.mean(error**2)),
+                "max": np.max(np.abs(error)),
+                "points": n_holdout,
+            }
+
+        self.weights = self.solve(Phi, targets)
+
+    @property
+    def query_bytes(self):
+        # the features of a query and the kernel row they are built from
+        return 16 * self.rank
+
+    @staticmethod
+    def get_length_scale(kernel):
+        params = kernel.get_params()
+        for key in sorted(params, key=len):
+            if key.endswith("length_scale"):
+                return np.asarray(params[key], dtype=float)
+
+        raise ValueError(f"Kernel {kernel} has no length scale.")
+
+    def standardize(self, points):
+        return (points - self.loc) / self.scale
+
+    def solve(self, Phi, targets):
+        # ridge regression in feature space, the weight space view of the
+        # gaussian process with kernel Phi Phi^T
+        A = Phi.T @ Phi + self.noise * np.eye(Phi.shape[1])
+
+        return np.linalg.solve(A, Phi.T @ targets)
+
+    def _predict(self, points):
+        X = self.standardize(points) / self.length_scale
+
+        return self.feature_map.transform(X) @ self.weights * self.y_std + self.y_mean
+
+
+class KroneckerGaussianProcess(MetricObject):
+    """
+    Gaussian process regression of values on a tensor-product grid.
+
+    With a product of squared exponential kernels over the two (standardized)
+    grid dimensions, the kernel matrix is the Kronecker product Kx ⊗ Ky, so
+    it is diagonalized by the eigendecompositions of the nx x nx and ny x ny
+    factors. Fitting costs O(nx^3 + ny^3 + nx ny (nx + ny)) instead of
+    O((nx ny)^3), which makes exact GP smoothing feasible on 500 x 500 grids.
+
+    Parameters
+    ----------
+    values : np.ndarray
+        Function values on the grid, shape (nx, ny), or (k, nx, ny) for k
+        stacked functions sharing the kernel.
+    grids : list of np.array
+        The two 1-D grids.
+    length_scale : float or tuple of float, optional
+        Length scales in standardized units, fitted by maximizing the
+        marginal likelihood if None.
+    noise : float, optional
+        Noise variance relative to the normalized values, fitted with the
+        length scales if None.
+    normalize_y : bool
+        Whether to standardize each function before fitting.
+    """
+
+    distance_criteria = ["values", "grids"]
+
+    def __init__(self, values, grids, length_scale=None, noise=1e-6, normalize_y=True):
+        self.values = np.asarray(values, dtype=float)
+        self.grids = [np.asarray(grid, dtype=float) for grid in grids]
+        self.stacked = self.values.ndim == 3
+
+        Y = self.values if self.stacked else self.values[None]
+        self.y_mean = np.zeros((Y.shape[0], 1, 1))
+        self.y_std = np.ones((Y.shape[0], 1, 1))
+        if normalize_y:
+            self.y_mean = Y.mean(axis=(1, 2), keepdims=True)
+            self.y_std = Y.std(axis=(1, 2), keepdims=True)
+            self.y_std[self.y_std == 0.0] = 1.0
+        self.Y = (Y - self.y_mean) / self.y_std
+
+        self.loc = [grid.mean() for grid in self.grids]
+        self.scale = [grid.std() or 1.0 for grid in self.grids]
+
+        if length_scale is None or noise is None:
+            self.length_scale, self.noise = self.optimize(length_scale, noise)
+        else:
+            self.length_scale = np.broadcast_to(length_scale, 2).astype(float)
+            self.noise = noise
+
+        self.fit()
+
+    def kernel(self, dim, x, y=None):
+        x = (np.asarray(x) - self.loc[dim]) / self.scale[dim]
+        y = x if y is None else (np.asarray(y) - self.loc[dim]) / self.scale[dim]
+
+        return np.exp(-0.5 * ((x[:, None] - y[None]) / self.length_scale[dim]) ** 2)
+
+    def eigen(self):
+        decomps = [
+            np.linalg.eigh(self.kernel(dim, grid))
+            for dim, grid in enumerate(self.grids)
+        ]
+        (lx, Qx), (ly, Qy) = decomps
+
+        return np.maximum(lx, 0.0), Qx, np.maximum(ly, 0.0), Qy
+
+    def log_marginal_likelihood(self):
+        lx, Qx, ly, Qy = self.eigen()
+        spectrum = lx[:, None] * ly[None] + self.noise
+
+        Y_rot = Qx.T @ self.Y @ Qy
+        quad = np.sum(Y_rot**2 / spectrum)
+        logdet = self.Y.shape[0] * np.sum(np.log(spectrum))
+
+        return -0.5 * (quad + logdet + self.Y.size * np.log(2 * np.pi))
+
+    def optimize(self, length_scale, noise):
+        # the likelihood only needs the two small eigendecompositions, so
+        # optimize the few hyperparameters directly on it
+        fixed_scale = length_scale is not None
+        fixed_noise = noise is not None
+
+        def loss(theta):
+            self.length_scale = (
+                np.broadcast_to(length_scale, 2).astype(float)
+                if fixed_scale
+                else np.exp(theta[:2])
+            )
+            self.noise = noise if fixed_noise else np.exp(theta[-1])
+            return -self.log_marginal_likelihood()
+
+        theta0 = np.log([1.0, 1.0, 1e-6])
+        bounds = [(np.log(1e-2), np.log(1e2))] * 2 + [(np.log(1e-12), np.log(1e-1))]
+        res = minimize(loss, theta0, method="L-BFGS-B", bounds=bounds)
+        loss(res.x)
+
+        return self.length_scale, self.noise
+
+    def fit(self):
+        lx, Qx, ly, Qy = self.eigen()
+        spectrum = lx[:, None] * ly[None] + self.noise
+
+        # weights (Kx ⊗ Ky + noise I)^-1 y, one matrix per function
+        self.weights = Qx @ ((Qx.T @ self.Y @ Qy) / spectrum) @ Qy.T
+
+    def on_grid(self, x, y):
+        """
+        Posterior mean on the tensor grid spanned by x and y, shape (nx, ny)
+        or (k, nx, ny).
+        """
+        Kx = self.kernel(0, x, self.grids[0])
+        Ky = self.kernel(1, y, self.grids[1])
+        out = (Kx @ self.weights @ Ky.T) * self.y_std + self.y_mean
+
+        return out if self.stacked else out[0]
+
+    def __call__(self, x, y):
+        x, y = np.broadcast_arrays(x, y)
+        Kx = self.kernel(0, x.ravel(), self.grids[0])
+        Ky = self.kernel(1, y.ravel(), self.grids[1])
+
+        out = np.einsum("pi,kij,pj->kp", Kx, self.weights, Ky)
+        out = out * self.y_std[:, :, 0] + self.y_mean[:, :, 0]
+        out = out.reshape((-1,) + x.shape)
+
+        return out if self.stacked else out[0]
+
+
+class KroneckerWarpedInterp(MetricObject):
+    """
+    Interpolant of a function known on a warped mesh that is the image of a
+    tensor grid, such as the deposit policy at the egm points, where
+    (m, n, d) are all functions of the exogenous (l, bl) grid.
+
+    The mesh coordinates and the function are smoothed jointly as functions
+    of the tensor grid by a `KroneckerGaussianProcess`, evaluated on an
+    optionally refined tensor grid, and queries are located in the smoothed
+    mesh with `warped_coords`. Queries outside the mesh take the value of
+    the nearest node. Non-finite nodes are filled along the first axis
+    before smoothing, since the Kronecker structure needs a complete grid.
+
+    Parameters
+    ----------
+    values : np.ndarray
+        Function values at the mesh nodes, shape (nx, ny).
+    mesh : list of np.ndarray
+        Mesh coordinates (xMat, yMat), each of shape (nx, ny).
+    grids : list of np.array
+        The two 1-D grids the mesh is the image of.
+    refine : int
+        Number of smoothed nodes per original cell along each dimension.
+    **gp_kwargs
+        Options of `KroneckerGaussianProcess`.
+    """
+
+    distance_criteria = ["values", "grids"]
+
+    def __init__(self, values, mesh, grids, refine=1, **gp_kwargs):
+        nodes = np.stack([fill_nonfinite(arr) for arr in [*mesh, values]])
+        self.gp = KroneckerGaussianProcess(nodes, grids, **gp_kwargs)
+
+        fine = [refine_grid(grid, refine) for grid in grids]
+        xMat, yMat, vMat = self.gp.on_grid(*fine)
+
+        self.interp = WarpedBilinearInterp(vMat, [xMat, yMat])
+        self.grids = [xMat.ravel(), yMat.ravel()]
+        self.values = vMat.ravel()
+        self.tree = cKDTree(np.column_stack(self.grids))
+
+    def __call__(self, x, y):
+        out = np.array(self.interp(x, y), dtype=float)
+
+        outside = np.isnan(out)
+        if np.any(outside):
+            x, y = np.broadcast_arrays(x, y)
+            _, idx = self.tree.query(np.column_stack([x[outside], y[outside]]))
+            out[outside] = self.values[idx]
+
+        return out
+
+
+def fill_nonfinite(values):
+    """
+    Fill non-finite entries of each column by linear interpolation along the
+    first axis, and columns without finite entries from the nearest column.
+    """
+    values = np.array(values, dtype=float)
+    index = np.arange(values.shape[0])
+    finite = np.isfinite(values)
+
+    columns = np.flatnonzero(finite.any(axis=0))
+    for j in columns:
+        ok = finite[:, j]
+        values[:, j] = np.interp(index, index[ok], values[ok, j])
+
+    for j in np.flatnonzero(~finite.any(axis=0)):
+        values[:, j] = values[:, columns[np.argmin(np.abs(columns - j))]]
+
+    return values
+
+
+def refine_grid(grid, refine):
+    """grid with refine - 1 evenly spaced points inserted in each interval"""
+    if refine <= 1:
+        return grid
+
+    steps = np.linspace(0.0, 1.0, refine, endpoint=False)
+    inner = grid[:-1, None] + np.diff(grid)[:, None] * steps
+
+    return np.append(inner.ravel(), grid[-1])
+
+
+def make_unstructured_interp(
+    values, grids, method="gaussian-process", max_memory=None, **kwargs
+):
+    """
+    Create a scattered-data interpolant with the chosen method.
+
+    Parameters
+    ----------
+    values : np.ndarray
+        Function values at the scattered points, optionally several functions
+        stacked along a leading axis.
+    grids : list of np.ndarray
+        Coordinates of the scattered points.
+    method : str
+        One of "gaussian-process", "approximate-gp", "delaunay",
+        "inverse-distance" or "local-rbf".
+    max_memory : int, optional
+        Cap in bytes on the temporaries of each prediction, see
+        `UnstructuredInterp`.
+    **kwargs
+        Options passed on to the interpolant of the chosen method.
+
+    Returns
+    -------
+    callable
+        Interpolant with `values` and `grids` attributes.
+    """
+    methods = {
+        "gaussian-process": GaussianProcessInterp,
+        "approximate-gp": ApproximateGaussianProcessInterp,
+        "delaunay": DelaunayInterp,
+        "inverse-distance": InverseDistanceInterp,
+        "local-rbf": LocalRBFInterp,
+    }
+
+    if method not in methods:
+        raise ValueError(
+            f"Unknown interpolation method {method!r}, expected one of {list(methods)}."
+        )
+
+    interp = methods[method](values, grids, **kwargs)
+    if max_memory is not None:
+        interp.max_memory = max_memory
+
+    return interp
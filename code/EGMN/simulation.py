@@ -0,0 +1,306 @@
+"""
+Vectorized Monte Carlo simulation of panels of agents of the EGMN models.
+
+The state of every agent in a panel is held in flat arrays and each period is
+a handful of array operations across agents: draw the shocks, evaluate the
+deposit and consumption policies, draw the retirement choice and move the
+state forward. Agents are simulated in chunks, so memory is bounded by the
+chunk size rather than by the size of the panel. Per period moments are
+accumulated as the chunks stream past, and histories can be written to `.npy`
+files on disk that are filled one chunk at a time.
+
+An agent type takes part by defining `initialize_panel(size, rng)`, which
+returns the initial state of `size` agents as a dict of arrays, and
+`panel_transition(t, state, rng)`, which updates the state in place and
+returns the variables of period t.
+"""
+
+import os
+
+import numpy as np
+from HARK.utilities import NullFunc
+from numpy.lib.format import open_memmap
+
+
+def draw_atoms(dstn, size, rng):
+    """
+    Draw from a discrete distribution.
+
+    Parameters
+    ----------
+    dstn : DiscreteDistribution
+        Distribution with `atoms` and `pmv`.
+    size : int
+        Number of draws.
+    rng : np.random.Generator
+        Random number generator.
+
+    Returns
+    -------
+    np.ndarray
+        Atoms of the draws, with one row per dimension of the distribution.
+    """
+    index = rng.choice(dstn.pmv.size, size=size, p=dstn.pmv)
+
+    return np.atleast_2d(dstn.atoms)[:, index]
+
+
+def stone_geary(x, factor, rho, shifter):
+    """
+    Stone-Geary function of `numba_backend.pens_func`, on arrays.
+    """
+    if rho == 1.0:
+        return factor * np.log(x + shifter)
+
+    return factor * (x + shifter) ** (1.0 - rho) / (1.0 - rho)
+
+
+def pension_period(deposit_stage, consumption_stage, m, n, g_params):
+    """
+    Deposit and consumption choices of agents with cash on hand m and
+    pension balance n.
+
+    Consumption comes from the consumption stage at the post-deposit state,
+    or from the deposit stage at (m, n) for solutions that have no
+    consumption stage, such as those of the value function iteration.
+
+    Parameters
+    ----------
+    deposit_stage : DepositStage
+        Deposit stage of the period.
+    consumption_stage : ConsumptionStage
+        Consumption stage of the period.
+    m, n : np.ndarray
+        Cash on hand and pension balance.
+    g_params : tuple
+        (factor, CRRA, shifter) of the deposit function g.
+
+    Returns
+    -------
+    tuple of np.ndarray
+        Deposit d, consumption c, liquid savings a and pension savings b.
+    """
+    d = np.clip(deposit_stage.d_func(m, n), 0.0, m)
+    l_nrm = m - d
+    b = n + d + stone_geary(d, *g_params)
+
+    if isinstance(getattr(consumption_stage, "c_func", NullFunc()), NullFunc):
+        c = deposit_stage.c_func(m, n)
+    else:
+        c = consumption_stage.c_func(l_nrm, b)
+    c = np.clip(c, 0.0, l_nrm)
+
+    return d, c, l_nrm - c, b
+
+
+def period_solution(agent, t):
+    """
+    Solution of the agent in simulated period t, cycling through the
+    solutions of an infinite horizon agent.
+    """
+    if agent.cycles == 0:
+        return agent.solution[t % len(agent.solution)]
+
+    return agent.solution[t]
+
+
+def panel_periods(agent):
+    """
+    Number of periods of a solved agent's life, or T_sim if it is infinite.
+    """
+    if agent.cycles == 0:
+        return agent.T_sim
+
+    return len(agent.solution)
+
+
+def terminal_period(agent, t):
+    """
+    Whether t is the last period of a finite horizon agent, whose terminal
+    stages consume the pension account along with cash on hand.
+    """
+    return agent.cycles != 0 and t >= len(agent.solution) - 1
+
+
+def newborns(agent, size, rng, Rfree):
+    """
+    Initial state of size agents: log-normal assets as in HARK, with
+    aNrmInitMean and aNrmInitStd the mean and std of log assets, earning
+    Rfree plus a transitory shock of the first period as cash on hand; no
+    pension savings, unit permanent income and alive.
+    """
+    a_nrm = np.exp(rng.normal(agent.aNrmInitMean, agent.aNrmInitStd, size))
+    theta = draw_atoms(agent.TranShkDstn[0], size, rng)[0]
+
+    return {
+        "m": a_nrm * Rfree + theta,
+        "n": np.zeros(size),
+        "p": np.ones(size),
+        "alive": np.ones(size, dtype=bool),
+    }
+
+
+def mask_dead(outputs, alive):
+    return {name: np.where(alive, values, np.nan) for name, values in outputs.items()}
+
+
+def pension_transition(agent, t, state, rng, g_params):
+    """
+    One period of agents who deposit into a pension account with risky
+    returns: deposit, consume, then draw permanent, transitory and risky
+    return shocks and survival.
+    """
+    solution = period_solution(agent, t)
+    t_cycle = t % agent.T_cycle
+    m, n = state["m"], state["n"]
+
+    if terminal_period(agent, t):
+        # cash out the pension account and consume everything
+        d, a, b = np.zeros((3, m.size))
+        c = m + n
+    else:
+        d, c, a, b = pension_period(
+            solution.deposit_stage, solution.consumption_stage, m, n, g_params
+        )
+    outputs = {"m": m, "n": n, "d": d, "c": c, "a": a, "b": b, "p": state["p"]}
+    outputs = mask_dead(outputs, state["alive"])
+
+    psi, theta, risky = draw_atoms(agent.ShockDstn[t_cycle], m.size, rng)
+    state["m"] = a * agent.Rfree / psi + theta
+    state["n"] = b * risky / psi
+    state["p"] = state["p"] * psi
+    state["alive"] &= rng.random(m.size) < agent.LivPrb[t_cycle]
+
+    return outputs
+
+
+class PanelMoments:
+    """
+    Number of observations, mean and standard deviation of each variable of a
+    panel in each period, accumulated one chunk of agents at a time. NaN marks
+    a variable that does not apply to an agent, e.g. deposits of retirees or
+    anything after death, and is left out.
+
+    Each chunk's count, mean and sum of squared deviations are merged into
+    the running ones with the parallel update of Chan, Golub and LeVeque,
+    which does not lose precision when the mean is large relative to the
+    standard deviation as sums of squares do.
+
+    Parameters
+    ----------
+    periods : int
+        Number of simulated periods.
+    """
+
+    def __init__(self, periods):
+        self.periods = periods
+        self.sums = {}
+        self.paths = {}
+
+    def update(self, t, name, values):
+        if name not in self.sums:
+            self.sums[name] = np.zeros((3, self.periods))
+
+        values = values[np.isfinite(values)]
+        if values.size == 0:
+            return
+
+        count_b = values.size
+        mean_b = values.mean()
+        m2_b = np.square(values - mean_b).sum()
+
+        count_a, mean_a, m2_a = self.sums[name][:, t]
+        count = count_a + count_b
+        delta = mean_b - mean_a
+        self.sums[name][:, t] = (
+            count,
+            mean_a + delta * count_b / count,
+            m2_a + m2_b + delta**2 * count_a * count_b / count,
+        )
+
+    def count(self, name):
+        return self.sums[name][0]
+
+    def mean(self, name):
+        count, mean, _ = self.sums[name]
+
+        return np.where(count > 0, mean, np.nan)
+
+    def std(self, name):
+        count, _, m2 = self.sums[name]
+        with np.errstate(invalid="ignore", divide="ignore"):
+            return np.sqrt(m2 / count)
+
+    def as_dict(self):
+        return {
+            name: {
+                "count": self.count(name),
+                "mean": self.mean(name),
+                "std": self.std(name),
+            }
+            for name in self.sums
+        }
+
+
+def simulate_panel(agent, agents, periods, chunk=100_000, seed=0, directory=None):
+    """
+    Simulate a panel of agents of one type, one chunk of agents at a time.
+
+    Parameters
+    ----------
+    agent : AgentType
+        Solved agent type with `initialize_panel` and `panel_transition`.
+    agents : int
+        Number of agents in the panel.
+    periods : int
+        Number of periods to simulate.
+    chunk : int
+        Number of agents simulated at once.
+    seed : int
+        Seed of the random draws. Each chunk has its own stream, so a panel
+        is reproducible for a given seed and chunk size.
+    directory : str, optional
+        If given, the history of each variable is written there as an
+        (agents, periods) array in `<variable>.npy`.
+
+    Returns
+    -------
+    PanelMoments
+        Per period moments of each variable, with the paths of the history
+        files in `paths`.
+    """
+    moments = PanelMoments(periods)
+    histories = {}
+    if directory is not None:
+        os.makedirs(directory, exist_ok=True)
+
+    for start in range(0, agents, chunk):
+        size = min(chunk, agents - start)
+        rng = np.random.default_rng([seed, start])
+        state = agent.initialize_panel(size, rng)
+        buffers = {}
+
+        for t in range(periods):
+            for name, values in agent.panel_transition(t, state, rng).items():
+                values = np.broadcast_to(np.asarray(values, dtype=float), (size,))
+                moments.update(t, name, values)
+
+                if directory is not None:
+                    if name not in buffers:
+                        buffers[name] = np.full((size, periods), np.nan)
+                    buffers[name][:, t] = values
+
+        # write whole rows of the chunk at once, the files are row major
+        for name, buffer in buffers.items():
+            if name not in histories:
+                path = os.path.join(directory, name + ".npy")
+                histories[name] = open_memmap(
+                    path, mode="w+", dtype=float, shape=(agents, periods)
+                )
+                moments.paths[name] = path
+            histories[name][start : start + size] = buffer
+
+    for history in histories.values():
+        history.flush()
+
+    return moments
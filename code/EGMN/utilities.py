@@ -1,7 +1,15 @@
+import hashlib
+import os
+import pickle
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
 import matplotlib.pyplot as plt
 import numpy as np
-from HARK.interpolation import LinearInterp, LinearInterpOnInterp1D
+from interpolators import WarpedInterpOnInterp1D
 from matplotlib import rcParams
+from numba_backend import pens_func
+from scipy.optimize import minimize_scalar
 
 rcParams.update({"figure.autolayout": True})
 
@@ -148,10 +156,437 @@ def plot_scatter_hist(x, y, color, title, xlabel, ylabel, filename):
 
 
 def interp_on_interp(values, grids):
-    temp = []
     x, y = grids
-    grid = y[0]
-    for i in range(grid.size):
-        temp.append(LinearInterp(x[:, i], values[:, i]))
 
-    return LinearInterpOnInterp1D(temp, grid)
+    return WarpedInterpOnInterp1D(values, x, y[0])
+
+
+def solve_foc(foc, lo, hi, args=(), x0=None, tol=1e-10, max_iter=50, step=1e-7):
+    """
+    Maximize a concave objective on [lo, hi] elementwise, given its derivative.
+
+    Corners are detected from the sign of the derivative at the bounds, and
+    interior solutions are found with Newton steps on a finite-difference
+    slope, falling back to bisection of the bracket whenever a step leaves
+    it, so that every point converges. Only points that have not converged
+    yet are evaluated.
+
+    Parameters
+    ----------
+    foc : callable
+        Derivative of the objective, foc(x, *args) on flat arrays.
+    lo, hi : np.ndarray
+        Bounds of the choice, lo <= hi.
+    args : tuple of np.ndarray
+        Other arguments of foc, broadcastable to the shape of the bounds.
+    x0 : np.ndarray, optional
+        Initial guess, the middle of the bounds if None.
+    tol : float
+        Tolerance on the step and on the width of the bracket.
+    max_iter : int
+        Maximum number of iterations.
+    step : float
+        Relative step of the finite-difference slope.
+
+    Returns
+    -------
+    x : np.ndarray
+        Maximizers, in the shape of the bounds.
+    stats : dict
+        Number of "iterations", of points solved at a "corner" and of
+        points left "unconverged" after max_iter iterations.
+    """
+    lo, hi, *args = np.broadcast_arrays(lo, hi, *args)
+    shape = lo.shape
+    lo = lo.astype(float).ravel()
+    hi = hi.astype(float).ravel()
+    args = [arg.ravel() for arg in args]
+
+    f_lo = foc(lo, *args)
+    f_hi = foc(hi, *args)
+    x = np.where(f_lo <= 0.0, lo, hi)
+    active = np.flatnonzero((f_lo > 0.0) & (f_hi < 0.0))
+
+    guess = 0.5 * (lo + hi) if x0 is None else np.clip(np.ravel(x0), lo, hi)
+    x[active] = guess[active]
+
+    stats = {"iterations": 0, "corner": x.size - active.size}
+    while active.size > 0 and stats["iterations"] < max_iter:
+        stats["iterations"] += 1
+        x_now = x[active]
+        args_now = [arg[active] for arg in args]
+
+        # shrink the bracket around the root
+        f_now = foc(x_now, *args_now)
+        lo[active] = np.where(f_now > 0.0, x_now, lo[active])
+        hi[active] = np.where(f_now > 0.0, hi[active], x_now)
+
+        h = step * np.maximum(1.0, np.abs(x_now))
+        h = np.where(x_now + h > hi[active], -h, h)
+        slope = (foc(x_now + h, *args_now) - f_now) / h
+
+        # x_now has just become an end of the bracket, so test a newton step
+        # for convergence before the safeguard, and take it if it stays in
+        # the bracket, ends included; bisection otherwise
+        with np.errstate(divide="ignore", invalid="ignore"):
+            x_newton = x_now - f_now / slope
+        converged = (f_now == 0.0) | ((slope < 0.0) & (np.abs(x_newton - x_now) < tol))
+        newton = (slope < 0.0) & (x_newton >= lo[active]) & (x_newton <= hi[active])
+        x_new = np.where(newton | converged, x_newton, 0.5 * (lo[active] + hi[active]))
+        x_new = np.where(f_now == 0.0, x_now, np.clip(x_new, lo[active], hi[active]))
+
+        done = converged | (hi[active] - lo[active] < tol)
+        x[active] = x_new
+        active = active[~done]
+
+    stats["unconverged"] = active.size
+
+    return x.reshape(shape), stats
+
+
+def maximize_deposit(v_func, g_pars, m, n, d0=None, tol=1e-10, width=0.05):
+    """
+    Maximize v_func(m - d, n + d + g(d)) over d in [0, m] point by point with
+    a bounded scalar search, as a reference for the deposit stage.
+
+    With an initial guess d0, each search is restricted to a window of
+    width * m around it, and repeated on all of [0, m] only if the optimum
+    lands on an edge of the window that is not a bound.
+
+    Parameters
+    ----------
+    v_func : callable
+        Value function of the consumption stage.
+    g_pars : tuple
+        (factor, CRRA, shifter) of the Stone-Geary tax deduction function g.
+    m, n : np.array
+        Flat arrays of the points to solve.
+    d0 : np.array, optional
+        Initial guess of the deposits.
+    tol : float
+        Tolerance on d.
+    width : float
+        Width of the search window around d0, relative to m.
+
+    Returns
+    -------
+    d : np.array
+        Optimal deposits.
+    stats : dict
+        Number of "iterations" and "evaluations" of the searches, and of
+        "restarts" on [0, m] and "unconverged" searches.
+    """
+    factor, g_rho, shifter = g_pars
+
+    def value(d_nrm, m_nrm, n_nrm):
+        b_nrm = n_nrm + d_nrm + pens_func(d_nrm, factor, g_rho, shifter)
+        return v_func(m_nrm - d_nrm, b_nrm)
+
+    def search(lo, hi, i):
+        res = minimize_scalar(
+            lambda d_nrm: -value(d_nrm, m[i], n[i]),
+            bounds=(lo, hi),
+            method="bounded",
+            options={"xatol": tol},
+        )
+        stats["iterations"] += res.nit
+        stats["evaluations"] += res.nfev
+        stats["unconverged"] += not res.success
+        return res.x
+
+    stats = {"iterations": 0, "evaluations": 0, "restarts": 0, "unconverged": 0}
+    d = np.empty(m.size)
+    for i in range(m.size):
+        if d0 is None:
+            d_now = search(0.0, m[i], i)
+        else:
+            lo = max(d0[i] - 0.5 * width * m[i], 0.0)
+            hi = min(d0[i] + 0.5 * width * m[i], m[i])
+            d_now = search(lo, hi, i)
+            # the guess was off if the optimum is pressed against the window
+            edge = 10 * tol + 1e-6 * (hi - lo)
+            if (lo > 0.0 and d_now - lo < edge) or (hi < m[i] and hi - d_now < edge):
+                stats["restarts"] += 1
+                d_now = search(0.0, m[i], i)
+
+        # the bounded search never evaluates the bounds themselves
+        candidates = np.array([d_now, 0.0, m[i]])
+        d[i] = candidates[np.argmax(value(candidates, m[i], n[i]))]
+
+    return d, stats
+
+
+def log_sum_choice(values, sigma):
+    """
+    Expected value and choice probabilities of a discrete choice with
+    extreme value taste shocks of scale sigma.
+
+    The values are shifted by their maximum before exponentiating, so
+    large values or a small sigma do not overflow. The probabilities
+    overwrite values to save allocating a second stack.
+
+    Parameters
+    ----------
+    values : np.ndarray
+        Value of each choice, stacked along the first axis. Overwritten.
+    sigma : float
+        Scale of the taste shocks, 0 for a deterministic choice.
+
+    Returns
+    -------
+    tuple
+        Log-sum value with the shape of a single choice, and values holding
+        the probability of each choice.
+    """
+    v_max = values.max(axis=0)
+
+    if sigma == 0.0:
+        best = values.argmax(axis=0)
+        values[...] = np.arange(values.shape[0]).reshape((-1,) + best.ndim * (1,))
+        np.equal(values, best, out=values)
+        return v_max, values
+
+    # where every choice is worth -inf keep them at -inf, not nan
+    shift = np.where(np.isfinite(v_max), v_max, 0.0)
+    values -= shift
+    values /= sigma
+    np.exp(values, out=values)
+    total = values.sum(axis=0)
+
+    # with every choice worth -inf the choice is arbitrary, split it evenly
+    empty = total == 0.0
+    total[empty] = values.shape[0]
+    values[:, empty] = 1.0
+    values /= total
+
+    with np.errstate(divide="ignore"):
+        log_sum = shift + sigma * np.log(np.where(empty, 0.0, total))
+
+    return log_sum, values
+
+
+def map_blocks(func, blocks, workers=1, pool="process"):
+    """
+    Apply func to each tuple of arguments in blocks, in a pool of workers.
+
+    Parameters
+    ----------
+    func : callable
+        Picklable function if pool is "process".
+    blocks : list of tuple
+        Arguments of each call.
+    workers : int
+        Number of workers, the calls run in this process if 1.
+    pool : str
+        "process" or "thread".
+
+    Returns
+    -------
+    list
+        Results in the order of blocks.
+    """
+    if workers == 1:
+        return [func(*block) for block in blocks]
+
+    executors = {"process": ProcessPoolExecutor, "thread": ThreadPoolExecutor}
+    if pool not in executors:
+        raise ValueError(f"Unknown pool {pool!r}, expected one of {list(executors)}.")
+
+    with executors[pool](max_workers=workers) as executor:
+        return list(executor.map(func, *zip(*blocks)))
+
+
+def maximize_simplex(
+    value, m, args=(), x0=None, count=20, tol=1e-8, max_iter=200, chunk=2**21
+):
+    """
+    Maximize value(c, d, m, *args) over c, d >= 0 with c + d <= m, elementwise.
+
+    The choice is parametrized by the share s = (c + d) / m of m that is
+    spent and the share q = d / (c + d) of it that is deposited, both in
+    [0, 1]. A coarse grid search over (s, q) finds the global region of each
+    maximum, and a compass search polishes all points at once, halving its
+    step wherever no neighbor improves on the current point. An initial
+    guess of the controls replaces the grid search, and the polish then
+    starts from a step 16 times smaller.
+
+    Parameters
+    ----------
+    value : callable
+        Objective, value(c, d, m, *args) on arrays of equal shape; nan is
+        treated as infeasible.
+    m : np.ndarray
+        Resources of each problem.
+    args : tuple of np.ndarray
+        Other arguments of value, broadcastable to the shape of m.
+    x0 : tuple of np.ndarray, optional
+        Initial guess (c, d), broadcastable to the shape of m.
+    count : int
+        Number of coarse grid points of each share, which also sets the
+        initial step of the polish.
+    tol : float
+        Step size, in shares, at which the polish stops.
+    max_iter : int
+        Maximum number of polish iterations.
+    chunk : int
+        Maximum number of points evaluated at once in the grid search.
+
+    Returns
+    -------
+    c, d, v : np.ndarray
+        Optimal controls and value, in the shape of m.
+    stats : dict
+        Number of polish "iterations", total number of value "evaluations"
+        over all points, as in `maximize_deposit`, and number of points left
+        "unconverged" after max_iter iterations.
+    """
+    m, *args = np.broadcast_arrays(m, *args)
+    shape = m.shape
+    m = m.astype(float).ravel()
+    args = [arg.ravel() for arg in args]
+
+    def evaluate(s, q, idx):
+        # s and q have shape (points, candidates) for the points in idx
+        m_now = np.broadcast_to(m[idx, None], s.shape)
+        c = s * m_now * (1.0 - q)
+        d = s * m_now * q
+        args_now = [np.broadcast_to(arg[idx, None], s.shape) for arg in args]
+        with np.errstate(all="ignore"):
+            v = value(c, d, m_now, *args_now)
+        return np.where(np.isnan(v), -np.inf, v)
+
+    share = np.linspace(0.0, 1.0, count)
+    step = np.full(m.size, share[1])
+    stats = {"iterations": 0, "evaluations": 0}
+
+    if x0 is not None:
+        # a. shares of the initial guess
+        c0, d0 = (np.broadcast_to(x, shape).ravel() for x in x0)
+        with np.errstate(all="ignore"):
+            s_opt = np.nan_to_num(np.clip((c0 + d0) / m, 0.0, 1.0))
+            q_opt = np.nan_to_num(np.clip(d0 / (c0 + d0), 0.0, 1.0))
+        step /= 16
+    else:
+        # a. coarse grid search
+        S, Q = (grid.ravel() for grid in np.meshgrid(share, share, indexing="ij"))
+        s_opt = np.empty(m.size)
+        q_opt = np.empty(m.size)
+        rows = max(1, chunk // S.size)
+        for start in range(0, m.size, rows):
+            idx = np.arange(start, min(start + rows, m.size))
+            v = evaluate(np.tile(S, (idx.size, 1)), np.tile(Q, (idx.size, 1)), idx)
+            best = np.argmax(v, axis=1)
+            s_opt[idx] = S[best]
+            q_opt[idx] = Q[best]
+        stats["evaluations"] += S.size * m.size
+
+    # b. compass search, one stencil of 9 candidates per point
+    ds, dq = (grid.ravel() for grid in np.meshgrid([0, -1, 1], [0, -1, 1]))
+    active = np.arange(m.size)
+    while active.size > 0 and stats["iterations"] < max_iter:
+        stats["iterations"] += 1
+        stats["evaluations"] += ds.size * active.size
+        s = np.clip(s_opt[active, None] + ds * step[active, None], 0.0, 1.0)
+        q = np.clip(q_opt[active, None] + dq * step[active, None], 0.0, 1.0)
+        best = np.argmax(evaluate(s, q, active), axis=1)
+
+        rows = np.arange(active.size)
+        s_opt[active] = s[rows, best]
+        q_opt[active] = q[rows, best]
+        step[active] = np.where(best == 0, 0.5 * step[active], step[active])
+        active = active[step[active] > tol]
+    stats["unconverged"] = active.size
+
+    s_opt = s_opt[:, None]
+    q_opt = q_opt[:, None]
+    v = evaluate(s_opt, q_opt, np.arange(m.size))[:, 0]
+    c = s_opt[:, 0] * m * (1.0 - q_opt[:, 0])
+    d = s_opt[:, 0] * m * q_opt[:, 0]
+
+    return c.reshape(shape), d.reshape(shape), v.reshape(shape), stats
+
+
+class SolutionCache:
+    """
+    Least recently used cache of solutions, keyed by a hash of everything
+    the solution depends on, including the class of the solution when
+    several models share a cache. Entries can also be pickled to a
+    directory so that separate runs share them.
+
+    Parameters
+    ----------
+    maxsize : int
+        Number of solutions kept in memory.
+    """
+
+    def __init__(self, maxsize=256):
+        self.maxsize = maxsize
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def make_key(*parts):
+        """
+        Hash parts (numbers, strings or arrays) into a key.
+        """
+        digest = hashlib.sha1()
+        for part in parts:
+            if isinstance(part, np.ndarray):
+                digest.update(repr((part.dtype.str, part.shape)).encode())
+                digest.update(np.ascontiguousarray(part).tobytes())
+            else:
+                digest.update(repr(part).encode())
+
+        return digest.hexdigest()
+
+    def get(self, key, directory=None):
+        """
+        Solution stored under key, from memory or else from directory,
+        or None if there is none.
+        """
+        if key in self.entries:
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return self.entries[key]
+
+        path = None if directory is None else os.path.join(directory, key + ".pkl")
+        if path is not None and os.path.exists(path):
+            with open(path, "rb") as file:
+                value = pickle.load(file)
+            self.store(key, value)
+            self.hits += 1
+            return value
+
+        self.misses += 1
+        return None
+
+    def put(self, key, value, directory=None):
+        """
+        Store value under key in memory and, if given, in directory.
+        """
+        self.store(key, value)
+
+        if directory is not None:
+            os.makedirs(directory, exist_ok=True)
+            path = os.path.join(directory, key + ".pkl")
+            # write then rename so concurrent runs never read half a file
+            temp = f"{path}.{os.getpid()}.tmp"
+            with open(temp, "wb") as file:
+                pickle.dump(value, file)
+            os.replace(temp, path)
+
+    def store(self, key, value):
+        self.entries[key] = value
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.maxsize:
+            self.entries.popitem(last=False)
+
+    def clear(self):
+        self.entries.clear()
+        self.hits = 0
+        self.misses = 0
+
+
+# retired-phase solutions shared by every agent in this process
+retired_cache = SolutionCache()
@@ -58,6 +58,8 @@ class G2EGMModelClass(ModelClass):
             "Nb_con",
             "Neta",
             "eulerK",
+            "simN",
+            "sim_seed",
             "egm_extrap_add",
             "do_print",
         ]
@@ -103,6 +105,16 @@ class G2EGMModelClass(ModelClass):
 
         # euler
         par.eulerK = 100
+        par.euler_m_min = 0.50
+        par.euler_m_max = 5.00
+        par.euler_n_min = 0.01
+        par.euler_n_max = 5.00
+
+        # simulation, simN agents are allocated by simulate() when needed
+        par.simN = 0
+        par.sim_seed = 1998
+        par.m_ini = 1.0
+        par.n_ini = 0.0
 
         # misc
         par.solmethod = "G2EGM"
@@ -125,6 +137,7 @@ class G2EGMModelClass(ModelClass):
         self.sim.euler = np.full(
             (self.par.T - 1, self.par.eulerK, self.par.eulerK), np.nan
         )
+        self.sim_prep()
 
     def create_grids(self):
         """construct grids for states and shocks"""
@@ -308,6 +321,35 @@ class G2EGMModelClass(ModelClass):
             sol.c_pure_c = np.zeros((par.T, par.Nb_pd, par.Nm))
             sol.inv_v_pure_c = np.zeros((par.T, par.Nb_pd, par.Nm))
 
+    def sim_prep(self):
+        """allocate memory for simulation"""
+
+        par = self.par
+        sim = self.sim
+
+        # a. states and choices, nan where they do not apply (d and b when retired)
+        shape = (par.T, par.simN)
+        sim.m = np.full(shape, np.nan)
+        sim.n = np.full(shape, np.nan)
+        sim.c = np.full(shape, np.nan)
+        sim.d = np.full(shape, np.nan)
+        sim.a = np.full(shape, np.nan)
+        sim.b = np.full(shape, np.nan)
+        sim.retired = np.zeros(shape)
+
+        # b. shocks
+        sim.eta = np.ones(shape)
+
+    def draw_shocks(self):
+        """draw income shocks for the simulation"""
+
+        par = self.par
+        sim = self.sim
+
+        rng = np.random.default_rng(par.sim_seed)
+        i_eta = rng.choice(par.Neta, size=(par.T, par.simN), p=par.w_eta)
+        sim.eta[:, :] = par.eta[i_eta]
+
     def solve_G2EGM(self):
         """solve with G2EGM"""
 
@@ -474,12 +516,66 @@ class G2EGMModelClass(ModelClass):
                 if par.solmethod == "G2EGM":
                     print(f"t = {t}, wb: {np.sum(sol.wb[t, :, :]):.8f}")
 
-    def calculate_euler(self):
-        """calculate euler errors"""
+    def simulate(self):
+        """simulate a panel of agents"""
+
+        t0 = time.time()
+
+        # a panel is only allocated once it is simulated, also after simN changes
+        if self.sim.m.shape != (self.par.T, self.par.simN):
+            self.sim_prep()
+
+        self.draw_shocks()
 
         with jit(self) as model:
             par = model.par
             sol = model.sol
             sim = model.sim
 
-            simulate.euler(sim, sol, par)
+            simulate.simulate(sim, sol, par)
+
+        if self.par.do_print:
+            print(f"simulated {self.par.simN} agents in {time.time() - t0:.2f} secs")
+
+    def calculate_euler(self, m=None, n=None, simulated=False):
+        """calculate euler errors and return their mean, 95th percentile and max"""
+
+        # on the eulerK x eulerK grid into sim.euler by default, otherwise at
+        # points (m, n) of shape (T-1,N), or (N,) for the same in every period,
+        # or at the simulated states of working agents
+        par = self.par
+
+        if simulated:
+            working = self.sim.retired[:-1] == 0
+            m = np.where(working, self.sim.m[:-1], np.nan)
+            n = np.where(working, self.sim.n[:-1], np.nan)
+
+        if m is None:
+            with jit(self) as model:
+                simulate.euler(model.sim, model.sol, model.par)
+
+            errors = self.sim.euler
+
+        else:
+            m = np.atleast_1d(np.asarray(m, dtype=np.float64))
+            n = np.atleast_1d(np.asarray(n, dtype=np.float64))
+            for x in (m, n):
+                if x.ndim > 2 or (x.ndim == 2 and x.shape[0] != par.T - 1):
+                    raise ValueError(
+                        f"euler points must have shape (N,) or (T-1,N) = "
+                        f"({par.T - 1},N), not {x.shape}"
+                    )
+
+            shape = (par.T - 1, np.broadcast_shapes(m.shape[-1:], n.shape[-1:])[0])
+            m = np.ascontiguousarray(np.broadcast_to(m, shape), dtype=np.float64)
+            n = np.ascontiguousarray(np.broadcast_to(n, shape), dtype=np.float64)
+            errors = np.full(shape, np.nan)
+
+            with jit(self) as model:
+                simulate.euler_errors(model.sol, model.par, m, n, errors)
+
+        return {
+            "mean": np.nanmean(errors),
+            "p95": np.nanpercentile(errors, 95),
+            "max": np.nanmax(errors),
+        }
@@ -6,96 +6,180 @@ import utility
 
 # consav
 from consav import linear_interp  # for linear interpolation
-from numba import njit
-
-
-@njit
-def euler(sim, sol, par):
-    euler = sim.euler
-
-    # a. grids
-    min_m = 0.50
-    min_n = 0.01
-
-    m_max = 5.00
-    n_max = 5.00
-
-    n_grid = np.linspace(min_n, n_max, par.eulerK)
-    m_grid = np.linspace(min_m, m_max, par.eulerK)
-
-    # b. loop over time
-    for t in range(par.T - 1):
-        for i_n in range(par.eulerK):
-            for i_m in range(par.eulerK):
-                # i. states
-                n = n_grid[i_n]
-                m = m_grid[i_m]
-                m_retire = m_grid[i_m] + n_grid[i_n]
-
-                # ii. discrete choice
+from numba import njit, prange
+
+
+@njit(parallel=True)
+def simulate(sim, sol, par):
+    # bind the output arrays first, writes through the attributes of sim do
+    # not survive a parallel loop
+    sim_m = sim.m
+    sim_n = sim.n
+    sim_c = sim.c
+    sim_d = sim.d
+    sim_a = sim.a
+    sim_b = sim.b
+    sim_retired = sim.retired
+    sim_eta = sim.eta
+
+    # agents are independent given their shocks, so split them across threads;
+    # every cell is written, so nothing is left over from a previous run
+    for i in prange(par.simN):
+        m = par.m_ini
+        n = par.n_ini
+        retired = False
+
+        for t in range(par.T):
+            sim_m[t, i] = m
+            sim_n[t, i] = n
+
+            # a. discrete choice, retirement is absorbing
+            m_retire = m + n
+            if not retired:
                 inv_v_retire = linear_interp.interp_1d(
                     sol.m_ret[t], sol.inv_v_ret[t], m_retire
                 )
                 inv_v = linear_interp.interp_2d(
                     par.grid_n, par.grid_m, sol.inv_v[t], n, m
                 )
+                retired = inv_v_retire > inv_v
 
-                if inv_v_retire > inv_v:
-                    continue
+            # b. retired: cash out the pension account and consume out of it
+            if retired:
+                sim_retired[t, i] = 1.0
 
-                # iii. continuous choice
                 c = np.fmin(
-                    linear_interp.interp_2d(par.grid_n, par.grid_m, sol.c[t], n, m), m
-                )
-                d = np.fmax(
-                    linear_interp.interp_2d(par.grid_n, par.grid_m, sol.d[t], n, m), 0
+                    linear_interp.interp_1d(sol.m_ret[t], sol.c_ret[t], m_retire),
+                    m_retire,
                 )
-                a = m - c - d
-                b = n + d + pens.func(d, par)
-
-                if a < 0.001:
-                    continue
-
-                # iv. shocks
-                RHS = 0
-                for i_eta in range(par.Neta):
-                    # o. state variables
-                    n_plus = par.Rb * b
-                    m_plus = par.Ra * a + par.eta[i_eta]
-                    m_retire_plus = m_plus + n_plus
-
-                    # oo. discrete choice
-                    inv_v_retire = linear_interp.interp_1d(
-                        sol.m_ret[t + 1], sol.inv_v_ret[t + 1], m_retire_plus
-                    )
-                    inv_v = linear_interp.interp_2d(
-                        par.grid_n, par.grid_m, sol.inv_v[t + 1], n_plus, m_plus
-                    )
-
-                    # ooo. continous choice
-                    if inv_v_retire > inv_v:
-                        c_plus = np.fmin(
-                            linear_interp.interp_1d(
-                                sol.m_ret[t + 1], sol.c_ret[t + 1], m_retire_plus
-                            ),
-                            m_retire_plus,
-                        )
-                    else:
-                        c_plus = np.fmin(
-                            linear_interp.interp_2d(
-                                par.grid_n, par.grid_m, sol.c[t + 1], n_plus, m_plus
-                            ),
-                            m_plus,
-                        )
-
-                    # oooo. accumulate
-                    RHS += (
-                        par.w_eta[i_eta]
-                        * par.beta
-                        * par.Ra
-                        * utility.marg_func(c_plus, par)
-                    )
-
-                    # v. euler error
-                euler_raw = c - utility.inv_marg_func(RHS, par)
-                euler[t, i_m, i_n] = np.log10(np.abs(euler_raw / c) + 1e-16)
+                a = m_retire - c
+
+                sim_c[t, i] = c
+                sim_d[t, i] = np.nan
+                sim_a[t, i] = a
+                sim_b[t, i] = np.nan
+
+                m = par.Ra * a + par.yret
+                n = 0.0
+                continue
+
+            # c. working: continuous choice
+            c = np.fmin(
+                linear_interp.interp_2d(par.grid_n, par.grid_m, sol.c[t], n, m), m
+            )
+            d = np.fmax(
+                linear_interp.interp_2d(par.grid_n, par.grid_m, sol.d[t], n, m), 0
+            )
+            d = np.fmin(d, m - c)
+            a = m - c - d
+            b = n + d + pens.func(d, par)
+
+            sim_retired[t, i] = 0.0
+            sim_c[t, i] = c
+            sim_d[t, i] = d
+            sim_a[t, i] = a
+            sim_b[t, i] = b
+
+            # d. next period states
+            m = par.Ra * a + sim_eta[t, i]
+            n = par.Rb * b
+
+
+@njit
+def euler_error(t, m, n, sol, par):
+    # log10 relative euler error of a worker at (m, n) in period t, nan where
+    # the agent retires, is (near) constrained or the point is missing
+    if np.isnan(m) or np.isnan(n):
+        return np.nan
+
+    # a. discrete choice
+    m_retire = m + n
+    inv_v_retire = linear_interp.interp_1d(sol.m_ret[t], sol.inv_v_ret[t], m_retire)
+    inv_v = linear_interp.interp_2d(par.grid_n, par.grid_m, sol.inv_v[t], n, m)
+
+    if inv_v_retire > inv_v:
+        return np.nan
+
+    # b. continuous choice
+    c = np.fmin(linear_interp.interp_2d(par.grid_n, par.grid_m, sol.c[t], n, m), m)
+    d = np.fmax(linear_interp.interp_2d(par.grid_n, par.grid_m, sol.d[t], n, m), 0)
+    a = m - c - d
+    b = n + d + pens.func(d, par)
+
+    if a < 0.001:
+        return np.nan
+
+    # c. shocks
+    RHS = 0
+    for i_eta in range(par.Neta):
+        # i. state variables
+        n_plus = par.Rb * b
+        m_plus = par.Ra * a + par.eta[i_eta]
+        m_retire_plus = m_plus + n_plus
+
+        # ii. discrete choice
+        inv_v_retire = linear_interp.interp_1d(
+            sol.m_ret[t + 1], sol.inv_v_ret[t + 1], m_retire_plus
+        )
+        inv_v = linear_interp.interp_2d(
+            par.grid_n, par.grid_m, sol.inv_v[t + 1], n_plus, m_plus
+        )
+
+        # iii. continous choice
+        if inv_v_retire > inv_v:
+            c_plus = np.fmin(
+                linear_interp.interp_1d(
+                    sol.m_ret[t + 1], sol.c_ret[t + 1], m_retire_plus
+                ),
+                m_retire_plus,
+            )
+        else:
+            c_plus = np.fmin(
+                linear_interp.interp_2d(
+                    par.grid_n, par.grid_m, sol.c[t + 1], n_plus, m_plus
+                ),
+                m_plus,
+            )
+
+        # iv. accumulate
+        RHS += par.w_eta[i_eta] * par.beta * par.Ra * utility.marg_func(c_plus, par)
+
+    # d. euler error
+    euler_raw = c - utility.inv_marg_func(RHS, par)
+
+    return np.log10(np.abs(euler_raw / c) + 1e-16)
+
+
+@njit(parallel=True)
+def euler_errors(sol, par, m, n, out):
+    # m, n and out have shape (T - 1, number of points), so every period can
+    # have its own points, e.g. simulated states; all (t, point) pairs are
+    # independent and split across threads
+    Nt, Npoints = m.shape
+    for k in prange(Nt * Npoints):
+        t = k // Npoints
+        i = k % Npoints
+        out[t, i] = euler_error(t, m[t, i], n[t, i], sol, par)
+
+
+@njit
+def euler(sim, sol, par):
+    # a. grids
+    n_grid = np.linspace(par.euler_n_min, par.euler_n_max, par.eulerK)
+    m_grid = np.linspace(par.euler_m_min, par.euler_m_max, par.eulerK)
+
+    # b. the same (m, n) points in every period, m major as in sim.euler
+    Npoints = par.eulerK * par.eulerK
+    m = np.empty((par.T - 1, Npoints))
+    n = np.empty((par.T - 1, Npoints))
+    for t in range(par.T - 1):
+        for i_m in range(par.eulerK):
+            for i_n in range(par.eulerK):
+                m[t, i_m * par.eulerK + i_n] = m_grid[i_m]
+                n[t, i_m * par.eulerK + i_n] = n_grid[i_n]
+
+    # c. errors
+    out = np.empty((par.T - 1, Npoints))
+    euler_errors(sol, par, m, n, out)
+
+    sim.euler[:, :, :] = out.reshape((par.T - 1, par.eulerK, par.eulerK))